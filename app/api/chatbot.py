@@ -1,14 +1,62 @@
+import asyncio
+import os
+
+from contextvars import ContextVar
 from datetime import datetime
 from pydantic import BaseModel
-from typing import Dict
-
-from app.api.utils import get_coordinates_from_address, find_nearest_stop, verify_stop_exists
-from app.api.config import openai_client
-from app.api.trip import get_trip, TripRequestModel
-
-
-# Dictionnaire pour stocker les conversations en cours
-conversations: Dict[str, Dict] = {}
+from typing import AsyncIterator, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from app.api.config import base_db, openai_client
+from app.api.conversation_history import build_prompt_history, history_stats
+from app.api.extraction import extract_date_time, extract_stop, fast_path_stats
+from app.api.geocoding import get_coordinates_from_address_async
+from app.api.itinerary_renderer import render_itineraries
+from app.api.metrics import track_dependency, track_step
+from app.api.response_cache import RESPONSE_CACHE_WARMUP, response_cache, template_fields
+from app.api.session_store import run_session_store, session_store
+from app.api.utils import find_nearest_stop, format_event, verify_stop_exists
+from app.api.trip import get_trip_async, TripRequestModel
+
+
+# Mots fréquents propres à chaque langue, pour deviner la langue de l'utilisateur
+LANGUAGE_MARKERS = {
+    "fr": {"je", "de", "à", "vers", "pour", "demain", "aujourd'hui", "depuis", "aller", "veux", "le", "la"},
+    "de": {"ich", "nach", "von", "morgen", "heute", "um", "uhr", "möchte", "will", "der", "die", "das"},
+    "en": {"i", "to", "from", "tomorrow", "today", "at", "want", "go", "the", "please", "would"},
+}
+
+# Langue des réponses mises en cache, indiquée à GPT lorsqu'elles sont générées hors conversation
+LANGUAGE_NAMES = {"fr": "français", "de": "allemand", "en": "anglais"}
+
+# Phrase d'introduction rédigée par GPT avant les itinéraires (mis en forme localement) : "on" ou "off"
+ITINERARY_INTRO = os.getenv("CHATBOT_ITINERARY_INTRO", "off") == "on"
+
+# Prompts des réponses qui ne dépendent que de quelques paramètres (nom d'arrêt, date, heure) : leurs réponses
+# sont mises en cache et générées au démarrage, sans appel à GPT pendant la conversation
+CANNED_PROMPTS = {
+    "farewell": "Merci pour votre visite. N'hésitez pas à relancer une demande de planification de voyage si vous avez besoin d'aide. À bientôt ! 👋",
+    "destination_selected": "L'utilisateur a mentionné {stop} comme destination. Formule une réponse pour informer que l'arrêt est sélectionné et enchainer la suite de la conversation avec le point de départ.",
+    "destination_nearest": "L'utilisateur a mentionné {place} comme destination. Je n'ai pas trouvé l'arrêt exact directement, mais j'ai trouvé l'arrêt le plus proche: {stop} grâce à une recherche des coordonnées. Formule une réponse pour informer que l'arrêt est sélectionné et enchainer la suite de la conversation avec le point de départ.",
+    "destination_not_found_nearby": "La destination mentionnée par l'utilisateur n'a pas été trouvée malgré une recherche des coordonnées. Demande-lui de préciser, d'utiliser la bulle de chat pour trouver l'arrêt exact ou de réessayer avec un autre arrêt.",
+    "destination_not_found": "L'utilisateur a mentionné une destination que je n'ai pas trouvée. Demande-lui de préciser, d'utiliser la bulle de chat pour trouver l'arrêt exact ou de réessayer avec un autre arrêt.",
+    "destination_not_extracted": "L'utilisateur a mentionné une destination que je n'ai pas trouvée. Demande-lui de préciser ou de réessayer avec un autre arrêt pour la destination afin de continuer.",
+    "origin_selected": "L'utilisateur a mentionné {stop} comme point de départ. Formule une réponse pour informer que l'arrêt est sélectionné et demander la date et l'heure.",
+    "origin_nearest": "L'utilisateur a mentionné {place} comme point de départ. Je n'ai pas trouvé l'arrêt exact directement, mais j'ai trouvé l'arrêt le plus proche: {stop} grâce à une recherche des coordonnées. Formule une réponse pour informer que l'arrêt est sélectionné et demander la date et l'heure.",
+    "origin_not_found_nearby": "L'utilisateur a mentionné un arrêt de départ que je n'ai pas trouvé malgré une recherche des coordonnées. Demande-lui de préciser, d'utiliser la bulle de chat pour trouver l'arrêt exact ou de réessayer avec un autre arrêt.",
+    "origin_not_found": "L'utilisateur a mentionné un arrêt de départ que je n'ai pas trouvé. Demande-lui de préciser, d'utiliser la bulle de chat pour trouver l'arrêt exact ou de réessayer avec un autre arrêt.",
+    "origin_not_extracted": "L'utilisateur a mentionné un arrêt de départ que je n'ai pas trouvé. Demande-lui de préciser ou de réessayer avec un autre arrêt.",
+    "date_time_selected": "L'utilisateur a spécifié la date {date} et l'heure {time}. Faire un petit récapitulatif et dire si l'utilisateur est d'accord pour lancer la recherche.",
+    "date_selected": "L'utilisateur a spécifié la date {date}. Veuillez demander maintenant l'heure exacte de départ.",
+    "date_invalid": "Je n'ai pas compris la date. Pouvez-vous reformuler, s'il vous plaît ?",
+    "time_selected": "L'utilisateur a spécifié l'heure {time}. Veuillez demander maintenant la date exacte.",
+    "time_invalid": "Je n'ai pas compris l'heure. Pouvez-vous reformuler, s'il vous plaît ?",
+    "date_time_invalid": "Je n'ai pas bien compris la date ou l'heure. Pouvez-vous reformuler, s'il vous plaît ?",
+}
+
+# File des fragments de réponse à transmettre au client pendant une requête /ask/stream (None sinon)
+response_stream: ContextVar[Optional[asyncio.Queue]] = ContextVar("response_stream", default=None)
 
 
 class UserQuery(BaseModel):
@@ -17,13 +65,14 @@ class UserQuery(BaseModel):
     '''
     query: str
     session_id: str
+    language: Optional[str] = None  # Langue du navigateur ("fr", "de", "en"), pour la mise en forme des itinéraires
 
 
-def initialize_conversation(session_id: str):
+def initialize_conversation():
     """
     Initialise une nouvelle conversation avec un message de bienvenue
     """
-    conversations[session_id] = {
+    return {
         "steps": {
             "origin": None,
             "destination": None,
@@ -37,127 +86,271 @@ def initialize_conversation(session_id: str):
     }
 
 
-def generate_response(conversation_history, prompt, max_tokens=150):
+async def complete(conversation_history, prompt, max_tokens=150):
     """
-    Génère une réponse en utilisant GPT
+    Génère une réponse complète en utilisant GPT (extraction d'informations ou réponse non diffusée)
     """
-    gpt_response = openai_client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=conversation_history + [{"role": "user", "content": prompt}],
-        max_tokens=max_tokens,
-        temperature=0.7
-    )
+    with track_dependency("openai", "chat.completions"):
+        gpt_response = await openai_client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=conversation_history + [{"role": "user", "content": prompt}],
+            max_tokens=max_tokens,
+            temperature=0.7
+        )
+    history_stats.record_usage(gpt_response.usage)
     return gpt_response.choices[0].message.content.strip()
 
 
-def handle_conversation_steps(user_input, steps, conversation_history):
+async def generate_response(conversation_history, prompt, max_tokens=150):
+    """
+    Génère la réponse destinée à l'utilisateur en utilisant GPT. Pendant une requête /ask/stream,
+    les fragments sont transmis au client au fur et à mesure de leur arrivée
+    """
+    stream = response_stream.get()
+    if stream is None:
+        return await complete(conversation_history, prompt, max_tokens)
+
+    # Une réponse déjà diffusée pendant ce tour (ex. récapitulatif avant la recherche) est remplacée
+    await stream.put(("reset", None))
+    chunks = []
+    with track_dependency("openai", "chat.completions.stream"):
+        gpt_stream = await openai_client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=conversation_history + [{"role": "user", "content": prompt}],
+            max_tokens=max_tokens,
+            temperature=0.7,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        async for chunk in gpt_stream:
+            # Le dernier fragment ne contient que la consommation de tokens de l'appel
+            history_stats.record_usage(chunk.usage)
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                chunks.append(delta)
+                await stream.put(("token", delta))
+    return "".join(chunks).strip()
+
+
+def neutral_history(language):
+    """
+    Historique sans aucun message de l'utilisateur, pour générer des réponses partagées entre les conversations
+    """
+    return [{"role": "system", "content": f"Réponds en {LANGUAGE_NAMES[language]}."}] + initialize_conversation()["conversation_history"]
+
+
+async def canned_response(conversation_history, name, **params):
+    """
+    Réponse à un prompt de CANNED_PROMPTS : une formulation en cache si possible, sinon générée par GPT
+    hors du contexte de la conversation (elle ne contient rien de propre à l'utilisateur) puis conservée
+    pour les prochaines conversations
+    """
+    # Les formulations générées au démarrage sont en français, comme le message de bienvenue
+    language = detect_language(conversation_history) or "fr"
+    reply = response_cache.get(name, language, params)
+    if reply is None:
+        reply = await generate_response(neutral_history(language), CANNED_PROMPTS[name].format(**params))
+        response_cache.add(name, language, params, reply)
+        return reply
+
+    stream = response_stream.get()
+    if stream is not None:
+        await stream.put(("reset", None))
+        await stream.put(("token", reply))
+    return reply
+
+
+async def warm_up_response_cache():
+    """
+    Charger les formulations de chaque réponse de CANNED_PROMPTS enregistrées dans MongoDB, puis générer
+    au démarrage celles qui manquent, les paramètres étant laissés sous la forme {stop}, {date}, etc.
+    """
+    if not RESPONSE_CACHE_WARMUP:
+        return
+    conversation_history = neutral_history("fr")
+    try:
+        await run_in_threadpool(response_cache.load_templates, base_db.response_templates, CANNED_PROMPTS, "fr")
+    except Exception as e:
+        print(f"Erreur lors du chargement des réponses enregistrées : {e}")
+
+    async def generate(name, prompt):
+        missing = response_cache.missing_templates(name, "fr")
+        if missing <= 0:
+            return
+        fields = template_fields(prompt)
+        placeholders = {field: "{" + field + "}" for field in fields}
+        instruction = prompt.format(**placeholders)
+        if fields:
+            instruction += f" Écris {', '.join(placeholders.values())} tels quels, avec les accolades, à la place des valeurs."
+        for _ in range(missing):
+            reply = await complete(conversation_history, instruction)
+            response_cache.add_template(name, "fr", reply, set(fields))
+        await run_in_threadpool(response_cache.save_templates, base_db.response_templates, name, "fr", prompt)
+
+    results = await asyncio.gather(*(generate(name, prompt) for name, prompt in CANNED_PROMPTS.items()), return_exceptions=True)
+    for name, result in zip(CANNED_PROMPTS, results):
+        if isinstance(result, Exception):
+            print(f"Erreur lors de la génération des réponses '{name}' : {result}")
+
+
+async def handle_conversation_steps(user_input, steps, conversation_history):
     """
     Gère les différentes étapes de la conversation en fonction des informations fournies par l'utilisateur
     """
     if not steps["destination"] or steps["destination"] is None:
-        return process_destination_step(user_input, steps, conversation_history)
+        return await process_destination_step(user_input, steps, conversation_history)
 
     if not steps["origin"] or steps["origin"] is None:
-        return process_origin_step(user_input, steps, conversation_history)
+        return await process_origin_step(user_input, steps, conversation_history)
 
     if not steps["date"] or not steps["time"] or steps["date"] is None or steps["time"] is None:
-        return process_date_time_step(user_input, steps, conversation_history)
+        return await process_date_time_step(user_input, steps, conversation_history)
 
 
-def process_destination_step(user_input, steps, conversation_history):
+@track_step
+async def process_destination_step(user_input, steps, conversation_history):
     """
     Traite l'étape où l'utilisateur spécifie sa destination
     """
-    gpt_help = generate_response(conversation_history, f"L'utilisateur a surement mentionné une destination dans {user_input}. Met l'arret entre deux # pour l'extraire. Souvent, il y a le nom de la ville ou commune virgule puis l'arrêt : #Ville, Arrêt#. Apart ce qu'il y a entre les #, tu peux ignorer le reste. Si tu penses que c'est une adresse, un monument ou un lieu spécifique, tu mets le maximum d'informations pour trouver l'arrêt le plus proche (surtout la ville ou commune) sans oublier les # mais pas besoin de structure spécifique comme pour l'arret : #Ville, Arrêt#.")
+    # Extraction locale : un nom d'arrêt reconnu dans le message évite l'appel GPT d'extraction
+    stop_name = extract_stop(user_input, "destination")
+    if stop_name:
+        fast_path_stats.stop_hits += 1
+        steps["destination"] = stop_name
+        return await canned_response(conversation_history, "destination_selected", stop=stop_name)
+    fast_path_stats.misses += 1
+
+    gpt_help = await complete(conversation_history, f"L'utilisateur a surement mentionné une destination dans {user_input}. Met l'arret entre deux # pour l'extraire. Souvent, il y a le nom de la ville ou commune virgule puis l'arrêt : #Ville, Arrêt#. Apart ce qu'il y a entre les #, tu peux ignorer le reste. Si tu penses que c'est une adresse, un monument ou un lieu spécifique, tu mets le maximum d'informations pour trouver l'arrêt le plus proche (surtout la ville ou commune) sans oublier les # mais pas besoin de structure spécifique comme pour l'arret : #Ville, Arrêt#.")
     if "#" in gpt_help:
         stop_name = gpt_help.split("#")[1]
-        verified_stop = verify_stop_exists(stop_name)
+        verified_stop = await run_in_threadpool(verify_stop_exists, stop_name)
         if verified_stop:
             steps["destination"] = verified_stop
-            return generate_response(conversation_history, f"L'utilisateur a mentionné {verified_stop} comme destination. Formule une réponse pour informer que l'arrêt est sélectionné et enchainer la suite de la conversation avec le point de départ.")
+            return await canned_response(conversation_history, "destination_selected", stop=verified_stop)
         else:
-            coordinates = get_coordinates_from_address(stop_name)
+            coordinates = await get_coordinates_from_address_async(stop_name)
             if coordinates:
-                nearest_stop = find_nearest_stop(*coordinates)
+                nearest_stop = await run_in_threadpool(find_nearest_stop, *coordinates)
                 if nearest_stop is not None:
                     steps["destination"] = nearest_stop
-                    return generate_response(conversation_history, f"L'utilisateur a mentionné {stop_name} comme destination. Je n'ai pas trouvé l'arrêt exact directement, mais j'ai trouvé l'arrêt le plus proche: {nearest_stop} grâce à une recherche des coordonnées. Formule une réponse pour informer que l'arrêt est sélectionné et enchainer la suite de la conversation avec le point de départ.")
+                    return await canned_response(conversation_history, "destination_nearest", place=stop_name, stop=nearest_stop)
                 else:
-                    return generate_response(conversation_history, "La destination mentionnée par l'utilisateur n'a pas été trouvée malgré une recherche des coordonnées. Demande-lui de préciser, d'utiliser la bulle de chat pour trouver l'arrêt exact ou de réessayer avec un autre arrêt.")
+                    return await canned_response(conversation_history, "destination_not_found_nearby")
             else:
-                return generate_response(conversation_history, "L'utilisateur a mentionné une destination que je n'ai pas trouvée. Demande-lui de préciser, d'utiliser la bulle de chat pour trouver l'arrêt exact ou de réessayer avec un autre arrêt.")
+                return await canned_response(conversation_history, "destination_not_found")
     else:
-        return generate_response(conversation_history, "L'utilisateur a mentionné une destination que je n'ai pas trouvée. Demande-lui de préciser ou de réessayer avec un autre arrêt pour la destination afin de continuer.")
+        return await canned_response(conversation_history, "destination_not_extracted")
 
 
-def process_origin_step(user_input, steps, conversation_history):
+@track_step
+async def process_origin_step(user_input, steps, conversation_history):
     """
     Traite l'étape où l'utilisateur spécifie son point de départ
     """
-    gpt_help = generate_response(conversation_history, f"L'utilisateur a surement mentionné un point de départ dans {user_input}. Met l'arret entre deux # pour l'extraire. Souvent, il y a le nom de la ville ou commune virgule puis l'arrêt : #Ville, Arrêt#. Apart ce qu'il y a entre les #, tu peux ignorer le reste. Si tu penses que c'est une adresse, un monument ou un lieu spécifique, tu mets le maximum d'informations pour trouver l'arrêt le plus proche (surtout la ville ou commune) sans oublier les # mais pas besoin de structure spécifique comme pour l'arret : #Ville, Arrêt#.")
+    # Extraction locale : un nom d'arrêt reconnu dans le message évite l'appel GPT d'extraction
+    stop_name = extract_stop(user_input, "origin")
+    if stop_name:
+        fast_path_stats.stop_hits += 1
+        steps["origin"] = stop_name
+        return await canned_response(conversation_history, "origin_selected", stop=stop_name)
+    fast_path_stats.misses += 1
+
+    gpt_help = await complete(conversation_history, f"L'utilisateur a surement mentionné un point de départ dans {user_input}. Met l'arret entre deux # pour l'extraire. Souvent, il y a le nom de la ville ou commune virgule puis l'arrêt : #Ville, Arrêt#. Apart ce qu'il y a entre les #, tu peux ignorer le reste. Si tu penses que c'est une adresse, un monument ou un lieu spécifique, tu mets le maximum d'informations pour trouver l'arrêt le plus proche (surtout la ville ou commune) sans oublier les # mais pas besoin de structure spécifique comme pour l'arret : #Ville, Arrêt#.")
     if "#" in gpt_help:
         stop_name = gpt_help.split("#")[1]
-        verified_stop = verify_stop_exists(stop_name)
+        verified_stop = await run_in_threadpool(verify_stop_exists, stop_name)
         if verified_stop:
             steps["origin"] = verified_stop
-            return generate_response(conversation_history, f"L'utilisateur a mentionné {verified_stop} comme point de départ. Formule une réponse pour informer que l'arrêt est sélectionné et demander la date et l'heure.")
+            return await canned_response(conversation_history, "origin_selected", stop=verified_stop)
         else:
-            coordinates = get_coordinates_from_address(stop_name)
+            coordinates = await get_coordinates_from_address_async(stop_name)
             if coordinates:
-                nearest_stop = find_nearest_stop(*coordinates)
+                nearest_stop = await run_in_threadpool(find_nearest_stop, *coordinates)
                 if nearest_stop is not None:
                     steps["origin"] = nearest_stop
-                    return generate_response(conversation_history, f"L'utilisateur a mentionné {stop_name} comme point de départ. Je n'ai pas trouvé l'arrêt exact directement, mais j'ai trouvé l'arrêt le plus proche: {nearest_stop} grâce à une recherche des coordonnées. Formule une réponse pour informer que l'arrêt est sélectionné et demander la date et l'heure.")
+                    return await canned_response(conversation_history, "origin_nearest", place=stop_name, stop=nearest_stop)
                 else:
-                    return generate_response(conversation_history, "L'utilisateur a mentionné un arrêt de départ que je n'ai pas trouvé malgré une recherche des coordonnées. Demande-lui de préciser, d'utiliser la bulle de chat pour trouver l'arrêt exact ou de réessayer avec un autre arrêt.")
+                    return await canned_response(conversation_history, "origin_not_found_nearby")
             else:
-                return generate_response(conversation_history, "L'utilisateur a mentionné un arrêt de départ que je n'ai pas trouvé. Demande-lui de préciser, d'utiliser la bulle de chat pour trouver l'arrêt exact ou de réessayer avec un autre arrêt.")
+                return await canned_response(conversation_history, "origin_not_found")
     else:
-        return generate_response(conversation_history, "L'utilisateur a mentionné un arrêt de départ que je n'ai pas trouvé. Demande-lui de préciser ou de réessayer avec un autre arrêt.")
+        return await canned_response(conversation_history, "origin_not_extracted")
 
 
-def process_date_time_step(user_input, steps, conversation_history):
+@track_step
+async def process_date_time_step(user_input, steps, conversation_history):
     """
     Traite l'étape où l'utilisateur spécifie la date et l'heure
     """
-    gpt_help = generate_response(conversation_history, f"L'utilisateur a mentionné une date et une heure dans '{user_input}'. Pour information, la date du jour est {datetime.now().strftime('%Y-%m-%d')} et l'heure est {datetime.now().strftime('%H:%M:%S')}. Met la date entre deux # pour l'extraire et l'heure entre deux $. Tu peux écrire seulement la date et/ou l'heure, pas besoin d'autres informations. Le format de la date est 'YYYY-MM-DD' et l'heure 'HH:MM:SS'.")
+    # Extraction locale des dates et heures absolues ou relatives, GPT seulement si rien n'est reconnu
+    date_str, time_str = extract_date_time(user_input)
+    if date_str or time_str:
+        fast_path_stats.date_time_hits += 1
+    else:
+        fast_path_stats.misses += 1
+        gpt_help = await complete(conversation_history, f"L'utilisateur a mentionné une date et une heure dans '{user_input}'. Pour information, la date du jour est {datetime.now().strftime('%Y-%m-%d')} et l'heure est {datetime.now().strftime('%H:%M:%S')}. Met la date entre deux # pour l'extraire et l'heure entre deux $. Tu peux écrire seulement la date et/ou l'heure, pas besoin d'autres informations. Le format de la date est 'YYYY-MM-DD' et l'heure 'HH:MM:SS'.")
 
-    # Extraire date et heure selon les délimiteurs '#' et '$'
-    date_str = None
-    time_str = None
+        # Extraire date et heure selon les délimiteurs '#' et '$'
+        if "#" in gpt_help:
+            date_str = gpt_help.split("#")[1]
 
-    if "#" in gpt_help:
-        date_str = gpt_help.split("#")[1]
-
-    if "$" in gpt_help:
-        time_str = gpt_help.split("$")[1]
+        if "$" in gpt_help:
+            time_str = gpt_help.split("$")[1]
 
     if date_str and time_str:
         steps["date"] = date_str
         steps["time"] = time_str
-        return generate_response(conversation_history, f"L'utilisateur a spécifié la date {steps['date']} et l'heure {steps['time']}. Faire un petit récapitulatif et dire si l'utilisateur est d'accord pour lancer la recherche.")
+        return await canned_response(conversation_history, "date_time_selected", date=steps['date'], time=steps['time'])
 
     elif date_str:
         try:
             datetime.strptime(date_str, "%Y-%m-%d")
             steps["date"] = date_str
-            return generate_response(conversation_history, f"L'utilisateur a spécifié la date {steps['date']}. Veuillez demander maintenant l'heure exacte de départ.")
+            return await canned_response(conversation_history, "date_selected", date=steps['date'])
         except ValueError:
-            return generate_response(conversation_history, "Je n'ai pas compris la date. Pouvez-vous reformuler, s'il vous plaît ?")
+            return await canned_response(conversation_history, "date_invalid")
     elif time_str:
         try:
             datetime.strptime(time_str, "%H:%M:%S")
             steps["time"] = time_str
-            return generate_response(conversation_history, f"L'utilisateur a spécifié l'heure {steps['time']}. Veuillez demander maintenant la date exacte.")
+            return await canned_response(conversation_history, "time_selected", time=steps['time'])
         except ValueError:
-            return generate_response(conversation_history, "Je n'ai pas compris l'heure. Pouvez-vous reformuler, s'il vous plaît ?")
+            return await canned_response(conversation_history, "time_invalid")
     else:
-        return generate_response(conversation_history, "Je n'ai pas bien compris la date ou l'heure. Pouvez-vous reformuler, s'il vous plaît ?")
+        return await canned_response(conversation_history, "date_time_invalid")
+
+
+def detect_language(conversation_history):
+    """
+    Langue des messages de l'utilisateur, None si elle n'est pas reconnue (la langue du navigateur est alors utilisée)
+    """
+    words = " ".join(message["content"].lower() for message in conversation_history if message["role"] == "user").split()
+    scores = {
+        language: sum(word in markers for word in words)
+        for language, markers in LANGUAGE_MARKERS.items()
+    }
+    language = max(scores, key=scores.get)
+    return language if scores[language] else None
+
+
+def followed_trips(trips):
+    """
+    Courses des itinéraires proposés, que le client peut suivre en direct via /live
+    """
+    followed = {}
+    for trip in trips[:3]:
+        for leg in trip.legs:
+            key = leg.trip_id or leg.journey_ref
+            if key and key not in followed:
+                followed[key] = {"trip": key, "line": leg.line, "origin_name": leg.origin_name, "destination_name": leg.destination_name}
+    return list(followed.values())
 
 
-def process_trip_request(steps, session_id, conversation_history):
+@track_step
+async def process_trip_request(steps, session, conversation_history, language=None):
     """
-    Envoie une requête pour récupérer les détails du voyage et les formate
+    Envoie une requête pour récupérer les détails du voyage et les met en forme en Markdown.
+    Retourne la réponse et les courses à suivre en direct
     """
     trip_request_data = {
         "origin_name": steps['origin'],
@@ -166,18 +359,24 @@ def process_trip_request(steps, session_id, conversation_history):
         "time": steps['time']
     }
     trip_request = TripRequestModel(**trip_request_data)
-    response = get_trip(trip_request)
+    response = await get_trip_async(trip_request)
 
     if response.get("trip_details"):
-        trip_details = response["trip_details"]
-        gpt_reply = generate_response(
-            conversation_history,
-            f"Voici les détails du voyage récupérés: {trip_details}, il faut que l'affichage soit facile à lire pour l'utilisateur, donc formate en Markdown afin que ça soit propre (titre avec niveau, gras, italique, etc.). Propose 3 trajets maximum. Il est important de fournir des informations claires et précises pour le voyage demandé (heure de départ, heure d'arrivée, correspondances, etc.). Formule une réponse polie et engageante avec une suggestion pour un nouveau voyage. Dire que l'utilisateur peut demander une nouvelle recherche car c'est fini pour ce voyage.",
-            max_tokens=800
-        )
+        # Mise en forme locale des itinéraires, GPT ne rédige au plus qu'une phrase d'introduction
+        gpt_reply = render_itineraries(
+            response["trips"], detect_language(session["conversation_history"]) or language,
+            origin_name=steps['origin'], destination_name=steps['destination']
+        ) or "\n\n".join(response["trip_details"])
+        if ITINERARY_INTRO:
+            intro = await generate_response(
+                conversation_history,
+                f"Les itinéraires entre {steps['origin']} et {steps['destination']} ont été trouvés et seront affichés juste après ta réponse. Écris uniquement une courte phrase d'introduction polie, sans détailler les trajets.",
+                max_tokens=40
+            )
+            gpt_reply = f"{intro}\n\n{gpt_reply}"
 
         # Réinitialiser les étapes et l'historique de la conversation
-        conversations[session_id] = {
+        session.update({
             "steps": {
                 "origin": None,
                 "destination": None,
@@ -186,13 +385,14 @@ def process_trip_request(steps, session_id, conversation_history):
             },
             "conversation_history": [],
             "count_trip_details": 0
-        }
+        })
 
-        return gpt_reply
+        return gpt_reply, followed_trips(response.get("trips", []))
 
     else:
-        conversations[session_id]["count_trip_details"] += 1
-        return generate_response(conversation_history, f"Une erreur s'est produite lors de la récupération des détails du voyage. Demande à l'utilisateur s'il veut réessayer ou arrêter le processus. Reponse de la requete: {response.get('response')}.")
+        session["count_trip_details"] += 1
+        gpt_reply = await generate_response(conversation_history, f"Une erreur s'est produite lors de la récupération des détails du voyage. Demande à l'utilisateur s'il veut réessayer ou arrêter le processus. Reponse de la requete: {response.get('response')}.")
+        return gpt_reply, []
 
 
 async def ask_gpt(user_query: UserQuery):
@@ -200,30 +400,66 @@ async def ask_gpt(user_query: UserQuery):
     Fonction pour gérer les requêtes utilisateur et les réponses de GPT pour une conversation sur les transports publics
     """
     session_id = user_query.session_id
-
-    if session_id not in conversations:
-        initialize_conversation(session_id)
+    session = await run_session_store(session_store.get, session_id) or initialize_conversation()
 
     user_input = user_query.query
-    steps = conversations[session_id]["steps"]
-    conversation_history = conversations[session_id]["conversation_history"]
+    steps = session["steps"]
+    conversation_history = session["conversation_history"]
 
     # Ajouter l'entrée utilisateur à l'historique
     conversation_history.append({"role": "user", "content": user_input})
 
+    # Historique envoyé à GPT : limité au budget de tokens, les échanges anciens étant résumés
+    prompt_history = build_prompt_history(conversation_history, steps)
+
     if "stop" in user_input.lower():
-        gpt_reply = generate_response(conversation_history, "Merci pour votre visite. N'hésitez pas à relancer une demande de planification de voyage si vous avez besoin d'aide. À bientôt ! 👋")
-        del conversations[session_id]
+        gpt_reply = await canned_response(prompt_history, "farewell")
+        await run_session_store(session_store.delete, session_id)
         return {"gpt_answer": gpt_reply, "session_id": session_id}
 
     # Gestion des étapes de la conversation
-    gpt_reply = handle_conversation_steps(user_input, steps, conversation_history)
+    gpt_reply = await handle_conversation_steps(user_input, steps, prompt_history)
 
     # Si toutes les informations sont collectées
+    follow = []
     if all(steps.values()):
-        gpt_reply = process_trip_request(steps, session_id, conversation_history)
+        gpt_reply, follow = await process_trip_request(steps, session, prompt_history, user_query.language)
 
-    # Ajouter la réponse de GPT à l'historique
+    # Ajouter la réponse de GPT à l'historique et enregistrer la conversation
     conversation_history.append({"role": "assistant", "content": gpt_reply})
+    await run_session_store(session_store.save, session_id, session)
+
+    return {"gpt_answer": gpt_reply, "session_id": session_id, "follow": follow}
+
 
-    return {"gpt_answer": gpt_reply, "session_id": session_id}
+async def ask_gpt_stream(user_query: UserQuery) -> AsyncIterator[str]:
+    """
+    Variante de ask_gpt qui diffuse la réponse en Server-Sent Events : fragments de texte ("token"),
+    remplacement de la réponse en cours ("reset"), puis résultat complet ("done")
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def run():
+        response_stream.set(queue)
+        try:
+            return await ask_gpt(user_query)
+        finally:
+            await queue.put(None)
+
+    # La conversation est menée dans une tâche séparée : elle se termine et est enregistrée
+    # même si le client se déconnecte pendant la diffusion
+    task = asyncio.create_task(run())
+    while True:
+        item = await queue.get()
+        if item is None:
+            break
+        event, text = item
+        yield format_event(event, {"text": text} if text is not None else {})
+
+    try:
+        result = await task
+    except Exception as e:
+        print(f"Erreur lors de la génération de la réponse : {e}")
+        yield format_event("error", {"detail": "Une erreur s'est produite. Veuillez réessayer."})
+        return
+    yield format_event("done", result)
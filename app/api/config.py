@@ -1,19 +1,49 @@
 import os
 
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI
 from pymongo import MongoClient
+from pymongo.collection import Collection
+from pymongo.database import Database
+
+from app.api.metrics import MongoCommandMetrics
 
 
 load_dotenv()
 
 
-# Connexion à MongoDB
-mongo_client = MongoClient(os.getenv('MONGO_URI'))
-db = mongo_client[os.getenv('MONGO_DB')]
+class ActiveDatabase:
+    '''
+    Base de données des données GTFS actives. L'ETL charge chaque version dans sa propre base,
+    l'API bascule sur la nouvelle base lorsqu'elle est publiée (voir dataset.refresh_dataset)
+    '''
+
+    def __init__(self, client: MongoClient, name: str):
+        self.client = client
+        self.database: Database = client[name]
+
+    def switch(self, name: str):
+        self.database = self.client[name]
+
+    @property
+    def name(self) -> str:
+        return self.database.name
+
+    def __getattr__(self, name: str) -> Collection:
+        return getattr(self.database, name)
+
+    def __getitem__(self, name: str) -> Collection:
+        return self.database[name]
+
+
+# Connexion à MongoDB : la base principale contient le pointeur vers la version active des données GTFS.
+# La durée de chaque commande est mesurée pour /metrics
+mongo_client = MongoClient(os.getenv('MONGO_URI'), event_listeners=[MongoCommandMetrics()])
+base_db = mongo_client[os.getenv('MONGO_DB')]
+db = ActiveDatabase(mongo_client, os.getenv('MONGO_DB'))
 
 # OpenAI API
-openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+openai_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 # OJP API URL et clé
 ojp_api_key = os.getenv("OJP_API_TOKEN")
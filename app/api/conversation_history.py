@@ -0,0 +1,148 @@
+import os
+
+from typing import Dict, List, Optional
+
+
+# Budget (en tokens estimés) de l'historique envoyé à GPT avec chaque prompt
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1200"))
+
+# Nombre de derniers échanges (message de l'utilisateur et réponses) conservés tels quels
+HISTORY_KEEP_EXCHANGES = int(os.getenv("HISTORY_KEEP_EXCHANGES", "3"))
+
+# Libellés des étapes dans le résumé des échanges plus anciens
+STEP_LABELS = {
+    "destination": "destination",
+    "origin": "point de départ",
+    "date": "date",
+    "time": "heure",
+}
+
+
+def estimate_tokens(message: Dict) -> int:
+    '''
+    Estimation du nombre de tokens d'un message (environ 4 caractères par token, plus l'enveloppe du message)
+    '''
+    return 4 + len(message["content"]) // 4
+
+
+def summarize_steps(steps: Dict, omitted: int) -> Dict:
+    '''
+    Résumé structuré des échanges retirés de l'historique : informations déjà collectées et restantes
+    '''
+    collected = [f"{label} : {steps[step]}" for step, label in STEP_LABELS.items() if steps.get(step)]
+    missing = [label for step, label in STEP_LABELS.items() if not steps.get(step)]
+    content = f"Résumé des {omitted} messages précédents. Informations collectées : {' ; '.join(collected) or 'aucune'}."
+    if missing:
+        content += f" Informations manquantes : {', '.join(missing)}."
+    return {"role": "system", "content": content}
+
+
+def count_leading_messages(conversation_history: List[Dict]) -> int:
+    '''
+    Nombre de messages de tête toujours conservés : messages système puis message de bienvenue
+    (premier message de l'assistant, avant tout message de l'utilisateur)
+    '''
+    head = 0
+    while head < len(conversation_history) and conversation_history[head]["role"] == "system":
+        head += 1
+    if head < len(conversation_history) and conversation_history[head]["role"] == "assistant":
+        head += 1
+    return head
+
+
+def split_exchanges(messages: List[Dict]) -> List[List[Dict]]:
+    '''
+    Découpage de l'historique en échanges : chaque message de l'utilisateur et les réponses qui le suivent
+    '''
+    exchanges: List[List[Dict]] = []
+    for message in messages:
+        if message["role"] == "user" or not exchanges:
+            exchanges.append([])
+        exchanges[-1].append(message)
+    return exchanges
+
+
+class HistoryStats:
+    '''
+    Compteurs de l'historique envoyé à GPT : tokens de prompt réels par appel et compactage de l'historique
+    '''
+
+    def __init__(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.max_prompt_tokens = 0
+        self.last_prompt_tokens = 0
+        self.compacted = 0
+        self.messages_omitted = 0
+        self.tokens_saved = 0
+
+    def record_usage(self, usage):
+        '''
+        Enregistrer la consommation d'un appel GPT (champ `usage` de la réponse, absent si non fourni)
+        '''
+        if usage is None:
+            return
+        self.calls += 1
+        self.prompt_tokens += usage.prompt_tokens
+        self.completion_tokens += usage.completion_tokens
+        self.max_prompt_tokens = max(self.max_prompt_tokens, usage.prompt_tokens)
+        self.last_prompt_tokens = usage.prompt_tokens
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "average_prompt_tokens": self.prompt_tokens / self.calls if self.calls else 0.0,
+            "max_prompt_tokens": self.max_prompt_tokens,
+            "last_prompt_tokens": self.last_prompt_tokens,
+            "token_budget": HISTORY_TOKEN_BUDGET,
+            "keep_exchanges": HISTORY_KEEP_EXCHANGES,
+            "compacted": self.compacted,
+            "messages_omitted": self.messages_omitted,
+            "estimated_tokens_saved": self.tokens_saved,
+        }
+
+
+history_stats = HistoryStats()
+
+
+def build_prompt_history(conversation_history: List[Dict], steps: Dict,
+                         budget: Optional[int] = None, keep_exchanges: Optional[int] = None) -> List[Dict]:
+    '''
+    Historique envoyé à GPT dans la limite du budget de tokens : messages système et de bienvenue,
+    résumé des étapes collectées à la place des échanges plus anciens, puis les derniers échanges tels quels.
+    L'historique enregistré dans la session n'est pas modifié
+    '''
+    budget = HISTORY_TOKEN_BUDGET if budget is None else budget
+    keep_exchanges = HISTORY_KEEP_EXCHANGES if keep_exchanges is None else keep_exchanges
+
+    head = count_leading_messages(conversation_history)
+    kept_head = conversation_history[:head]
+
+    exchanges = split_exchanges(conversation_history[head:])
+    total = sum(estimate_tokens(message) for message in conversation_history)
+    if len(exchanges) <= keep_exchanges and total <= budget:
+        return conversation_history
+
+    # Derniers échanges dans la limite du budget, le plus récent (message en cours) étant toujours gardé
+    remaining = budget - sum(estimate_tokens(message) for message in kept_head)
+    kept: List[List[Dict]] = []
+    for exchange in reversed(exchanges[-keep_exchanges:] if keep_exchanges else exchanges[-1:]):
+        tokens = sum(estimate_tokens(message) for message in exchange)
+        if kept and tokens > remaining:
+            break
+        kept.insert(0, exchange)
+        remaining -= tokens
+
+    omitted = sum(len(exchange) for exchange in exchanges[:len(exchanges) - len(kept)])
+    if not omitted:
+        return conversation_history
+
+    summary = summarize_steps(steps, omitted)
+    prompt_history = kept_head + [summary] + [message for exchange in kept for message in exchange]
+    history_stats.compacted += 1
+    history_stats.messages_omitted += omitted
+    history_stats.tokens_saved += total - sum(estimate_tokens(message) for message in prompt_history)
+    return prompt_history
@@ -0,0 +1,65 @@
+import asyncio
+
+from starlette.concurrency import run_in_threadpool
+from typing import Callable, List
+
+from app.api.config import base_db, db
+
+
+# Fonctions de reconstruction des structures en mémoire qui dépendent des données GTFS
+dataset_loaders: List[Callable[[], None]] = []
+
+# Version des données GTFS actuellement chargée en mémoire (None pour une base sans métadonnées de version)
+current_version = None
+dataset_loaded = False
+
+
+def register_loader(loader: Callable[[], None]):
+    '''
+    Enregistrer une fonction à appeler à chaque chargement d'une nouvelle version des données GTFS
+    '''
+    dataset_loaders.append(loader)
+    return loader
+
+
+def get_dataset_version():
+    '''
+    Lire la version des données GTFS publiée par le processus ETL et la base de données qui la contient
+    '''
+    metadata = base_db.gtfs_metadata.find_one({"_id": "active"})
+    if not metadata:
+        return None, base_db.name
+    return metadata.get("version"), metadata.get("database", base_db.name)
+
+
+def refresh_dataset(force: bool = False) -> bool:
+    '''
+    Basculer sur la base de données de la version publiée par l'ETL (nouvelle version ou retour arrière)
+    et reconstruire les structures en mémoire
+    '''
+    global current_version, dataset_loaded
+
+    version, database = get_dataset_version()
+    if not force and dataset_loaded and version == current_version and database == db.name:
+        return False
+
+    db.switch(database)
+    for loader in dataset_loaders:
+        loader()
+
+    current_version = version
+    dataset_loaded = True
+    print(f"Données GTFS chargées en mémoire (version {version}, base {database})")
+    return True
+
+
+async def watch_dataset(interval: float):
+    '''
+    Vérifier périodiquement la version des données GTFS et recharger les structures en mémoire si nécessaire
+    '''
+    while True:
+        try:
+            await run_in_threadpool(refresh_dataset)
+        except Exception as e:
+            print(f"Erreur lors du rechargement des données GTFS : {e}")
+        await asyncio.sleep(interval)
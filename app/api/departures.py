@@ -0,0 +1,99 @@
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from fastapi import HTTPException
+from typing import Dict, List, Optional
+
+from app.api import service_calendar
+from app.api.config import db
+from app.api.service_calendar import gtfs_local_time, gtfs_seconds
+from app.api.utils import find_stop_id
+
+
+SECONDS_PER_DAY = 24 * 3600
+
+# Durée couverte par chaque document de la collection stop_departures (voir l'ETL)
+DEPARTURES_BUCKET_SECONDS = 3600
+
+
+def parse_departure_time(date: Optional[str], time: Optional[str]) -> datetime:
+    '''
+    Date et heure de début du tableau des départs, par défaut maintenant
+    '''
+    now = datetime.now()
+    try:
+        day = datetime.strptime(date, "%Y-%m-%d").date() if date else now.date()
+        if time:
+            clock = datetime.strptime(time, "%H:%M:%S" if time.count(":") == 2 else "%H:%M").time()
+        else:
+            clock = now.time().replace(microsecond=0)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date or time format (expected YYYY-MM-DD and HH:MM[:SS])")
+    return datetime.combine(day, clock)
+
+
+def find_departure_buckets(station_id: str, ranges: List[tuple]) -> List[Dict]:
+    '''
+    Lire les documents horaires d'une gare couvrant les plages de secondes demandées (l'ETL peut écrire
+    plusieurs documents pour une même heure, les départs sont triés après lecture)
+    '''
+    hour_filters = [
+        {"hour": {"$gte": low // DEPARTURES_BUCKET_SECONDS, "$lte": high // DEPARTURES_BUCKET_SECONDS}}
+        for _, low, high in ranges
+    ]
+    return list(db.stop_departures.find({"station_id": station_id, "$or": hour_filters}, {"_id": 0}))
+
+
+def get_departures(stop_name: str, start: datetime, window_minutes: int = 60, limit: int = 20) -> Dict:
+    '''
+    Prochains départs d'une gare entre `start` et `start + window_minutes`, limités aux services
+    circulant ce jour-là. Les courses de la veille après minuit (heures GTFS au-delà de 24h)
+    et celles du lendemain sont prises en compte
+    '''
+    stop_id, stop_name = find_stop_id(stop_name)
+    day = start.date()
+    seconds = gtfs_seconds(day, start)
+    end = seconds + window_minutes * 60
+
+    # Plages de secondes à lire pour chaque jour de service (veille, jour même, lendemain)
+    ranges = []
+    for day_offset in (-1, 0, 1):
+        shift = day_offset * SECONDS_PER_DAY
+        if end - shift >= 0:
+            ranges.append((day_offset, max(seconds - shift, 0), end - shift))
+
+    buckets = find_departure_buckets(stop_id, ranges)
+    if not buckets:
+        # Arrêt résolu sur un quai : utiliser sa gare
+        stop = db.stops.find_one({"stop_id": stop_id}, {"parent_station": 1, "_id": 0})
+        if stop and stop.get("parent_station"):
+            stop_id = str(stop["parent_station"])
+            buckets = find_departure_buckets(stop_id, ranges)
+
+    calendar = service_calendar.service_calendar
+    departures = []
+    for bucket in buckets:
+        times = bucket["times"]
+        for day_offset, low, high in ranges:
+            first, last = bisect_left(times, low), bisect_right(times, high)
+            if first >= last:
+                continue
+
+            service_day = day + timedelta(days=day_offset)
+            active = calendar.active_services(service_day)
+            for position in range(first, last):
+                if not active[calendar.index(bucket["services"][position])]:
+                    continue
+                departures.append((times[position] + day_offset * SECONDS_PER_DAY, {
+                    "departure_time": gtfs_local_time(service_day, times[position]).isoformat(),
+                    "line": bucket["lines"][position],
+                    "direction": bucket["directions"][position],
+                    "stop_id": bucket["stops"][position],
+                    "trip_id": bucket["trips"][position],
+                }))
+
+    departures.sort(key=lambda departure: departure[0])
+    return {
+        "stop_id": stop_id,
+        "stop_name": stop_name,
+        "departures": [departure for _, departure in departures[:limit]],
+    }
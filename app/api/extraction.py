@@ -0,0 +1,265 @@
+import re
+import unicodedata
+
+from datetime import date, datetime, timedelta
+from typing import List, Optional, Tuple
+
+from app.api import stop_index
+from app.api.stop_index import normalize_stop_name
+
+
+# Nombre maximal de mots d'un nom d'arrêt recherché dans le message
+MAX_STOP_NAME_WORDS = 8
+
+# Mots courants qui sont aussi des noms d'arrêts (ex. "Au", "Ins") : jamais reconnus seuls comme arrêt
+COMMON_WORDS = {
+    "a", "au", "aux", "de", "des", "du", "en", "et", "la", "le", "les", "un", "une", "pour", "vers", "depuis",
+    "oui", "non", "merci", "bonjour", "gare", "centre", "ville", "place", "poste", "ecole", "eglise",
+    "am", "an", "auf", "bis", "das", "der", "die", "ein", "im", "in", "ins", "nach", "von", "zu", "zum", "zur",
+    "ja", "nein", "danke", "bahnhof", "post", "dorf", "kirche", "schule", "zentrum",
+    "at", "by", "from", "the", "to", "yes", "no", "station", "center", "centre", "town",
+}
+
+# Mots qui précèdent la destination ou le point de départ dans un message contenant plusieurs arrêts
+DESTINATION_WORDS = {"a", "pour", "vers", "jusqu", "nach", "zu", "zum", "zur", "bis", "to"}
+ORIGIN_WORDS = {"de", "d", "du", "depuis", "von", "ab", "aus", "from"}
+
+MONTHS = {
+    "janvier": 1, "fevrier": 2, "mars": 3, "avril": 4, "mai": 5, "juin": 6, "juillet": 7, "aout": 8,
+    "septembre": 9, "octobre": 10, "novembre": 11, "decembre": 12,
+    "januar": 1, "februar": 2, "marz": 3, "april": 4, "juni": 6, "juli": 7, "august": 8,
+    "september": 9, "oktober": 10, "november": 11, "dezember": 12,
+    "january": 1, "february": 2, "march": 3, "may": 5, "june": 6, "july": 7, "october": 10, "december": 12,
+}
+WEEKDAYS = {
+    "lundi": 0, "mardi": 1, "mercredi": 2, "jeudi": 3, "vendredi": 4, "samedi": 5, "dimanche": 6,
+    "montag": 0, "dienstag": 1, "mittwoch": 2, "donnerstag": 3, "freitag": 4, "samstag": 5, "sonntag": 6,
+    "monday": 0, "tuesday": 1, "wednesday": 2, "thursday": 3, "friday": 4, "saturday": 5, "sunday": 6,
+}
+MONTH_PATTERN = "|".join(sorted(MONTHS, key=len, reverse=True))
+WEEKDAY_PATTERN = "|".join(WEEKDAYS)
+
+# Dates relatives (jours à ajouter), les expressions les plus longues d'abord
+RELATIVE_DAYS = [
+    (re.compile(r"\b(?:apres[- ]demain|ubermorgen|day after tomorrow)\b"), 2),
+    (re.compile(r"\b(?:aujourd'?\s?hui|ce soir|ce matin|cet apres[- ]midi|heute|today|tonight|this (?:morning|afternoon|evening))\b"), 0),
+    # "morgen" seul signifie demain, "heute morgen" et "am Morgen" désignent le matin
+    (re.compile(r"\b(?:demain|(?<!heute )(?<!am )morgen|tomorrow)\b"), 1),
+]
+IN_DAYS = re.compile(r"\b(?:dans|in) (\d{1,2}) (?:jours?|tagen|days?)\b")
+ISO_DATE = re.compile(r"\b(\d{4})-(\d{1,2})-(\d{1,2})\b")
+# "12.03.2025", "12/03", "12.03." ; sans année, une heure comme "8.30 Uhr" ou "8.30h" est exclue
+NUMERIC_DATE = re.compile(r"\b(\d{1,2})[./](\d{1,2})(?:[./](\d{4}|\d{2})\b(?![.:]\d)|\.?(?![\d:]|\s*(?:h\b|uhr\b)))")
+DAY_MONTH_DATE = re.compile(rf"\b(\d{{1,2}})(?:er|\.)?\s+({MONTH_PATTERN})\b(?:\s+(\d{{4}}))?")
+MONTH_DAY_DATE = re.compile(rf"\b({MONTH_PATTERN})\s+(\d{{1,2}})(?:st|nd|rd|th)?\b(?:,?\s+(\d{{4}}))?")
+WEEKDAY_DATE = re.compile(rf"\b({WEEKDAY_PATTERN})\b")
+
+# Heures relatives à maintenant
+NOW = re.compile(r"\b(?:maintenant|tout de suite|des que possible|jetzt|sofort|right now|now|asap)\b")
+IN_MINUTES = re.compile(r"\b(?:dans|in) (\d{1,3}) ?(?:min|minutes?|minuten)\b")
+IN_HOURS = re.compile(r"\b(?:dans|in) (\d{1,2}|une|einer|an|one) ?(?:h|heures?|stunden?|hours?)\b")
+
+# Heures absolues : "8h30", "08:30", "8 h", "20 heures", "8.30 Uhr", "8 pm", "midi"
+CLOCK_TIME = re.compile(r"\b(\d{1,2})\s*(?::|h|\.(?=\d{2}\s*uhr))\s*(\d{2})(?::(\d{2}))?\b")
+HOUR_TIME = re.compile(r"\b(\d{1,2})\s*(?:h|heures?|uhr)\b")
+AM_PM_TIME = re.compile(r"\b(\d{1,2})(?::(\d{2}))?\s*(am|pm)\b")
+NAMED_TIMES = [
+    (re.compile(r"\b(?:midi|mittag|noon)\b"), 12),
+    (re.compile(r"\b(?:minuit|mitternacht|midnight)\b"), 0),
+]
+
+# Moments de la journée qui placent une heure ambiguë ("8h") l'après-midi ou le soir
+AFTERNOON = re.compile(r"\b(?:soir|apres[- ]midi|abend|abends|nachmittag|nachmittags|evening|afternoon|tonight)\b")
+
+
+def fold(text: str) -> str:
+    '''
+    Texte en minuscules et sans accents, ponctuation conservée (pour les dates et heures)
+    '''
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(char for char in decomposed if not unicodedata.combining(char)).replace("’", "'")
+
+
+def find_stop_mentions(text: str) -> List[Tuple[str, str]]:
+    '''
+    Noms d'arrêts cités dans le message (correspondance exacte sur les noms normalisés, la plus longue d'abord),
+    avec le mot qui précède chacun
+    '''
+    by_name = stop_index.stop_resolver.by_name
+    words = normalize_stop_name(text).split()
+    mentions = []
+    position = 0
+    while position < len(words):
+        for length in range(min(MAX_STOP_NAME_WORDS, len(words) - position), 0, -1):
+            key = " ".join(words[position:position + length])
+            if key in by_name and not (length == 1 and (key in COMMON_WORDS or len(key) < 3)):
+                mentions.append((words[position - 1] if position else "", by_name[key][1]))
+                position += length
+                break
+        else:
+            position += 1
+    return mentions
+
+
+def extract_stop(text: str, role: str) -> Optional[str]:
+    '''
+    Arrêt cité dans le message pour la destination ou le point de départ (`role`), None en cas de doute
+    '''
+    if not len(stop_index.stop_resolver):
+        return None
+
+    mentions = find_stop_mentions(text)
+    names = {name for _, name in mentions}
+    if len(names) == 1:
+        return names.pop()
+
+    if len(names) > 1:
+        # Plusieurs arrêts : garder celui introduit par une préposition du bon rôle, s'il est seul dans ce cas
+        role_words = DESTINATION_WORDS if role == "destination" else ORIGIN_WORDS
+        names = {name for previous, name in mentions if previous in role_words}
+        return names.pop() if len(names) == 1 else None
+
+    # Message court sans nom exact : nom d'arrêt saisi avec une faute de frappe
+    if len(normalize_stop_name(text).split()) <= 3:
+        stop = stop_index.resolve_stop(text)
+        return stop[1] if stop else None
+    return None
+
+
+def next_date(day: int, month: int, year: Optional[int], today: date) -> Optional[date]:
+    '''
+    Date à partir du jour et du mois, l'année en cours (ou la suivante si la date est passée) par défaut
+    '''
+    try:
+        if year is not None:
+            return date(year + 2000 if year < 100 else year, month, day)
+        candidate = date(today.year, month, day)
+        return candidate if candidate >= today else date(today.year + 1, month, day)
+    except ValueError:
+        return None
+
+
+def parse_date(text: str, today: date) -> Optional[date]:
+    '''
+    Date absolue ou relative (français, allemand, anglais) mentionnée dans le message. Une date absolue
+    invalide (ex. "8.30", qui est une heure) est ignorée au profit des expressions suivantes
+    '''
+    absolute_dates = [
+        (ISO_DATE, lambda match: (int(match.group(3)), int(match.group(2)), int(match.group(1)))),
+        (NUMERIC_DATE, lambda match: (int(match.group(1)), int(match.group(2)), int(match.group(3)) if match.group(3) else None)),
+        (DAY_MONTH_DATE, lambda match: (int(match.group(1)), MONTHS[match.group(2)], int(match.group(3)) if match.group(3) else None)),
+        (MONTH_DAY_DATE, lambda match: (int(match.group(2)), MONTHS[match.group(1)], int(match.group(3)) if match.group(3) else None)),
+    ]
+    for pattern, fields in absolute_dates:
+        for match in pattern.finditer(text):
+            day = next_date(*fields(match), today)
+            if day:
+                return day
+
+    for pattern, days in RELATIVE_DAYS:
+        if pattern.search(text):
+            return today + timedelta(days=days)
+
+    match = IN_DAYS.search(text)
+    if match:
+        return today + timedelta(days=int(match.group(1)))
+
+    match = WEEKDAY_DATE.search(text)
+    if match:
+        # Prochain jour de la semaine cité, jamais aujourd'hui
+        days = (WEEKDAYS[match.group(1)] - today.weekday()) % 7 or 7
+        return today + timedelta(days=days)
+    return None
+
+
+def parse_relative_time(text: str, now: datetime) -> Optional[datetime]:
+    '''
+    Heure relative à maintenant ("maintenant", "dans 20 minutes", "in einer Stunde")
+    '''
+    match = IN_MINUTES.search(text)
+    if match:
+        return now + timedelta(minutes=int(match.group(1)))
+    match = IN_HOURS.search(text)
+    if match:
+        hours = int(match.group(1)) if match.group(1).isdigit() else 1
+        return now + timedelta(hours=hours)
+    if NOW.search(text):
+        return now
+    return None
+
+
+def parse_time(text: str) -> Optional[Tuple[int, int, int]]:
+    '''
+    Heure absolue mentionnée dans le message, en (heures, minutes, secondes)
+    '''
+    hour = minute = second = None
+    match = AM_PM_TIME.search(text)
+    if match:
+        hour, minute = int(match.group(1)) % 12, int(match.group(2) or 0)
+        if match.group(3) == "pm":
+            hour += 12
+        second = 0
+    else:
+        match = CLOCK_TIME.search(text)
+        if match:
+            hour, minute, second = int(match.group(1)), int(match.group(2)), int(match.group(3) or 0)
+        else:
+            match = HOUR_TIME.search(text)
+            if match:
+                hour, minute, second = int(match.group(1)), 0, 0
+            else:
+                for pattern, named_hour in NAMED_TIMES:
+                    if pattern.search(text):
+                        return named_hour, 0, 0
+                return None
+
+        if hour < 12 and AFTERNOON.search(text):
+            hour += 12
+
+    if hour > 23 or minute > 59 or second > 59:
+        return None
+    return hour, minute, second
+
+
+def extract_date_time(text: str, now: Optional[datetime] = None) -> Tuple[Optional[str], Optional[str]]:
+    '''
+    Date ("YYYY-MM-DD") et heure ("HH:MM:SS") de départ mentionnées dans le message, chacune None si absente
+    '''
+    now = (now or datetime.now()).replace(microsecond=0)
+    text = fold(text)
+
+    relative = parse_relative_time(text, now)
+    if relative:
+        return relative.strftime("%Y-%m-%d"), relative.strftime("%H:%M:%S")
+
+    day = parse_date(text, now.date())
+    clock = parse_time(text)
+    return (
+        day.strftime("%Y-%m-%d") if day else None,
+        "%02d:%02d:%02d" % clock if clock else None,
+    )
+
+
+class FastPathStats:
+    '''
+    Compteurs de l'extraction locale : messages traités sans appel à GPT et repli sur GPT
+    '''
+
+    def __init__(self):
+        self.stop_hits = 0
+        self.date_time_hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict:
+        hits = self.stop_hits + self.date_time_hits
+        return {
+            "stop_hits": self.stop_hits,
+            "date_time_hits": self.date_time_hits,
+            "misses": self.misses,
+            # Chaque message traité localement évite l'appel GPT d'extraction
+            "llm_calls_avoided": hits,
+            "hit_ratio": hits / (hits + self.misses) if hits + self.misses else 0.0,
+        }
+
+
+fast_path_stats = FastPathStats()
@@ -0,0 +1,195 @@
+import asyncio
+import httpx
+import os
+import sqlite3
+import threading
+import time
+
+from starlette.concurrency import run_in_threadpool
+from typing import Dict, Optional, Tuple
+
+from app.api.config import db
+from app.api.dataset import register_loader
+from app.api.http_clients import geocoding_client
+from app.api.stop_index import normalize_stop_name
+
+
+NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
+
+
+class GeocodingCache:
+    '''
+    Cache persistant sur disque (SQLite) des résultats de géocodage, avec durée de vie et éviction
+    '''
+
+    def __init__(self, path: str, ttl: float, negative_ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.puts_since_eviction = 0
+        # Dates de dernière utilisation des lectures, enregistrées avec la prochaine écriture
+        self.last_used: Dict[str, float] = {}
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        # Journal WAL : lectures et écritures sans synchronisation disque à chaque transaction
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS geocoding ("
+            "query TEXT PRIMARY KEY, lat REAL, lon REAL, expires_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS geocoding_last_used ON geocoding (last_used)")
+        self.connection.commit()
+
+    def get(self, query: str) -> Tuple[bool, Optional[Tuple[float, float]]]:
+        '''
+        Retourner (trouvé, coordonnées). Un résultat négatif en cache est retourné comme (True, None).
+        Une lecture n'écrit rien sur disque : une entrée expirée est remplacée par la prochaine écriture
+        et la date d'utilisation est enregistrée avec elle
+        '''
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT lat, lon, expires_at FROM geocoding WHERE query = ?", (query,)
+            ).fetchone()
+            if row is None:
+                return False, None
+
+            lat, lon, expires_at = row
+            if expires_at < now:
+                return False, None
+            self.last_used[query] = now
+
+        return True, (lat, lon) if lat is not None else None
+
+    def put(self, query: str, coordinates: Optional[Tuple[float, float]]):
+        '''
+        Enregistrer un résultat (ou une absence de résultat) et évincer les entrées les moins récemment utilisées
+        '''
+        now = time.time()
+        lat, lon = coordinates if coordinates else (None, None)
+        expires_at = now + (self.ttl if coordinates else self.negative_ttl)
+
+        with self.lock:
+            if self.last_used:
+                self.connection.executemany(
+                    "UPDATE geocoding SET last_used = ? WHERE query = ?",
+                    [(used, used_query) for used_query, used in self.last_used.items()]
+                )
+                self.last_used.clear()
+            self.connection.execute(
+                "INSERT OR REPLACE INTO geocoding (query, lat, lon, expires_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                (query, lat, lon, expires_at, now)
+            )
+
+            # L'éviction parcourt la table, elle n'est faite que toutes les 100 écritures
+            self.puts_since_eviction += 1
+            if self.puts_since_eviction >= 100:
+                self.puts_since_eviction = 0
+                self.connection.execute(
+                    "DELETE FROM geocoding WHERE query IN ("
+                    "SELECT query FROM geocoding ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+            self.connection.commit()
+
+
+class RateLimiter:
+    '''
+    Limiteur garantissant un intervalle minimal entre deux appels (politique d'utilisation de Nominatim)
+    '''
+
+    def __init__(self, min_interval: float):
+        self.min_interval = min_interval
+        self.next_call = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self.lock:
+            delay = self.next_call - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.next_call = time.monotonic() + self.min_interval
+
+
+# Gazetteer local : nom normalisé d'arrêt ou de commune -> coordonnées, construit par l'ETL
+gazetteer: Dict[str, Tuple[float, float]] = {}
+
+geocoding_cache = GeocodingCache(
+    path=os.getenv("GEOCODING_CACHE_PATH", "app/data/geocoding_cache.sqlite3"),
+    ttl=float(os.getenv("GEOCODING_CACHE_TTL", str(30 * 24 * 3600))),
+    negative_ttl=float(os.getenv("GEOCODING_NEGATIVE_TTL", str(24 * 3600))),
+    max_entries=int(os.getenv("GEOCODING_CACHE_SIZE", "50000"))
+)
+
+nominatim_rate_limiter = RateLimiter(float(os.getenv("NOMINATIM_MIN_INTERVAL", "1.0")))
+
+
+@register_loader
+def load_gazetteer():
+    '''
+    Charger en mémoire le gazetteer construit lors de l'ETL
+    '''
+    global gazetteer
+
+    gazetteer = {
+        normalize_stop_name(place["name"]): (place["lat"], place["lon"])
+        for place in db.gazetteer.find({}, {"name": 1, "lat": 1, "lon": 1, "_id": 0})
+    }
+
+
+def nominatim_params(address):
+    '''
+    Paramètres de recherche Nominatim limités à la Suisse
+    '''
+    return {
+        'q': address,
+        'format': 'json',
+        'limit': 1,
+        'countrycodes': 'CH',
+        'accept-language': 'fr'
+    }
+
+
+async def query_nominatim(address) -> Optional[Tuple[float, float]]:
+    '''
+    Interroger l'API Nominatim d'OpenStreetMap en respectant la limite de débit
+    '''
+    await nominatim_rate_limiter.wait()
+    response = await geocoding_client.get(NOMINATIM_URL, params=nominatim_params(address))
+    response.raise_for_status()
+
+    results = response.json()
+    if results:
+        return float(results[0]['lat']), float(results[0]['lon'])
+    return None
+
+
+async def get_coordinates_from_address_async(address):
+    """
+    Obtenir les coordonnées (latitude et longitude) d'une adresse : gazetteer local, puis cache persistant,
+    et en dernier recours l'API Nominatim d'OpenStreetMap.
+    """
+    query = normalize_stop_name(address or "")
+    if not query:
+        return None
+
+    coordinates = gazetteer.get(query)
+    if coordinates:
+        return coordinates
+
+    found, coordinates = await run_in_threadpool(geocoding_cache.get, query)
+    if found:
+        return coordinates
+
+    try:
+        coordinates = await query_nominatim(address)
+    except (httpx.HTTPError, ValueError) as e:
+        # Erreur réseau ou réponse vide ou non JSON : aucun résultat, et pas de mise en cache d'une erreur temporaire
+        print(f"Erreur lors du géocodage de '{address}' : {e}")
+        return None
+
+    await run_in_threadpool(geocoding_cache.put, query, coordinates)
+    return coordinates
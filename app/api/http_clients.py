@@ -0,0 +1,100 @@
+import asyncio
+import httpx
+import os
+
+from contextlib import asynccontextmanager
+
+from app.api.config import ojp_api_key
+from app.api.metrics import dependency_errors, track_dependency
+
+
+class PooledClient:
+    '''
+    Client HTTP asynchrone avec connexions persistantes, délais d'attente et nombre de requêtes simultanées borné.
+    La durée et les erreurs des requêtes sont mesurées sous le nom du service (`name`)
+    '''
+
+    def __init__(self, name: str, max_connections: int, max_concurrency: int, timeout: float, headers: dict = None):
+        self.name = name
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.timeout = httpx.Timeout(timeout, connect=min(timeout, 5.0))
+        self.headers = headers or {}
+        self.max_concurrency = max_concurrency
+        self.client = None
+        self.semaphore = None
+
+    def get_client(self) -> httpx.AsyncClient:
+        '''
+        Créer le client à la première utilisation, dans la boucle d'événements de l'application
+        '''
+        if self.client is None or self.client.is_closed:
+            self.client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout, headers=self.headers)
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self.client
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        '''
+        Envoyer une requête en attendant qu'une place se libère si trop de requêtes sont en cours
+        '''
+        client = self.get_client()
+        async with self.semaphore:
+            with track_dependency(self.name, method):
+                response = await client.request(method, url, **kwargs)
+        if response.status_code >= 400:
+            dependency_errors.inc(self.name, method)
+        return response
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, **kwargs):
+        '''
+        Envoyer une requête dont la réponse est lue au fil des morceaux reçus (`response.aiter_bytes()`).
+        La place est gardée et la durée mesurée jusqu'à la fin de la lecture
+        '''
+        client = self.get_client()
+        async with self.semaphore:
+            with track_dependency(self.name, method):
+                async with client.stream(method, url, **kwargs) as response:
+                    if response.status_code >= 400:
+                        dependency_errors.inc(self.name, method)
+                    yield response
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+
+# Client pour l'API OJP (planification des trajets)
+ojp_client = PooledClient(
+    name="ojp",
+    max_connections=int(os.getenv("OJP_MAX_CONNECTIONS", "20")),
+    max_concurrency=int(os.getenv("OJP_MAX_CONCURRENCY", "10")),
+    timeout=float(os.getenv("OJP_TIMEOUT", "15")),
+    headers={
+        'Content-Type': 'application/xml',
+        'Authorization': f'Bearer {ojp_api_key}'
+    }
+)
+
+# Client pour l'API Nominatim (géocodage)
+geocoding_client = PooledClient(
+    name="nominatim",
+    max_connections=int(os.getenv("GEOCODING_MAX_CONNECTIONS", "4")),
+    max_concurrency=int(os.getenv("GEOCODING_MAX_CONCURRENCY", "2")),
+    timeout=float(os.getenv("GEOCODING_TIMEOUT", "5")),
+    headers={'User-Agent': 'API Client'}
+)
+
+
+async def close_http_clients():
+    '''
+    Fermer les connexions persistantes à l'arrêt de l'application
+    '''
+    await ojp_client.close()
+    await geocoding_client.close()
@@ -0,0 +1,56 @@
+from pydantic import BaseModel
+from typing import List, Optional
+
+from app.api.utils import format_datetime
+
+
+class Leg(BaseModel):
+    '''
+    Modèle de données pour une étape d'un trajet en transport public
+    '''
+    origin_name: str = "Unknown"
+    origin_stop_ref: Optional[str] = None
+    departure_time: Optional[str] = None  # Horaire prévu, format ISO "YYYY-MM-DDTHH:MM:SSZ"
+    departure_estimated: Optional[str] = None
+    destination_name: str = "Unknown"
+    destination_stop_ref: Optional[str] = None
+    arrival_time: Optional[str] = None
+    arrival_estimated: Optional[str] = None
+    line: str = "Unknown line"
+    direction: str = "Unknown destination"
+    journey_ref: Optional[str] = None
+    trip_id: Optional[str] = None  # Identifiant de course GTFS, pour les itinéraires calculés localement
+    canceled: bool = False  # Course supprimée selon les données temps réel
+
+    def describe(self) -> str:
+        '''
+        Décrire l'étape en une phrase
+        '''
+        departure_time = format_datetime(self.departure_time) if self.departure_time else "Unknown"
+        arrival_time = format_datetime(self.arrival_time) if self.arrival_time else "Unknown"
+        # Heures estimées (temps réel) lorsqu'elles diffèrent des heures prévues
+        if self.departure_estimated and self.departure_estimated != self.departure_time:
+            departure_time += f" (estimé {format_datetime(self.departure_estimated)})"
+        if self.arrival_estimated and self.arrival_estimated != self.arrival_time:
+            arrival_time += f" (estimé {format_datetime(self.arrival_estimated)})"
+        description = f"Prenez la ligne {self.line} (direction {self.direction}) de {self.origin_name} à {departure_time}, puis descendez à {self.destination_name} à {arrival_time}."
+        if self.canceled:
+            description += " Attention : cette course est supprimée."
+        return description
+
+
+class Trip(BaseModel):
+    '''
+    Modèle de données pour un itinéraire composé d'une ou plusieurs étapes
+    '''
+    legs: List[Leg] = []
+
+    @property
+    def transfers(self) -> int:
+        return max(len(self.legs) - 1, 0)
+
+    def describe(self, trip_number: int) -> str:
+        '''
+        Décrire l'itinéraire et chacune de ses étapes
+        '''
+        return " ".join([f"Trajet n°{trip_number}:"] + [leg.describe() for leg in self.legs])
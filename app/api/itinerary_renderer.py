@@ -0,0 +1,187 @@
+import os
+
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from app.api.itinerary import Leg, Trip
+from app.api.realtime import GTFS_TIMEZONE, parse_leg_time
+
+
+# Langue des itinéraires lorsque le client n'en indique pas (ou en indique une non traduite)
+DEFAULT_LANGUAGE = os.getenv("CHATBOT_LANGUAGE", "fr")
+
+TEMPLATES: Dict[str, Dict[str, str]] = {
+    "fr": {
+        "title": "## {origin} → {destination}",
+        "date": "*{date}*",
+        "trip": "### Trajet {number} : {departure} → {arrival} ({duration}, {transfers})",
+        "direct": "direct",
+        "transfer": "1 correspondance",
+        "transfers": "{count} correspondances",
+        "leg": "- **{departure}** {origin} → **{arrival}** {destination} · {line} direction {direction}",
+        "change": "- *Correspondance à {station} : {minutes} min*",
+        "walk": "- *Changement de {origin} à {destination} : {minutes} min*",
+        "delay": "{time} (+{minutes} min)",
+        "early": "{time} (−{minutes} min)",
+        "canceled": "  ⚠️ **Course supprimée**",
+        "footer": "Vous pouvez demander une nouvelle recherche à tout moment.",
+        "weekdays": "lundi,mardi,mercredi,jeudi,vendredi,samedi,dimanche",
+    },
+    "de": {
+        "title": "## {origin} → {destination}",
+        "date": "*{date}*",
+        "trip": "### Verbindung {number}: {departure} → {arrival} ({duration}, {transfers})",
+        "direct": "direkt",
+        "transfer": "1 Umstieg",
+        "transfers": "{count} Umstiege",
+        "leg": "- **{departure}** {origin} → **{arrival}** {destination} · {line} Richtung {direction}",
+        "change": "- *Umsteigen in {station}: {minutes} Min.*",
+        "walk": "- *Umsteigen von {origin} nach {destination}: {minutes} Min.*",
+        "delay": "{time} (+{minutes} Min.)",
+        "early": "{time} (−{minutes} Min.)",
+        "canceled": "  ⚠️ **Fahrt fällt aus**",
+        "footer": "Sie können jederzeit eine neue Suche starten.",
+        "weekdays": "Montag,Dienstag,Mittwoch,Donnerstag,Freitag,Samstag,Sonntag",
+    },
+    "en": {
+        "title": "## {origin} → {destination}",
+        "date": "*{date}*",
+        "trip": "### Option {number}: {departure} → {arrival} ({duration}, {transfers})",
+        "direct": "direct",
+        "transfer": "1 change",
+        "transfers": "{count} changes",
+        "leg": "- **{departure}** {origin} → **{arrival}** {destination} · {line} towards {direction}",
+        "change": "- *Change at {station}: {minutes} min*",
+        "walk": "- *Change from {origin} to {destination}: {minutes} min*",
+        "delay": "{time} (+{minutes} min)",
+        "early": "{time} (−{minutes} min)",
+        "canceled": "  ⚠️ **Service cancelled**",
+        "footer": "You can start a new search at any time.",
+        "weekdays": "Monday,Tuesday,Wednesday,Thursday,Friday,Saturday,Sunday",
+    },
+}
+
+
+def get_templates(language: Optional[str]) -> Dict[str, str]:
+    '''
+    Textes de la langue demandée ("de-CH" -> "de"), ou de la langue par défaut
+    '''
+    language = (language or DEFAULT_LANGUAGE)[:2].lower()
+    return TEMPLATES.get(language) or TEMPLATES[DEFAULT_LANGUAGE]
+
+
+def local_time(value: Optional[str]) -> Optional[datetime]:
+    '''
+    Heure d'une étape en heure locale (les heures OJP sont en UTC)
+    '''
+    if not value:
+        return None
+    return parse_leg_time(value).astimezone(GTFS_TIMEZONE)
+
+
+def seconds_between(start: datetime, end: datetime) -> float:
+    '''
+    Durée réelle entre deux heures locales : la soustraction de deux heures du même fuseau ignore
+    les changements d'heure
+    '''
+    return end.timestamp() - start.timestamp()
+
+
+def format_duration(seconds: int) -> str:
+    hours, minutes = divmod(max(seconds, 0) // 60, 60)
+    return f"{hours} h {minutes:02d}" if hours else f"{minutes} min"
+
+
+def format_leg_time(templates: Dict[str, str], timetabled: Optional[datetime], estimated: Optional[datetime]) -> str:
+    '''
+    Heure prévue, avec l'écart de l'heure estimée (temps réel) lorsqu'il atteint une minute
+    '''
+    if timetabled is None:
+        return "?"
+    time = timetabled.strftime("%H:%M")
+    if estimated is None:
+        return time
+    minutes = round(seconds_between(timetabled, estimated) / 60)
+    if minutes >= 1:
+        return templates["delay"].format(time=time, minutes=minutes)
+    if minutes <= -1:
+        return templates["early"].format(time=time, minutes=-minutes)
+    return time
+
+
+def render_leg(templates: Dict[str, str], leg: Leg) -> List[str]:
+    lines = [templates["leg"].format(
+        departure=format_leg_time(templates, local_time(leg.departure_time), local_time(leg.departure_estimated)),
+        origin=leg.origin_name,
+        arrival=format_leg_time(templates, local_time(leg.arrival_time), local_time(leg.arrival_estimated)),
+        destination=leg.destination_name,
+        line=leg.line,
+        direction=leg.direction,
+    )]
+    if leg.canceled:
+        lines.append(templates["canceled"])
+    return lines
+
+
+def render_trip(templates: Dict[str, str], trip: Trip, number: int) -> List[str]:
+    '''
+    Titre de l'itinéraire (horaires, durée, correspondances) puis une ligne par étape et par correspondance
+    '''
+    departure = local_time(trip.legs[0].departure_time)
+    arrival = local_time(trip.legs[-1].arrival_time)
+    if trip.transfers == 0:
+        transfers = templates["direct"]
+    elif trip.transfers == 1:
+        transfers = templates["transfer"]
+    else:
+        transfers = templates["transfers"].format(count=trip.transfers)
+
+    lines = [templates["trip"].format(
+        number=number,
+        departure=departure.strftime("%H:%M") if departure else "?",
+        arrival=arrival.strftime("%H:%M") if arrival else "?",
+        duration=format_duration(int(seconds_between(departure, arrival))) if departure and arrival else "?",
+        transfers=transfers,
+    )]
+
+    previous = None
+    for leg in trip.legs:
+        if previous is not None:
+            previous_arrival, next_departure = local_time(previous.arrival_time), local_time(leg.departure_time)
+            minutes = round(seconds_between(previous_arrival, next_departure) / 60) if previous_arrival and next_departure else 0
+            if previous.destination_name == leg.origin_name:
+                lines.append(templates["change"].format(station=leg.origin_name, minutes=minutes))
+            else:
+                lines.append(templates["walk"].format(origin=previous.destination_name, destination=leg.origin_name, minutes=minutes))
+        lines.extend(render_leg(templates, leg))
+        previous = leg
+    return lines
+
+
+def render_itineraries(trips: List[Trip], language: Optional[str] = None, max_trips: int = 3,
+                       origin_name: Optional[str] = None, destination_name: Optional[str] = None) -> str:
+    '''
+    Itinéraires en Markdown (titres, horaires, correspondances, ligne et direction) dans la langue demandée
+    '''
+    templates = get_templates(language)
+    trips = [trip for trip in trips if trip.legs][:max_trips]
+    if not trips:
+        return ""
+
+    first_leg, last_leg = trips[0].legs[0], trips[0].legs[-1]
+    lines = [templates["title"].format(
+        origin=origin_name or first_leg.origin_name,
+        destination=destination_name or last_leg.destination_name
+    )]
+    departure = local_time(first_leg.departure_time)
+    if departure:
+        weekday = templates["weekdays"].split(",")[departure.weekday()]
+        lines.append(templates["date"].format(date=f"{weekday} {departure.strftime('%d.%m.%Y')}"))
+
+    for number, trip in enumerate(trips, start=1):
+        lines.append("")
+        lines.extend(render_trip(templates, trip, number))
+
+    lines.append("")
+    lines.append(templates["footer"])
+    return "\n".join(lines)
@@ -0,0 +1,443 @@
+import math
+import os
+import threading
+import numpy as np
+
+from array import array
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from app.api import service_calendar
+from app.api.config import db
+from app.api.dataset import register_loader
+from app.api.itinerary import Leg, Trip
+from app.api.service_calendar import gtfs_local_time, gtfs_seconds, ServiceCalendar
+
+
+# Mode d'utilisation du calcul d'itinéraires local :
+#   "off"      : jamais utilisé, les horaires ne sont pas chargés en mémoire
+#   "fallback" : utilisé lorsque l'API OJP est en erreur ou trop lente
+#   "local"    : utilisé par défaut à la place de l'API OJP
+# Sur un réseau de 670 000 connexions par jour, une recherche au plus tôt prend de 10 à 30 ms (médiane, 95e centile)
+# et une demande de 3 itinéraires en enchaîne 3 ; compter davantage sur le réseau suisse complet
+LOCAL_ROUTING = os.getenv("LOCAL_ROUTING", "off")
+
+# Temps de correspondance minimal par défaut dans une même gare (secondes)
+DEFAULT_TRANSFER_TIME = int(os.getenv("LOCAL_ROUTING_TRANSFER_TIME", "120"))
+
+# Durée maximale d'un trajet recherché (secondes)
+MAX_TRIP_DURATION = int(os.getenv("LOCAL_ROUTING_MAX_DURATION", str(6 * 3600)))
+
+# Durée des tranches de connexions parcourues à la fois (secondes)
+SCAN_WINDOW = 1800
+
+SECONDS_PER_DAY = 24 * 3600
+UNREACHED = 1 << 40
+
+
+def parse_gtfs_time(value) -> int:
+    '''
+    Convertir une heure GTFS "HH:MM:SS" (qui peut dépasser 24h) en secondes depuis le début du jour de service
+    '''
+    if not isinstance(value, str) or len(value) < 7:
+        return -1
+    return int(value[:-6]) * 3600 + int(value[-5:-3]) * 60 + int(value[-2:])
+
+
+def gtfs_id(value) -> str:
+    '''
+    Identifiant GTFS sous forme de texte (pandas a pu stocker les identifiants numériques comme entiers)
+    '''
+    if isinstance(value, float):
+        return "" if math.isnan(value) else str(int(value))
+    return str(value) if value is not None else ""
+
+
+class Timetable:
+    '''
+    Horaires GTFS compacts en mémoire : connexions élémentaires (départ d'un arrêt vers l'arrêt suivant
+    d'une même course) triées par heure de départ, pour un calcul d'itinéraires de type Connection Scan.
+    Les itinéraires sont calculés entre gares (arrêt parent), les quais d'une même gare étant confondus.
+    '''
+
+    def __init__(self, station_ids: List[str], station_names: List[str], stop_stations: Dict[str, int],
+                 trip_ids: List[str], trip_journey_refs: List[str], trip_lines: List[str], trip_directions: List[str],
+                 trip_services: np.ndarray, calendar: ServiceCalendar,
+                 conn_trips: np.ndarray, conn_dep_stations: np.ndarray, conn_arr_stations: np.ndarray,
+                 conn_dep_times: np.ndarray, conn_arr_times: np.ndarray,
+                 transfer_times: List[int], footpaths: Dict[int, List[Tuple[int, int]]]):
+        self.station_ids = station_ids
+        self.station_names = station_names
+        self.stop_stations = stop_stations
+        self.trip_ids = trip_ids
+        self.trip_journey_refs = trip_journey_refs
+        self.trip_lines = trip_lines
+        self.trip_directions = trip_directions
+        # Indices des services dans le calendrier utilisé lors de la construction
+        self.trip_services = trip_services
+        self.calendar = calendar
+        self.conn_trips = conn_trips
+        self.conn_dep_stations = conn_dep_stations
+        self.conn_arr_stations = conn_arr_stations
+        self.conn_dep_times = conn_dep_times
+        self.conn_arr_times = conn_arr_times
+        self.transfer_times = transfer_times
+        self.footpaths = footpaths
+
+    def __len__(self):
+        return len(self.conn_trips)
+
+    def connections_window(self, day: date, start: int, end: int) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        Indices des connexions circulant entre `start` et `end` secondes après minuit du jour donné,
+        y compris les courses de la veille après minuit et celles du lendemain, triés par heure de départ,
+        avec le décalage en secondes de leur jour de service
+        '''
+        windows = []
+        offsets = []
+        for day_offset in (-1, 0, 1):
+            shift = day_offset * SECONDS_PER_DAY
+            if end - shift < 0:
+                continue
+            low = np.searchsorted(self.conn_dep_times, start - shift, side="left")
+            high = np.searchsorted(self.conn_dep_times, end - shift, side="right")
+            if low >= high:
+                continue
+            indices = np.arange(low, high)
+            active = self.calendar.active_services(day + timedelta(days=day_offset))
+            indices = indices[active[self.trip_services[self.conn_trips[indices]]]]
+            windows.append(indices)
+            offsets.append(np.full(len(indices), shift, dtype=np.int64))
+
+        if not windows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+        indices = np.concatenate(windows)
+        shifts = np.concatenate(offsets)
+        order = np.argsort(self.conn_dep_times[indices] + shifts, kind="stable")
+        return indices[order], shifts[order]
+
+    def station_times(self, times: Dict[int, int]) -> np.ndarray:
+        '''
+        Heures par gare sous forme de tableau (UNREACHED pour les gares non atteintes)
+        '''
+        values = np.full(len(self.station_ids), UNREACHED, dtype=np.int64)
+        if times:
+            values[np.fromiter(times.keys(), dtype=np.int64, count=len(times))] = list(times.values())
+        return values
+
+    def earliest_arrival(self, origin: int, destination: int, day: date, departure: int):
+        '''
+        Connection Scan : parcourir les connexions par heure de départ croissante et retourner,
+        pour la destination, la liste des étapes (connexion de montée, connexion de descente, décalage du jour)
+        '''
+        # Heure d'arrivée et heure à partir de laquelle on peut monter dans une course, par gare
+        arrival: Dict[int, int] = {origin: departure}
+        ready: Dict[int, int] = {origin: departure}
+        # Comment chaque gare a été atteinte : ("ride", montée, descente, décalage) ou ("walk", gare précédente)
+        reached_by: Dict[int, tuple] = {}
+        # Course et jour de service (course * 3 + jour relatif) -> connexion de montée et son heure de départ
+        boarded: Dict[int, Tuple[int, int]] = {}
+
+        for to_station, duration in self.footpaths.get(origin, ()):
+            arrival[to_station] = ready[to_station] = departure + duration
+            reached_by[to_station] = ("walk", origin)
+
+        transfer_times = self.transfer_times
+        footpaths = self.footpaths
+        # Les connexions sont extraites par tranches : la plupart des recherches s'arrêtent bien avant la durée maximale
+        for window_start in range(departure, departure + MAX_TRIP_DURATION, SCAN_WINDOW):
+            if window_start >= arrival.get(destination, UNREACHED):
+                break
+
+            window_end = min(window_start + SCAN_WINDOW, departure + MAX_TRIP_DURATION) - 1
+            indices, shifts = self.connections_window(day, window_start, window_end)
+            if not len(indices):
+                continue
+            dep_stations = self.conn_dep_stations[indices]
+            dep_times = self.conn_dep_times[indices] + shifts
+            trip_keys = self.conn_trips[indices].astype(np.int64) * 3 + shifts // SECONDS_PER_DAY + 1
+            pending = np.ones(len(indices), dtype=bool)
+
+            # Heures par gare et heure de montée par course de la tranche, tenues à jour pendant le parcours
+            ready_times = self.station_times(ready)
+            window_trips, trip_slots = np.unique(trip_keys, return_inverse=True)
+            boarded_times = np.full(len(window_trips), UNREACHED, dtype=np.int64)
+            if boarded:
+                keys = np.fromiter(boarded.keys(), dtype=np.int64, count=len(boarded))
+                times = np.fromiter((boarding[1] for boarding in boarded.values()), dtype=np.int64, count=len(boarded))
+                slots = np.minimum(np.searchsorted(window_trips, keys), len(window_trips) - 1)
+                found = window_trips[slots] == keys
+                boarded_times[slots[found]] = times[found]
+
+            # Seules les connexions d'une course déjà empruntée ou partant d'une gare atteinte à temps sont parcourues
+            # en Python. Les gares atteintes et les courses empruntées pendant un passage ajoutent des connexions
+            # de la tranche au passage suivant (les heures ne font que diminuer : chaque connexion est vue une fois)
+            while True:
+                candidates = pending & (dep_times < arrival.get(destination, UNREACHED)) & (
+                    (ready_times[dep_stations] <= dep_times) | (boarded_times[trip_slots] <= dep_times)
+                )
+                selected = np.flatnonzero(candidates)
+                if not len(selected):
+                    break
+                pending[selected] = False
+
+                connections = zip(
+                    indices[selected].tolist(),
+                    trip_keys[selected].tolist(),
+                    trip_slots[selected].tolist(),
+                    dep_stations[selected].tolist(),
+                    self.conn_arr_stations[indices[selected]].tolist(),
+                    dep_times[selected].tolist(),
+                    (self.conn_arr_times[indices[selected]] + shifts[selected]).tolist(),
+                    shifts[selected].tolist()
+                )
+                for connection, trip_key, trip_slot, dep_station, station, dep_time, arr_time, shift in connections:
+                    if dep_time >= arrival.get(destination, UNREACHED):
+                        break
+
+                    # Une course peut être rattrapée plus tôt lors d'un passage suivant : garder la première montée
+                    boarding = boarded.get(trip_key)
+                    if boarding is None or boarding[1] > dep_time:
+                        if ready.get(dep_station, UNREACHED) > dep_time:
+                            continue
+                        boarding = boarded[trip_key] = (connection, dep_time)
+                        boarded_times[trip_slot] = dep_time
+                    enter = boarding[0]
+
+                    if arr_time < arrival.get(station, UNREACHED):
+                        arrival[station] = arr_time
+                        ready[station] = ready_times[station] = arr_time + transfer_times[station]
+                        reached_by[station] = ("ride", enter, connection, shift)
+                        for to_station, duration in footpaths.get(station, ()):
+                            if arr_time + duration < arrival.get(to_station, UNREACHED):
+                                arrival[to_station] = ready[to_station] = ready_times[to_station] = arr_time + duration
+                                reached_by[to_station] = ("walk", station)
+
+        if destination not in reached_by:
+            return None
+
+        legs = []
+        station = destination
+        for _ in range(len(reached_by)):
+            if station == origin:
+                break
+            step = reached_by[station]
+            if step[0] == "walk":
+                station = step[1]
+                continue
+            _, enter, leave, shift = step
+            legs.append((enter, leave, shift))
+            station = int(self.conn_dep_stations[enter])
+        legs.reverse()
+        return legs
+
+    def describe_leg(self, day: date, enter: int, leave: int, shift: int) -> Leg:
+        '''
+        Construire une étape d'itinéraire à partir de ses connexions de montée et de descente.
+        Les heures sont calculées depuis l'origine du jour de service de la course (midi moins 12 h)
+        '''
+        service_day = day + timedelta(days=shift // SECONDS_PER_DAY)
+        trip = int(self.conn_trips[enter])
+        origin = int(self.conn_dep_stations[enter])
+        destination = int(self.conn_arr_stations[leave])
+        departure_time = gtfs_local_time(service_day, int(self.conn_dep_times[enter]))
+        arrival_time = gtfs_local_time(service_day, int(self.conn_arr_times[leave]))
+        return Leg(
+            origin_name=self.station_names[origin],
+            origin_stop_ref=self.station_ids[origin],
+            departure_time=departure_time.isoformat(),
+            destination_name=self.station_names[destination],
+            destination_stop_ref=self.station_ids[destination],
+            arrival_time=arrival_time.isoformat(),
+            line=self.trip_lines[trip],
+            direction=self.trip_directions[trip],
+            journey_ref=self.trip_journey_refs[trip],
+            trip_id=self.trip_ids[trip],
+        )
+
+    def plan(self, origin_stop_id: str, destination_stop_id: str, departure: datetime, max_results: int = 3) -> List[Trip]:
+        '''
+        Calculer jusqu'à `max_results` itinéraires successifs au plus tôt entre deux arrêts
+        '''
+        origin = self.stop_stations.get(gtfs_id(origin_stop_id))
+        destination = self.stop_stations.get(gtfs_id(destination_stop_id))
+        if origin is None or destination is None or origin == destination:
+            return []
+
+        day = departure.date()
+        start = gtfs_seconds(day, departure)
+        trips = []
+        while len(trips) < max_results:
+            legs = self.earliest_arrival(origin, destination, day, start)
+            if not legs:
+                break
+            trips.append(Trip(legs=[self.describe_leg(day, *leg) for leg in legs]))
+            # Itinéraire suivant : partir après le premier départ de celui-ci
+            start = int(self.conn_dep_times[legs[0][0]]) + legs[0][2] + 60
+        return trips
+
+
+def load_stations():
+    '''
+    Associer chaque arrêt (quai) à sa gare, c'est-à-dire à son arrêt parent s'il en a un
+    '''
+    stops = [
+        (gtfs_id(stop.get("stop_id")), gtfs_id(stop.get("parent_station")), stop.get("stop_name") or "")
+        for stop in db.stops.find({}, {"stop_id": 1, "stop_name": 1, "parent_station": 1, "_id": 0})
+    ]
+    names = {stop_id: name for stop_id, _, name in stops}
+
+    station_index: Dict[str, int] = {}
+    station_ids: List[str] = []
+    station_names: List[str] = []
+    stop_stations: Dict[str, int] = {}
+    for stop_id, parent_station, name in stops:
+        station_id = parent_station or stop_id
+        station = station_index.get(station_id)
+        if station is None:
+            station = station_index[station_id] = len(station_ids)
+            station_ids.append(station_id)
+            station_names.append(names.get(station_id) or name)
+        stop_stations[stop_id] = station
+    return station_ids, station_names, stop_stations
+
+
+def load_transfers(stop_stations: Dict[str, int], station_count: int):
+    '''
+    Temps de correspondance minimal par gare et trajets à pied entre gares voisines
+    '''
+    transfer_times = [DEFAULT_TRANSFER_TIME] * station_count
+    explicit = set()
+    walks: Dict[Tuple[int, int], int] = {}
+
+    transfers_cursor = db.transfers.find({}, {"from_stop_id": 1, "to_stop_id": 1, "transfer_type": 1, "min_transfer_time": 1, "_id": 0})
+    for transfer in transfers_cursor:
+        from_station = stop_stations.get(gtfs_id(transfer.get("from_stop_id")))
+        to_station = stop_stations.get(gtfs_id(transfer.get("to_stop_id")))
+        # Type 3 : correspondance impossible
+        if from_station is None or to_station is None or transfer.get("transfer_type") == 3:
+            continue
+
+        duration = transfer.get("min_transfer_time")
+        if duration is None or (isinstance(duration, float) and math.isnan(duration)):
+            duration = DEFAULT_TRANSFER_TIME
+        duration = int(duration)
+
+        if from_station == to_station:
+            # Plusieurs paires de quais dans la même gare : garder la plus courte
+            if from_station in explicit:
+                duration = min(duration, transfer_times[from_station])
+            transfer_times[from_station] = duration
+            explicit.add(from_station)
+        else:
+            key = (from_station, to_station)
+            walks[key] = min(duration, walks.get(key, duration))
+
+    footpaths: Dict[int, List[Tuple[int, int]]] = {}
+    for (from_station, to_station), duration in walks.items():
+        footpaths.setdefault(from_station, []).append((to_station, duration))
+    return transfer_times, footpaths
+
+
+def build_timetable() -> Timetable:
+    '''
+    Construire les horaires compacts à partir des collections GTFS chargées par l'ETL
+    '''
+    station_ids, station_names, stop_stations = load_stations()
+
+    lines = {
+        gtfs_id(route.get("route_id")): gtfs_id(route.get("route_short_name")) or "Unknown line"
+        for route in db.routes.find({}, {"route_id": 1, "route_short_name": 1, "_id": 0})
+    }
+
+    trip_index: Dict[str, int] = {}
+    trip_ids, trip_journey_refs, trip_lines, trip_directions = [], [], [], []
+    calendar = service_calendar.service_calendar
+    trip_services = array("i")
+    trips_cursor = db.trips.find({}, {"trip_id": 1, "route_id": 1, "service_id": 1, "trip_headsign": 1, "original_trip_id": 1, "_id": 0})
+    for trip in trips_cursor:
+        trip_id = gtfs_id(trip.get("trip_id"))
+        trip_index[trip_id] = len(trip_ids)
+        trip_ids.append(trip_id)
+        trip_journey_refs.append(gtfs_id(trip.get("original_trip_id")) or trip_id)
+        trip_lines.append(lines.get(gtfs_id(trip.get("route_id")), "Unknown line"))
+        trip_directions.append(gtfs_id(trip.get("trip_headsign")) or "Unknown destination")
+        trip_services.append(calendar.index(gtfs_id(trip.get("service_id"))))
+
+    # Horaires de passage, lus une seule fois dans des tableaux compacts
+    trips, sequences, stations, arrivals, departures = array("i"), array("i"), array("i"), array("i"), array("i")
+    stop_times_cursor = db.stop_times.find(
+        {}, {"trip_id": 1, "stop_id": 1, "stop_sequence": 1, "arrival_time": 1, "departure_time": 1, "_id": 0}
+    ).batch_size(50000)
+    for stop_time in stop_times_cursor:
+        trip = trip_index.get(gtfs_id(stop_time.get("trip_id")))
+        station = stop_stations.get(gtfs_id(stop_time.get("stop_id")))
+        if trip is None or station is None:
+            continue
+        departure = parse_gtfs_time(stop_time.get("departure_time"))
+        arrival = parse_gtfs_time(stop_time.get("arrival_time"))
+        trips.append(trip)
+        sequences.append(int(stop_time.get("stop_sequence", 0)))
+        stations.append(station)
+        arrivals.append(arrival if arrival >= 0 else departure)
+        departures.append(departure if departure >= 0 else arrival)
+
+    trips, sequences, stations = np.frombuffer(trips, dtype=np.int32), np.frombuffer(sequences, dtype=np.int32), np.frombuffer(stations, dtype=np.int32)
+    arrivals, departures = np.frombuffer(arrivals, dtype=np.int32), np.frombuffer(departures, dtype=np.int32)
+
+    # Passages consécutifs d'une même course -> connexions élémentaires
+    order = np.lexsort((sequences, trips))
+    trips, stations, arrivals, departures = trips[order], stations[order], arrivals[order], departures[order]
+    valid = (
+        (trips[:-1] == trips[1:])
+        & (stations[:-1] != stations[1:])
+        & (departures[:-1] >= 0)
+        & (arrivals[1:] >= departures[:-1])
+    )
+    conn_trips = trips[:-1][valid]
+    conn_dep_stations = stations[:-1][valid]
+    conn_arr_stations = stations[1:][valid]
+    conn_dep_times = departures[:-1][valid]
+    conn_arr_times = arrivals[1:][valid]
+
+    order = np.lexsort((conn_arr_times, conn_dep_times))
+    transfer_times, footpaths = load_transfers(stop_stations, len(station_ids))
+
+    return Timetable(
+        station_ids, station_names, stop_stations,
+        trip_ids, trip_journey_refs, trip_lines, trip_directions,
+        np.frombuffer(trip_services, dtype=np.int32), calendar,
+        conn_trips[order], conn_dep_stations[order], conn_arr_stations[order],
+        conn_dep_times[order].astype(np.int64), conn_arr_times[order].astype(np.int64),
+        transfer_times, footpaths
+    )
+
+
+# Horaires partagés par l'application, construits uniquement si le calcul local est activé
+timetable: Optional[Timetable] = None
+timetable_lock = threading.Lock()
+
+
+@register_loader
+def load_timetable():
+    '''
+    Reconstruire les horaires en mémoire à chaque nouvelle version des données
+    '''
+    global timetable
+
+    if LOCAL_ROUTING == "off":
+        return
+
+    with timetable_lock:
+        timetable = build_timetable()
+    print(f"Horaires chargés pour le calcul d'itinéraires local ({len(timetable)} connexions)")
+
+
+def plan_trips(origin_stop_id: str, destination_stop_id: str, departure: datetime, max_results: int = 3) -> List[Trip]:
+    '''
+    Calculer des itinéraires à partir des horaires GTFS locaux (liste vide si ceux-ci ne sont pas chargés)
+    '''
+    if timetable is None:
+        return []
+    return timetable.plan(origin_stop_id, destination_stop_id, departure, max_results)
@@ -0,0 +1,135 @@
+import asyncio
+import os
+
+from collections import defaultdict
+from typing import AsyncIterator, Dict, Iterable, List, Set
+
+from app.api import realtime
+from app.api.utils import format_event
+
+
+# Nombre maximal de courses suivies par abonnement et intervalle des messages de maintien de connexion (secondes)
+LIVE_MAX_TRIPS = int(os.getenv("LIVE_MAX_TRIPS", "50"))
+LIVE_KEEPALIVE = float(os.getenv("LIVE_KEEPALIVE", "20"))
+
+
+class LiveSubscription:
+    '''
+    Abonnement d'un client aux mises à jour de quelques courses. Seul le dernier état de chaque course
+    est conservé en attente : un client lent reçoit l'état courant sans accumuler de retard
+    '''
+
+    def __init__(self, keys: Set[str]):
+        self.keys = keys
+        self.pending: Dict[str, str] = {}
+        self.event = asyncio.Event()
+
+    def push(self, trip_id: str, message: str):
+        self.pending[trip_id] = message
+        self.event.set()
+
+    async def next_messages(self, timeout: float) -> List[str]:
+        '''
+        Attendre les prochains messages (liste vide si rien n'est arrivé pendant `timeout` secondes)
+        '''
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        self.event.clear()
+        messages = list(self.pending.values())
+        self.pending.clear()
+        return messages
+
+
+class LiveHub:
+    '''
+    Diffusion des mises à jour temps réel aux abonnés : chaque course modifiée est sérialisée une seule fois,
+    puis transmise aux seuls abonnés qui la suivent (par trip_id GTFS ou JourneyRef OJP)
+    '''
+
+    def __init__(self):
+        self.subscriptions: Dict[str, Set[LiveSubscription]] = defaultdict(set)
+        self.subscribers = 0
+        self.published = 0
+        self.delivered = 0
+
+    def subscribe(self, keys: Iterable[str]) -> LiveSubscription:
+        subscription = LiveSubscription(set(keys))
+        for key in subscription.keys:
+            self.subscriptions[key].add(subscription)
+        self.subscribers += 1
+        return subscription
+
+    def unsubscribe(self, subscription: LiveSubscription):
+        for key in subscription.keys:
+            subscribers = self.subscriptions.get(key)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.subscriptions[key]
+        self.subscribers -= 1
+
+    def publish(self, trip_ids: List[str]):
+        '''
+        Transmettre l'état des courses modifiées à leurs abonnés (appelé après chaque rafraîchissement de l'index)
+        '''
+        index = realtime.realtime_index
+        for trip_id in trip_ids:
+            journey_ref = index.trip_journeys.get(trip_id)
+            subscribers = self.subscriptions.get(trip_id, set())
+            if journey_ref and journey_ref in self.subscriptions:
+                subscribers = subscribers | self.subscriptions[journey_ref]
+            if not subscribers:
+                continue
+
+            message = format_event("trip_update", index.trip_payload(trip_id))
+            for subscription in subscribers:
+                subscription.push(trip_id, message)
+            self.published += 1
+            self.delivered += len(subscribers)
+
+    def snapshot(self, keys: Iterable[str]) -> List[str]:
+        '''
+        État actuel des courses suivies ayant des données temps réel, envoyé à l'ouverture de l'abonnement
+        '''
+        index = realtime.realtime_index
+        messages = []
+        for key in keys:
+            trip_id = key if key in index.trip_stations else index.journey_trips.get(key)
+            if trip_id:
+                messages.append(format_event("trip_update", index.trip_payload(trip_id)))
+        return messages
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": self.subscribers,
+            "followed_trips": len(self.subscriptions),
+            "published": self.published,
+            "delivered": self.delivered,
+        }
+
+
+# Diffuseur partagé, alimenté par le rafraîchissement de l'index temps réel
+live_hub = LiveHub()
+realtime.register_listener(live_hub.publish)
+
+
+async def live_updates(keys: List[str]) -> AsyncIterator[str]:
+    '''
+    Flux Server-Sent Events des mises à jour des courses suivies, jusqu'à la déconnexion du client
+    '''
+    subscription = live_hub.subscribe(keys)
+    try:
+        yield format_event("subscribed", {"trips": sorted(subscription.keys)})
+        for message in live_hub.snapshot(subscription.keys):
+            yield message
+        while True:
+            messages = await subscription.next_messages(LIVE_KEEPALIVE)
+            if not messages:
+                # Commentaire SSE : garde la connexion ouverte à travers les proxys
+                yield ": keepalive\n\n"
+            for message in messages:
+                yield message
+    finally:
+        live_hub.unsubscribe(subscription)
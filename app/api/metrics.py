@@ -0,0 +1,178 @@
+import functools
+import threading
+import time
+
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+from pymongo import monitoring
+
+
+# Bornes des histogrammes de latence (secondes)
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def format_labels(labelnames: Tuple[str, ...], labels: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    '''
+    Compteur Prometheus par combinaison d'étiquettes
+    '''
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values: Dict[Tuple[str, ...], float] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        # Copie sous le verrou : les incréments concurrents ne modifient pas le dictionnaire pendant l'export
+        with self.lock:
+            values = list(self.values.items())
+        for labels, value in sorted(values):
+            lines.append(f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}")
+        return lines
+
+
+class Histogram:
+    '''
+    Histogramme Prometheus par combinaison d'étiquettes. Une observation n'incrémente qu'une case,
+    les valeurs cumulées sont calculées à l'export
+    '''
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # Par étiquettes : [observations par case (+ une case au-delà de la dernière borne), somme]
+        self.values: Dict[Tuple[str, ...], list] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        position = bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][position] += 1
+            entry[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        # Copie sous le verrou des cases et des sommes : chaque série exportée est cohérente
+        with self.lock:
+            values = [(labels, (list(counts), total)) for labels, (counts, total) in self.values.items()]
+        for labels, (counts, total) in sorted(values):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                bucket_labels = format_labels(self.labelnames, labels, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            cumulative += counts[-1]
+            bucket_labels = format_labels(self.labelnames, labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, labels)} {total!r}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+# Appels aux services externes : MongoDB, Nominatim, OJP, OpenAI
+dependency_latency = Histogram(
+    "tp_dependency_request_seconds", "Durée des appels aux services externes", ("dependency", "operation")
+)
+dependency_errors = Counter(
+    "tp_dependency_errors_total", "Appels aux services externes en erreur", ("dependency", "operation")
+)
+
+# Étapes de la conversation du chatbot
+chatbot_step_latency = Histogram("tp_chatbot_step_seconds", "Durée des étapes du chatbot", ("step",))
+chatbot_step_errors = Counter("tp_chatbot_step_errors_total", "Étapes du chatbot en erreur", ("step",))
+
+METRICS = [dependency_latency, dependency_errors, chatbot_step_latency, chatbot_step_errors]
+
+
+@contextmanager
+def track_dependency(dependency: str, operation: str):
+    '''
+    Mesurer la durée d'un appel à un service externe et compter les exceptions
+    '''
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        dependency_errors.inc(dependency, operation)
+        raise
+    finally:
+        dependency_latency.observe(time.perf_counter() - start, dependency, operation)
+
+
+def track_step(func):
+    '''
+    Décorateur mesurant la durée d'une étape asynchrone du chatbot (étiquetée par le nom de la fonction)
+    et comptant ses exceptions
+    '''
+    step = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            chatbot_step_errors.inc(step)
+            raise
+        finally:
+            chatbot_step_latency.observe(time.perf_counter() - start, step)
+    return wrapper
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    '''
+    Durée et erreurs des commandes MongoDB, mesurées par le pilote (find, aggregate, getMore, etc.)
+    '''
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        dependency_latency.observe(event.duration_micros / 1e6, "mongo", event.command_name)
+
+    def failed(self, event):
+        dependency_errors.inc("mongo", event.command_name)
+        dependency_latency.observe(event.duration_micros / 1e6, "mongo", event.command_name)
+
+
+def render_metrics(stats: Dict[str, dict]) -> str:
+    '''
+    Métriques au format texte Prometheus : compteurs et histogrammes, puis les valeurs numériques
+    des statistiques des composants (caches, sessions, temps réel), exportées en jauges "tp_<composant>_<champ>"
+    '''
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+
+    for component, values in stats.items():
+        for field, value in values.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            name = f"tp_{component}_{field}"
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {format_value(value)}")
+    return "\n".join(lines) + "\n"
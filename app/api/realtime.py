@@ -0,0 +1,343 @@
+import asyncio
+import os
+import threading
+
+from datetime import date, datetime, timedelta, timezone
+from starlette.concurrency import run_in_threadpool
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from app.api.config import base_db, db
+from app.api.dataset import register_loader
+from app.api.itinerary import Leg, Trip
+from app.api.journey_planner import gtfs_id
+from app.api.service_calendar import GTFS_TIMEZONE
+
+# Durée de conservation en mémoire d'une course qui n'est plus mise à jour (comme le TTL de la collection)
+REALTIME_TTL = int(os.getenv("GTFS_RT_TTL", "1800"))
+
+# Passage d'une course à un arrêt : (arrivée, retard à l'arrivée, départ, retard au départ), heures en timestamps Unix
+StopTimeUpdate = Tuple[Optional[int], Optional[int], Optional[int], Optional[int]]
+
+
+def station_key(stop_id) -> str:
+    '''
+    Clé commune aux identifiants GTFS, GTFS Realtime et OJP d'une même gare :
+    "8503000:0:3" (quai), "Parent8503000" (gare) et "ch:1:sloid:3000:1:2" (SLOID) donnent "8503000"
+    '''
+    stop_id = gtfs_id(stop_id)
+    if stop_id.startswith("ch:1:sloid:"):
+        parts = stop_id.split(":")
+        return f"85{int(parts[3]):05d}" if len(parts) > 3 and parts[3].isdigit() else stop_id
+    if stop_id.startswith("Parent"):
+        stop_id = stop_id[len("Parent"):]
+    return stop_id.split(":", 1)[0]
+
+
+def parse_leg_time(value: str) -> datetime:
+    '''
+    Heure d'une étape en datetime avec fuseau : UTC pour l'API OJP ("...Z"), heure locale pour le calcul local
+    '''
+    if value.endswith("Z"):
+        return datetime.fromisoformat(value[:-1]).replace(tzinfo=timezone.utc)
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=GTFS_TIMEZONE)
+
+
+def format_leg_time(moment: datetime, like: str) -> str:
+    '''
+    Formater une heure estimée comme l'heure prévue correspondante
+    '''
+    if like.endswith("Z"):
+        return moment.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    return moment.astimezone(GTFS_TIMEZONE).replace(tzinfo=None).isoformat()
+
+
+def estimated_time(timetabled: Optional[str], timestamp: Optional[int], delay: Optional[int]) -> Optional[str]:
+    '''
+    Heure estimée à partir de l'heure annoncée par le flux, ou à défaut de l'heure prévue et du retard
+    '''
+    if not timetabled:
+        return None
+    if timestamp:
+        return format_leg_time(datetime.fromtimestamp(timestamp, timezone.utc), timetabled)
+    if delay is not None:
+        return format_leg_time(parse_leg_time(timetabled) + timedelta(seconds=delay), timetabled)
+    return None
+
+
+class RealtimeIndex:
+    '''
+    Index en mémoire des mises à jour temps réel par (course, gare), rafraîchi de façon incrémentale
+    à partir de la collection trip_updates alimentée par le démon GTFS Realtime de l'ETL
+    '''
+
+    def __init__(self):
+        self.stop_times: Dict[Tuple[str, str], StopTimeUpdate] = {}
+        # Par course : gares indexées, date de service, annulation et date de la dernière mise à jour
+        self.trip_stations: Dict[str, List[str]] = {}
+        self.trip_dates: Dict[str, Optional[date]] = {}
+        self.trip_updated_at: Dict[str, datetime] = {}
+        self.canceled = set()
+        # JourneyRef OJP (original_trip_id GTFS) -> trip_id GTFS, pour les courses ayant des mises à jour
+        self.journey_trips: Dict[str, str] = {}
+        self.trip_journeys: Dict[str, str] = {}
+        self.last_updated_at: Optional[datetime] = None
+        self.last_refresh: Optional[datetime] = None
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.trip_stations)
+
+    def load_journey_refs(self, trip_ids: List[str]):
+        '''
+        Associer les JourneyRef OJP aux nouvelles courses (une seule requête par rafraîchissement)
+        '''
+        trip_ids = [trip_id for trip_id in trip_ids if trip_id not in self.trip_journeys]
+        if not trip_ids:
+            return
+        for trip in db.trips.find({"trip_id": {"$in": trip_ids}}, {"trip_id": 1, "original_trip_id": 1, "_id": 0}):
+            journey_ref = gtfs_id(trip.get("original_trip_id"))
+            if journey_ref:
+                trip_id = gtfs_id(trip.get("trip_id"))
+                self.journey_trips[journey_ref] = trip_id
+                self.trip_journeys[trip_id] = journey_ref
+
+    def apply(self, documents: Iterable[Dict]) -> List[str]:
+        '''
+        Remplacer les passages des courses mises à jour et retourner les courses dont les données ont changé
+        '''
+        changed = []
+        for document in documents:
+            trip_id = gtfs_id(document.get("trip_id"))
+            if not trip_id:
+                continue
+
+            stop_times = {}
+            for update in document.get("stop_time_updates") or ():
+                stop_times[station_key(update.get("stop_id"))] = (
+                    update.get("arrival"), update.get("arrival_delay"),
+                    update.get("departure"), update.get("departure_delay"),
+                )
+
+            start_date = document.get("start_date")
+            trip_date = datetime.strptime(start_date, "%Y%m%d").date() if start_date else None
+            canceled = bool(document.get("canceled"))
+            self.trip_updated_at[trip_id] = document.get("updated_at") or datetime.now(timezone.utc).replace(tzinfo=None)
+
+            previous_stations = self.trip_stations.get(trip_id)
+            if (
+                previous_stations is not None
+                and self.trip_dates.get(trip_id) == trip_date
+                and (trip_id in self.canceled) == canceled
+                and len(previous_stations) == len(stop_times)
+                and all(self.stop_times.get((trip_id, station)) == value for station, value in stop_times.items())
+            ):
+                continue
+
+            # Ajouter les nouveaux passages avant de retirer les anciens : une lecture concurrente trouve toujours une valeur
+            for station, value in stop_times.items():
+                self.stop_times[(trip_id, station)] = value
+            for station in previous_stations or ():
+                if station not in stop_times:
+                    self.stop_times.pop((trip_id, station), None)
+            self.trip_stations[trip_id] = list(stop_times)
+            self.trip_dates[trip_id] = trip_date
+            if canceled:
+                self.canceled.add(trip_id)
+            else:
+                self.canceled.discard(trip_id)
+            changed.append(trip_id)
+        return changed
+
+    def remove(self, trip_id: str):
+        for station in self.trip_stations.pop(trip_id, ()):
+            self.stop_times.pop((trip_id, station), None)
+        self.trip_dates.pop(trip_id, None)
+        self.trip_updated_at.pop(trip_id, None)
+        self.canceled.discard(trip_id)
+        journey_ref = self.trip_journeys.pop(trip_id, None)
+        if journey_ref:
+            self.journey_trips.pop(journey_ref, None)
+
+    def prune(self, now: datetime) -> List[str]:
+        '''
+        Retirer les courses qui ne sont plus publiées par le flux depuis REALTIME_TTL secondes
+        '''
+        expires_before = now - timedelta(seconds=REALTIME_TTL)
+        expired = [trip_id for trip_id, updated_at in self.trip_updated_at.items() if updated_at < expires_before]
+        for trip_id in expired:
+            self.remove(trip_id)
+        return expired
+
+    def refresh(self) -> List[str]:
+        '''
+        Lire les mises à jour enregistrées depuis le dernier rafraîchissement et retourner les courses modifiées.
+        Les documents d'un même passage du démon partagent la même date : elle est relue (>=) pour ne rien manquer
+        '''
+        with self.lock:
+            query = {"updated_at": {"$gte": self.last_updated_at}} if self.last_updated_at else {}
+            documents = list(base_db.trip_updates.find(query, {"_id": 0}).sort("updated_at", 1))
+            if documents:
+                self.last_updated_at = documents[-1].get("updated_at") or self.last_updated_at
+
+            changed = self.apply(documents)
+            self.load_journey_refs(changed)
+            now = datetime.now(timezone.utc).replace(tzinfo=None)
+            changed.extend(self.prune(now))
+            self.last_refresh = now
+            return changed
+
+    def trip_id_for(self, leg: Leg) -> Optional[str]:
+        return leg.trip_id or self.journey_trips.get(leg.journey_ref or "")
+
+    def lookup(self, trip_id: str, stop_ref: Optional[str], moment: Optional[str]) -> Optional[StopTimeUpdate]:
+        '''
+        Passage temps réel d'une course à une gare, si la date de service de la mise à jour correspond à l'étape
+        '''
+        if not stop_ref:
+            return None
+        update = self.stop_times.get((trip_id, station_key(stop_ref)))
+        if update is None or not moment:
+            return update
+        trip_date = self.trip_dates.get(trip_id)
+        # Les courses après minuit appartiennent au jour de service de la veille
+        if trip_date and parse_leg_time(moment).astimezone(GTFS_TIMEZONE).date() - trip_date not in (timedelta(0), timedelta(days=1)):
+            return None
+        return update
+
+    def annotate_leg(self, leg: Leg) -> Leg:
+        '''
+        Étape avec ses heures estimées de départ et d'arrivée (recherches en O(1), sans requête MongoDB)
+        '''
+        trip_id = self.trip_id_for(leg)
+        if not trip_id or trip_id not in self.trip_stations:
+            return leg
+
+        fields = {}
+        departure = self.lookup(trip_id, leg.origin_stop_ref, leg.departure_time)
+        if departure is not None:
+            estimated = estimated_time(leg.departure_time, departure[2], departure[3])
+            if estimated:
+                fields["departure_estimated"] = estimated
+        arrival = self.lookup(trip_id, leg.destination_stop_ref, leg.arrival_time)
+        if arrival is not None:
+            estimated = estimated_time(leg.arrival_time, arrival[0], arrival[1])
+            if estimated:
+                fields["arrival_estimated"] = estimated
+        if trip_id in self.canceled:
+            fields["canceled"] = True
+        return leg.model_copy(update=fields) if fields else leg
+
+    def annotate(self, trips: List[Trip]) -> Tuple[List[Trip], bool]:
+        '''
+        Itinéraires avec les heures estimées de chaque étape, et indicateur d'au moins une étape modifiée
+        '''
+        if not self.trip_stations:
+            return trips, False
+
+        annotated = []
+        changed = False
+        for trip in trips:
+            legs = [self.annotate_leg(leg) for leg in trip.legs]
+            if any(new is not old for new, old in zip(legs, trip.legs)):
+                changed = True
+                trip = trip.model_copy(update={"legs": legs})
+            annotated.append(trip)
+        return annotated, changed
+
+    def trip_payload(self, trip_id: str) -> Dict:
+        '''
+        État temps réel d'une course (passages par gare et retard maximal), tel qu'envoyé aux abonnés
+        '''
+        if trip_id not in self.trip_stations:
+            return {"trip_id": trip_id, "removed": True}
+
+        stops = []
+        delays = []
+        for station in self.trip_stations[trip_id]:
+            arrival, arrival_delay, departure, departure_delay = self.stop_times[(trip_id, station)]
+            stops.append({
+                "station": station,
+                "arrival": arrival,
+                "arrival_delay": arrival_delay,
+                "departure": departure,
+                "departure_delay": departure_delay,
+            })
+            delays.extend(delay for delay in (arrival_delay, departure_delay) if delay is not None)
+        return {
+            "trip_id": trip_id,
+            "journey_ref": self.trip_journeys.get(trip_id),
+            "canceled": trip_id in self.canceled,
+            "delay": max(delays) if delays else None,
+            "stops": stops,
+        }
+
+    def stats(self) -> dict:
+        return {
+            "trips": len(self.trip_stations),
+            "stop_times": len(self.stop_times),
+            "canceled": len(self.canceled),
+            "last_updated_at": self.last_updated_at,
+            "last_refresh": self.last_refresh,
+        }
+
+
+# Index partagé par l'application, rafraîchi par watch_realtime
+realtime_index = RealtimeIndex()
+
+# Fonctions appelées (dans la boucle d'événements) avec les courses modifiées à chaque rafraîchissement
+realtime_listeners: List[Callable[[List[str]], None]] = []
+
+
+def register_listener(listener: Callable[[List[str]], None]):
+    '''
+    Enregistrer une fonction à appeler avec les courses dont les données temps réel ont changé
+    '''
+    realtime_listeners.append(listener)
+    return listener
+
+
+@register_loader
+def reload_realtime_index():
+    '''
+    Reconstruire l'index à chaque nouvelle version des données : les JourneyRef dépendent des courses GTFS chargées
+    '''
+    global realtime_index
+
+    index = RealtimeIndex()
+    index.refresh()
+    realtime_index = index
+
+
+def apply_realtime(result: Dict) -> Dict:
+    '''
+    Ajouter les heures estimées aux itinéraires d'un résultat de trajet. Le résultat (éventuellement en cache)
+    n'est pas modifié : un nouveau résultat est retourné si des étapes ont changé
+    '''
+    trips = result.get("trips")
+    if not trips:
+        return result
+
+    trips, changed = realtime_index.annotate(trips)
+    if not changed:
+        return result
+    return {
+        **result,
+        "trips": trips,
+        "trip_details": [trip.describe(trip_number) for trip_number, trip in enumerate(trips, start=1)],
+    }
+
+
+async def watch_realtime(interval: float):
+    '''
+    Rafraîchir périodiquement l'index des mises à jour temps réel et notifier les courses modifiées
+    '''
+    while True:
+        try:
+            changed = await run_in_threadpool(realtime_index.refresh)
+            if changed:
+                for listener in realtime_listeners:
+                    listener(changed)
+        except Exception as e:
+            print(f"Erreur lors du rafraîchissement des données temps réel : {e}")
+        await asyncio.sleep(interval)
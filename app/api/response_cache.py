@@ -0,0 +1,135 @@
+import os
+import random
+
+from collections import OrderedDict
+from string import Formatter
+from typing import Dict, List, Optional, Tuple
+
+
+# Nombre de formulations conservées par réponse, nombre maximal de réponses en cache
+RESPONSE_CACHE_VARIANTS = int(os.getenv("RESPONSE_CACHE_VARIANTS", "3"))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "2000"))
+
+# Génération au démarrage des formulations manquantes (les formulations sont enregistrées dans MongoDB
+# et rechargées aux démarrages suivants) : "on" ou "off"
+RESPONSE_CACHE_WARMUP = os.getenv("RESPONSE_CACHE_WARMUP", "on") == "on"
+
+
+def template_fields(template: str) -> set:
+    '''
+    Noms des paramètres d'un modèle de réponse ("{stop}" -> "stop"), ValueError si le modèle est mal formé
+    '''
+    return {field for _, field, _, _ in Formatter().parse(template) if field is not None}
+
+
+class ResponseCache:
+    '''
+    Cache LRU des réponses du chatbot qui ne dépendent que d'un modèle de prompt et de quelques paramètres
+    (nom d'arrêt, date, heure). Plusieurs formulations sont conservées par réponse et choisies au hasard.
+    Les modèles générés au démarrage (paramètres laissés sous la forme "{stop}") servent toutes les valeurs
+    '''
+
+    def __init__(self, max_size: int, variants: int):
+        self.max_size = max_size
+        self.variants = variants
+        self.entries: OrderedDict = OrderedDict()
+        self.templates: Dict[Tuple[str, str], List[str]] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(name: str, language: str, params: Dict[str, str]) -> tuple:
+        return (name, language) + tuple(sorted(params.items()))
+
+    def get(self, name: str, language: str, params: Dict[str, str]) -> Optional[str]:
+        '''
+        Une des formulations en cache pour ce modèle et ces paramètres, None tant qu'il en manque
+        '''
+        key = self.make_key(name, language, params)
+        variants = self.entries.get(key)
+        # Compléter une entrée incomplète avec les modèles, qui ont pu être générés depuis sa création
+        if (variants is None or len(variants) < self.variants) and (name, language) in self.templates:
+            expanded = [template.format(**params) for template in self.templates[(name, language)]]
+            variants = list(dict.fromkeys((variants or []) + expanded))[:self.variants]
+            self.store(key, variants)
+
+        if variants is None or len(variants) < self.variants:
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return random.choice(variants)
+
+    def add(self, name: str, language: str, params: Dict[str, str], reply: str):
+        '''
+        Conserver une réponse générée par GPT comme formulation supplémentaire
+        '''
+        key = self.make_key(name, language, params)
+        variants = self.entries.get(key, [])
+        if len(variants) < self.variants and reply not in variants:
+            self.store(key, variants + [reply])
+
+    def add_template(self, name: str, language: str, template: str, fields: set) -> bool:
+        '''
+        Ajouter une formulation générée au démarrage, si elle contient exactement les paramètres attendus
+        '''
+        try:
+            if template_fields(template) != fields:
+                return False
+        except ValueError:
+            return False
+
+        templates = self.templates.setdefault((name, language), [])
+        if len(templates) < self.variants and template not in templates:
+            templates.append(template)
+        return True
+
+    def missing_templates(self, name: str, language: str) -> int:
+        return self.variants - len(self.templates.get((name, language), []))
+
+    def load_templates(self, collection, prompts: Dict[str, str], language: str):
+        '''
+        Charger les formulations enregistrées par un précédent démarrage, si leur prompt n'a pas changé
+        '''
+        for document in collection.find({"language": language}):
+            prompt = prompts.get(document["name"])
+            if prompt is None or prompt != document["prompt"]:
+                continue
+            for template in document["templates"]:
+                self.add_template(document["name"], language, template, template_fields(prompt))
+
+    def save_templates(self, collection, name: str, language: str, prompt: str):
+        '''
+        Enregistrer les formulations d'un prompt, partagées entre les processus et les redémarrages
+        '''
+        collection.replace_one(
+            {"_id": f"{language}:{name}"},
+            {"name": name, "language": language, "prompt": prompt, "templates": self.templates.get((name, language), [])},
+            upsert=True
+        )
+
+    def store(self, key: tuple, variants: List[str]):
+        self.entries[key] = variants
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.entries),
+            "templates": len(self.templates),
+            "max_size": self.max_size,
+            "variants": self.variants,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / (self.hits + self.misses) if self.hits + self.misses else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+# Cache partagé des réponses du chatbot
+response_cache = ResponseCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_VARIANTS)
@@ -1,28 +1,102 @@
 from fastapi import APIRouter, Query
+from fastapi.responses import Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional
 
-from app.api.chatbot import ask_gpt, UserQuery
-from app.api.config import db
-from app.api.trip import get_trip, TripRequestModel
-from app.api.utils import search_stops, get_coordinates_from_address, find_nearest_stop
+from app.api import realtime
+from app.api.chatbot import ask_gpt, ask_gpt_stream, UserQuery
+from app.api.config import base_db, db
+from app.api.conversation_history import history_stats
+from app.api.departures import get_departures, parse_departure_time
+from app.api.extraction import fast_path_stats
+from app.api.geocoding import get_coordinates_from_address_async
+from app.api.live import LIVE_MAX_TRIPS, live_hub, live_updates
+from app.api.metrics import render_metrics
+from app.api.response_cache import response_cache
+from app.api.session_store import run_session_store, session_store
+from app.api.spatial_index import NearestStopsBatchModel
+from app.api.trip import get_trip_async, TripRequestModel
+from app.api.trip_batch import plan_trips_batch, TripBatchModel
+from app.api.trip_cache import trip_cache
+from app.api.utils import search_stops, find_nearest_stops, find_nearest_stops_batch
 
 
 router = APIRouter()
 
 
 @router.get("/search_stops")
-async def search_stops_route(query: str = Query(None, min_length=3)):
+async def search_stops_route(
+    query: str = Query(None, min_length=3),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0)
+):
     '''
     Rechercher des arrêts par nom et retourner une liste d'arrêts uniques
     '''
-    return search_stops(db.stops, query)
+    return await run_in_threadpool(search_stops, db.stops, query, limit, offset)
+
+
+@router.get("/departures")
+async def get_departures_route(
+    stop: str = Query(..., min_length=3),
+    date: Optional[str] = None,
+    time: Optional[str] = None,
+    window: int = Query(60, ge=1, le=720),
+    limit: int = Query(20, ge=1, le=200)
+):
+    '''
+    Obtenir les prochains départs d'un arrêt dans une fenêtre de temps (en minutes)
+    '''
+    return await run_in_threadpool(get_departures, stop, parse_departure_time(date, time), window, limit)
 
 
 @router.post("/trip")
-def get_trip_route(request: TripRequestModel):
+async def get_trip_route(request: TripRequestModel):
     '''
     Obtenir les détails du trajet entre deux arrêts à une date et une heure spécifiques
     '''
-    return get_trip(request)
+    return await get_trip_async(request)
+
+
+@router.post("/trips/batch")
+async def get_trips_batch_route(batch: TripBatchModel):
+    '''
+    Obtenir les itinéraires d'un lot de demandes de trajet, transmis en NDJSON au fur et à mesure
+    '''
+    return StreamingResponse(plan_trips_batch(batch), media_type="application/x-ndjson")
+
+
+@router.get("/trip/cache_stats")
+async def get_trip_cache_stats():
+    '''
+    Obtenir les statistiques du cache des trajets (succès, échecs, requêtes regroupées)
+    '''
+    return trip_cache.stats()
+
+
+@router.get("/realtime/stats")
+async def get_realtime_stats():
+    '''
+    Obtenir l'état de l'index temps réel et du démon d'ingestion GTFS Realtime (retard du flux, débit)
+    '''
+    return {
+        "index": realtime.realtime_index.stats(),
+        "ingestion": await run_in_threadpool(base_db.gtfs_metadata.find_one, {"_id": "realtime"}, {"_id": 0}),
+        "live": live_hub.stats(),
+    }
+
+
+@router.get("/live")
+async def live_route(trip: List[str] = Query(..., min_length=1, max_length=LIVE_MAX_TRIPS)):
+    '''
+    Suivre en direct les courses d'un itinéraire (trip_id GTFS ou JourneyRef OJP) : flux Server-Sent Events
+    qui transmet l'état temps réel d'une course à chaque changement
+    '''
+    return StreamingResponse(
+        live_updates(trip),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 @router.post("/ask")
@@ -33,12 +107,89 @@ async def ask_gpt_route(user_query: UserQuery):
     return await ask_gpt(user_query)
 
 
+@router.post("/ask/stream")
+async def ask_gpt_stream_route(user_query: UserQuery):
+    '''
+    Obtenir la réponse GPT en flux Server-Sent Events, fragment par fragment
+    '''
+    return StreamingResponse(
+        ask_gpt_stream(user_query),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.get("/ask/session_stats")
+async def get_session_stats():
+    '''
+    Obtenir les statistiques du stockage des conversations (nombre de sessions, expirations, évictions)
+    '''
+    return await run_session_store(session_store.stats)
+
+
+@router.get("/ask/fast_path_stats")
+async def get_fast_path_stats():
+    '''
+    Obtenir les statistiques de l'extraction locale des arrêts, dates et heures (appels GPT évités)
+    '''
+    return fast_path_stats.stats()
+
+
+@router.get("/ask/history_stats")
+async def get_history_stats():
+    '''
+    Obtenir la consommation de tokens des appels GPT et les statistiques de compactage de l'historique
+    '''
+    return history_stats.stats()
+
+
+@router.get("/ask/response_cache_stats")
+async def get_response_cache_stats():
+    '''
+    Obtenir les statistiques du cache des réponses du chatbot (formulations générées, taux de succès)
+    '''
+    return response_cache.stats()
+
+
 @router.get("/nearest_stops")
-async def get_nearest_stop(query: str):
+async def get_nearest_stop(
+    query: str,
+    k: int = Query(5, ge=1, le=50),
+    radius: Optional[float] = Query(None, gt=0, le=50000)
+):
     '''
     Obtenir les arrêts les plus proches d'une position géographique donnée
     '''
-    coordinates = get_coordinates_from_address(query)
+    coordinates = await get_coordinates_from_address_async(query)
     if coordinates:
-        return find_nearest_stop(*coordinates)
+        return await run_in_threadpool(find_nearest_stops, *coordinates, k=k, radius=radius)
     return None
+
+
+@router.post("/nearest_stops/batch")
+async def get_nearest_stops_batch(request: NearestStopsBatchModel):
+    '''
+    Obtenir les arrêts les plus proches pour un lot de coordonnées en un seul appel
+    '''
+    return await run_in_threadpool(
+        find_nearest_stops_batch,
+        [(point.lat, point.lon) for point in request.coordinates], k=request.k, radius=request.radius
+    )
+
+
+@router.get("/metrics")
+async def get_metrics():
+    '''
+    Obtenir les métriques au format texte Prometheus : latences et erreurs par service externe et par étape
+    du chatbot, tokens OpenAI, taux de succès des caches, conversations actives et temps réel
+    '''
+    stats = {
+        "openai": history_stats.stats(),
+        "trip_cache": trip_cache.stats(),
+        "response_cache": response_cache.stats(),
+        "fast_path": fast_path_stats.stats(),
+        "sessions": await run_session_store(session_store.stats),
+        "live": live_hub.stats(),
+        "realtime": realtime.realtime_index.stats(),
+    }
+    return Response(render_metrics(stats), media_type="text/plain; version=0.0.4; charset=utf-8")
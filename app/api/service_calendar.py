@@ -0,0 +1,125 @@
+import numpy as np
+import os
+
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Iterable, List, Optional
+from zoneinfo import ZoneInfo
+
+from app.api.config import db
+from app.api.dataset import register_loader
+
+
+# Fuseau horaire des heures GTFS (les heures des itinéraires calculés localement sont en heure locale)
+GTFS_TIMEZONE = ZoneInfo(os.getenv("GTFS_TIMEZONE", "Europe/Zurich"))
+
+
+def service_day_start(day: date) -> datetime:
+    '''
+    Origine des heures GTFS d'un jour de service (en UTC) : midi heure locale moins 12 h.
+    Les jours de changement d'heure, elle diffère d'une heure de minuit
+    '''
+    noon = datetime.combine(day, time(12), tzinfo=GTFS_TIMEZONE)
+    return noon.astimezone(timezone.utc) - timedelta(hours=12)
+
+
+def gtfs_local_time(day: date, seconds: int) -> datetime:
+    '''
+    Heure locale (sans fuseau) d'une heure GTFS exprimée en secondes depuis l'origine du jour de service
+    '''
+    moment = service_day_start(day) + timedelta(seconds=seconds)
+    return moment.astimezone(GTFS_TIMEZONE).replace(tzinfo=None)
+
+
+def gtfs_seconds(day: date, moment: datetime) -> int:
+    '''
+    Heure locale (sans fuseau) convertie en secondes depuis l'origine du jour de service, comme les heures GTFS
+    '''
+    moment = moment.replace(tzinfo=GTFS_TIMEZONE).astimezone(timezone.utc)
+    return int((moment - service_day_start(day)).total_seconds())
+
+
+class ServiceCalendar:
+    '''
+    Jours de circulation des services GTFS, précalculés par l'ETL sous forme de bitsets.
+    Une ligne par jour de la période de validité : les services actifs un jour donné sont un masque
+    obtenu sans calcul, indexé comme `service_ids` (le dernier élément, toujours faux, sert aux services inconnus)
+    '''
+
+    def __init__(self, service_ids: List[str] = (), start: Optional[date] = None, bitsets: Iterable[bytes] = (), days: int = 0):
+        self.service_ids = list(service_ids)
+        self.service_index = {service_id: index for index, service_id in enumerate(self.service_ids)}
+        self.start = start
+        self.days = days
+
+        bits = np.zeros((len(self.service_ids) + 1, days), dtype=bool)
+        for index, bitset in enumerate(bitsets):
+            bits[index] = np.unpackbits(np.frombuffer(bitset, dtype=np.uint8), count=days).astype(bool)
+        # Stockage par jour pour que le masque d'un jour soit une ligne contiguë
+        self.matrix = np.ascontiguousarray(bits.T)
+        self.inactive = np.zeros(len(self.service_ids) + 1, dtype=bool)
+
+    def __len__(self):
+        return len(self.service_ids)
+
+    @property
+    def unknown_service(self) -> int:
+        '''
+        Indice à utiliser pour un service absent du calendrier (jamais actif)
+        '''
+        return len(self.service_ids)
+
+    def index(self, service_id: str) -> int:
+        return self.service_index.get(service_id, self.unknown_service)
+
+    def day_offset(self, day: date) -> Optional[int]:
+        '''
+        Position du jour dans la période de validité, None en dehors
+        '''
+        if self.start is None:
+            return None
+        offset = (day - self.start).days
+        return offset if 0 <= offset < self.days else None
+
+    def active_services(self, day: date) -> np.ndarray:
+        '''
+        Masque des services circulant le jour donné (lecture seule)
+        '''
+        offset = self.day_offset(day)
+        return self.matrix[offset] if offset is not None else self.inactive
+
+    def is_active(self, service_id: str, day: date) -> bool:
+        return bool(self.active_services(day)[self.index(service_id)])
+
+    def active_service_ids(self, day: date) -> List[str]:
+        return [self.service_ids[index] for index in np.flatnonzero(self.active_services(day)[:-1]).tolist()]
+
+    @property
+    def end(self) -> Optional[date]:
+        '''
+        Dernier jour de la période de validité
+        '''
+        return self.start + timedelta(days=self.days - 1) if self.start is not None and self.days else None
+
+
+# Calendrier partagé par l'application, rechargé à chaque nouvelle version des données
+service_calendar = ServiceCalendar()
+
+
+@register_loader
+def load_service_calendar():
+    '''
+    Charger les bitsets des jours de circulation précalculés lors de l'ETL
+    '''
+    global service_calendar
+
+    entries = list(db.service_calendar.find({}, {"service_id": 1, "start_date": 1, "days": 1, "bits": 1, "_id": 0}))
+    if not entries:
+        service_calendar = ServiceCalendar()
+        return
+
+    service_calendar = ServiceCalendar(
+        service_ids=[str(entry["service_id"]) for entry in entries],
+        start=datetime.strptime(entries[0]["start_date"], "%Y%m%d").date(),
+        bitsets=[bytes(entry["bits"]) for entry in entries],
+        days=int(entries[0]["days"])
+    )
@@ -0,0 +1,164 @@
+import os
+import time
+
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from starlette.concurrency import run_in_threadpool
+from typing import Dict, List, Optional
+
+from app.api.config import base_db
+from app.api.conversation_history import count_leading_messages
+
+
+# Durée d'inactivité au-delà de laquelle une conversation est oubliée (secondes)
+SESSION_TTL = float(os.getenv("SESSION_TTL", "3600"))
+
+# Nombre maximal de conversations conservées en mémoire par processus
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+
+# Nombre maximal de messages conservés dans l'historique d'une conversation
+SESSION_MAX_HISTORY = int(os.getenv("SESSION_MAX_HISTORY", "20"))
+
+
+def trim_history(conversation_history: List[Dict]) -> List[Dict]:
+    '''
+    Historique limité à SESSION_MAX_HISTORY messages : messages système et de bienvenue, puis les plus récents
+    '''
+    if len(conversation_history) <= SESSION_MAX_HISTORY:
+        return conversation_history
+    head = count_leading_messages(conversation_history)
+    tail = max(SESSION_MAX_HISTORY - head, 1)
+    return conversation_history[:head] + conversation_history[head:][-tail:]
+
+
+def compact_session(session: Dict) -> Dict:
+    '''
+    Enregistrement compact d'une conversation : étapes, derniers messages de l'historique et compteur d'erreurs
+    '''
+    return {
+        "steps": session["steps"],
+        "conversation_history": trim_history(session["conversation_history"]),
+        "count_trip_details": session.get("count_trip_details", 0),
+    }
+
+
+class MemorySessionStore:
+    '''
+    Conversations en mémoire du processus : LRU borné avec expiration après une durée d'inactivité
+    '''
+    # Accès en mémoire : appelés directement depuis la boucle d'événements
+    blocking = False
+
+    def __init__(self, max_sessions: int, ttl: float):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.sessions: OrderedDict = OrderedDict()
+        self.expirations = 0
+        self.evictions = 0
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        entry = self.sessions.get(session_id)
+        if entry is None:
+            return None
+
+        expires_at, session = entry
+        if expires_at < time.monotonic():
+            del self.sessions[session_id]
+            self.expirations += 1
+            return None
+        return session
+
+    def save(self, session_id: str, session: Dict):
+        '''
+        Enregistrer la conversation et repousser son expiration, en évinçant les moins récemment utilisées
+        '''
+        self.sessions[session_id] = (time.monotonic() + self.ttl, compact_session(session))
+        self.sessions.move_to_end(session_id)
+
+        # Les conversations sont rangées par dernière utilisation : les expirées sont en tête
+        now = time.monotonic()
+        while self.sessions:
+            oldest_id, (expires_at, _) = next(iter(self.sessions.items()))
+            if expires_at >= now and len(self.sessions) <= self.max_sessions:
+                break
+            del self.sessions[oldest_id]
+            if expires_at < now:
+                self.expirations += 1
+            else:
+                self.evictions += 1
+
+    def delete(self, session_id: str):
+        self.sessions.pop(session_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "backend": "memory",
+            "sessions": len(self.sessions),
+            "max_sessions": self.max_sessions,
+            "ttl": self.ttl,
+            "expirations": self.expirations,
+            "evictions": self.evictions,
+        }
+
+
+class MongoSessionStore:
+    '''
+    Conversations dans MongoDB (base principale), partagées entre les processus de l'application.
+    Un index TTL supprime les conversations inactives
+    '''
+    # Accès MongoDB : exécutés dans le pool de threads pour ne pas bloquer la boucle d'événements
+    blocking = True
+
+    def __init__(self, collection, ttl: float):
+        self.collection = collection
+        self.ttl = ttl
+        self.collection.create_index([("updated_at", 1)], expireAfterSeconds=int(ttl))
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        # La suppression par l'index TTL n'est pas immédiate : ignorer les conversations déjà expirées
+        expires_before = datetime.now(timezone.utc) - timedelta(seconds=self.ttl)
+        return self.collection.find_one(
+            {"_id": session_id, "updated_at": {"$gte": expires_before}}, {"_id": 0, "updated_at": 0}
+        )
+
+    def save(self, session_id: str, session: Dict):
+        self.collection.replace_one(
+            {"_id": session_id},
+            {**compact_session(session), "updated_at": datetime.now(timezone.utc)},
+            upsert=True
+        )
+
+    def delete(self, session_id: str):
+        self.collection.delete_one({"_id": session_id})
+
+    def stats(self) -> dict:
+        expires_before = datetime.now(timezone.utc) - timedelta(seconds=self.ttl)
+        return {
+            "backend": "mongo",
+            "sessions": self.collection.count_documents({"updated_at": {"$gte": expires_before}}),
+            "ttl": self.ttl,
+        }
+
+
+def create_session_store():
+    '''
+    Stockage des conversations selon SESSION_STORE : "memory" (par défaut, un seul processus)
+    ou "mongo" (partagé entre plusieurs processus uvicorn)
+    '''
+    if os.getenv("SESSION_STORE", "memory") == "mongo":
+        return MongoSessionStore(base_db.sessions, SESSION_TTL)
+    return MemorySessionStore(SESSION_MAX_SESSIONS, SESSION_TTL)
+
+
+# Stockage partagé des conversations du chatbot
+session_store = create_session_store()
+
+
+async def run_session_store(method, *args):
+    '''
+    Appeler une méthode du stockage des conversations depuis une route asynchrone, dans le pool de threads
+    si le stockage est bloquant (MongoDB)
+    '''
+    if session_store.blocking:
+        return await run_in_threadpool(method, *args)
+    return method(*args)
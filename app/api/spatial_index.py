@@ -0,0 +1,179 @@
+import math
+import numpy as np
+
+from pydantic import BaseModel, Field
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from app.api.config import db
+from app.api.dataset import register_loader
+
+
+EARTH_RADIUS_M = 6371008.8
+
+
+def haversine(lat: float, lon: float, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    '''
+    Distances en mètres entre un point et un ensemble de points (calcul vectorisé)
+    '''
+    lat1, lon1 = math.radians(lat), math.radians(lon)
+    lats, lons = np.radians(lats), np.radians(lons)
+    a = np.sin((lats - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lats) * np.sin((lons - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+class Coordinates(BaseModel):
+    '''
+    Modèle de données pour une position géographique
+    '''
+    lat: float = Field(ge=-90, le=90)
+    lon: float = Field(ge=-180, le=180)
+
+
+class NearestStopsBatchModel(BaseModel):
+    '''
+    Modèle de données pour une recherche des arrêts les plus proches sur un lot de positions
+    '''
+    coordinates: List[Coordinates] = Field(max_length=1000)
+    k: int = Field(1, ge=1, le=50)
+    radius: Optional[float] = Field(None, gt=0, le=50000)
+
+
+class StopSpatialIndex:
+    '''
+    Grille régulière en latitude/longitude sur les coordonnées des arrêts,
+    pour les recherches des k plus proches voisins et par rayon
+    '''
+
+    def __init__(self, stops: Iterable[Dict] = (), cell_size: float = 0.01):
+        stops = list(stops)
+        self.cell_size = cell_size
+        self.stop_ids = np.array([str(stop["stop_id"]) for stop in stops], dtype=object)
+        self.stop_names = np.array([stop["stop_name"] for stop in stops], dtype=object)
+        lats = np.array([stop["lat"] for stop in stops], dtype=np.float64)
+        lons = np.array([stop["lon"] for stop in stops], dtype=np.float64)
+
+        # Arrêts triés par cellule : chaque cellule correspond à une tranche contiguë des tableaux
+        rows = np.floor(lats / cell_size).astype(np.int64)
+        cols = np.floor(lons / cell_size).astype(np.int64)
+        order = np.lexsort((cols, rows))
+        self.stop_ids, self.stop_names = self.stop_ids[order], self.stop_names[order]
+        self.lats, self.lons = lats[order], lons[order]
+        rows, cols = rows[order], cols[order]
+
+        self.cells: Dict[Tuple[int, int], Tuple[int, int]] = {}
+        self.bounds = (0, 0, 0, 0)
+        if len(order):
+            self.bounds = (int(rows.min()), int(rows.max()), int(cols.min()), int(cols.max()))
+            boundaries = np.flatnonzero((np.diff(rows) != 0) | (np.diff(cols) != 0)) + 1
+            starts = np.concatenate(([0], boundaries))
+            ends = np.concatenate((boundaries, [len(order)]))
+            for start, end in zip(starts.tolist(), ends.tolist()):
+                self.cells[(int(rows[start]), int(cols[start]))] = (start, end)
+
+        # Plus petite largeur d'une cellule en mètres (vers le nord, les méridiens se rapprochent)
+        max_lat = float(np.abs(self.lats).max()) if len(order) else 0.0
+        self.min_cell_width_m = math.radians(cell_size) * EARTH_RADIUS_M * math.cos(math.radians(min(max_lat + cell_size, 89.0)))
+
+    def __len__(self):
+        return len(self.stop_ids)
+
+    def ring_candidates(self, row: int, col: int, ring: int) -> List[np.ndarray]:
+        '''
+        Indices des arrêts des cellules situées exactement à `ring` cellules de la cellule centrale
+        '''
+        slices = []
+        for d_row in range(-ring, ring + 1):
+            step = 1 if abs(d_row) == ring else 2 * ring
+            for d_col in range(-ring, ring + 1, step or 1):
+                cell = self.cells.get((row + d_row, col + d_col))
+                if cell:
+                    slices.append(np.arange(*cell))
+        return slices
+
+    def query(self, lat: float, lon: float, k: Optional[int] = 1, radius: Optional[float] = None,
+              unique_names: bool = True) -> List[Dict]:
+        '''
+        Retourner les arrêts les plus proches (k premiers et/ou dans un rayon en mètres),
+        avec leur distance, en ne gardant par défaut que l'arrêt le plus proche pour chaque nom
+        '''
+        if not len(self) or (k is None and radius is None):
+            return []
+
+        row, col = math.floor(lat / self.cell_size), math.floor(lon / self.cell_size)
+        min_row, max_row, min_col, max_col = self.bounds
+        max_ring = max(abs(row - min_row), abs(row - max_row), abs(col - min_col), abs(col - max_col))
+
+        indices = np.empty(0, dtype=np.int64)
+        distances = np.empty(0)
+        ring = 0
+        while ring <= max_ring:
+            # Loin des arrêts, les anneaux deviennent plus coûteux qu'un calcul sur tous les arrêts
+            if (2 * ring + 1) ** 2 > len(self.cells):
+                indices = np.arange(len(self))
+                distances = haversine(lat, lon, self.lats, self.lons)
+                break
+
+            slices = self.ring_candidates(row, col, ring)
+            if slices:
+                ring_indices = np.concatenate(slices)
+                indices = np.concatenate((indices, ring_indices))
+                distances = np.concatenate((distances, haversine(lat, lon, self.lats[ring_indices], self.lons[ring_indices])))
+
+            # Tout arrêt hors des anneaux déjà parcourus est au moins à cette distance
+            covered = ring * self.min_cell_width_m
+            if radius is not None and covered >= radius:
+                break
+            if radius is None and k is not None and self.count_results(indices, distances, covered, unique_names) >= k:
+                break
+            ring += 1
+
+        if radius is not None:
+            within = distances <= radius
+            indices, distances = indices[within], distances[within]
+
+        order = np.argsort(distances, kind="stable")
+        results = []
+        seen_names = set()
+        for idx, distance in zip(indices[order].tolist(), distances[order].tolist()):
+            name = self.stop_names[idx]
+            if unique_names:
+                if name in seen_names:
+                    continue
+                seen_names.add(name)
+            results.append({"stop_id": self.stop_ids[idx], "stop_name": name, "distance": round(distance, 1)})
+            if k is not None and len(results) >= k:
+                break
+        return results
+
+    def count_results(self, indices: np.ndarray, distances: np.ndarray, max_distance: float, unique_names: bool) -> int:
+        '''
+        Nombre de résultats certains, c'est-à-dire plus proches que toute cellule non encore parcourue
+        '''
+        certain = indices[distances <= max_distance]
+        return len(set(self.stop_names[certain])) if unique_names else len(certain)
+
+    def query_many(self, coordinates: Sequence[Tuple[float, float]], k: Optional[int] = 1,
+                   radius: Optional[float] = None, unique_names: bool = True) -> List[List[Dict]]:
+        '''
+        Résoudre un lot de coordonnées en un seul appel
+        '''
+        return [self.query(lat, lon, k, radius, unique_names) for lat, lon in coordinates]
+
+
+# Index partagé par l'application, reconstruit à chaque nouvelle version des données
+stop_spatial_index = StopSpatialIndex()
+
+
+@register_loader
+def load_stop_spatial_index():
+    '''
+    Construire l'index spatial à partir des coordonnées de la collection des arrêts
+    '''
+    global stop_spatial_index
+
+    stops_cursor = db.stops.find({}, {"stop_id": 1, "stop_name": 1, "stop_lat": 1, "stop_lon": 1, "_id": 0})
+    stop_spatial_index = StopSpatialIndex(
+        {"stop_id": stop["stop_id"], "stop_name": stop["stop_name"], "lat": stop["stop_lat"], "lon": stop["stop_lon"]}
+        for stop in stops_cursor
+        if stop.get("stop_name") and stop.get("stop_lat") is not None and stop.get("stop_lon") is not None
+    )
@@ -0,0 +1,231 @@
+import bisect
+import heapq
+import math
+import re
+import unicodedata
+
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from app.api.config import db
+from app.api.dataset import register_loader
+
+
+# Tout ce qui n'est ni une lettre ni un chiffre est remplacé par un espace
+NON_ALPHANUMERIC = re.compile(r"[^0-9a-z]+")
+
+
+def normalize_stop_name(name: str) -> str:
+    '''
+    Normaliser un nom d'arrêt : minuscules, sans accents et sans ponctuation
+    '''
+    decomposed = unicodedata.normalize("NFKD", name.casefold())
+    without_accents = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return NON_ALPHANUMERIC.sub(" ", without_accents).strip()
+
+
+def trigrams(text: str) -> Set[str]:
+    '''
+    Découper un texte normalisé en trigrammes
+    '''
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def prefix_range(keys: List[str], values: List[int], prefix: str) -> List[int]:
+    '''
+    Retourner les valeurs associées aux clés triées qui commencent par le préfixe
+    '''
+    start = bisect.bisect_left(keys, prefix)
+    end = bisect.bisect_left(keys, prefix + "\x7f", start)
+    return values[start:end]
+
+
+class StopSearchIndex:
+    '''
+    Index n-grammes des noms d'arrêts pour l'autocomplétion
+    '''
+
+    def __init__(self, stop_names: Iterable[str] = ()):
+        # Les identifiants sont attribués par longueur puis ordre alphabétique du nom normalisé,
+        # ce qui sert directement de critère de départage lors du classement
+        entries = sorted((normalize_stop_name(name), name) for name in set(stop_names))
+        entries.sort(key=lambda entry: len(entry[0]))
+        self.normalized: List[str] = [normalized_name for normalized_name, _ in entries]
+        self.names: List[str] = [name for _, name in entries]
+
+        # Noms normalisés triés, pour les recherches par début de nom
+        by_name = sorted(range(len(entries)), key=self.normalized.__getitem__)
+        self.name_keys = [self.normalized[stop_idx] for stop_idx in by_name]
+        self.name_ids = by_name
+
+        # Fins de noms commençant à chaque mot, pour les recherches par début de mot
+        words = sorted(
+            (normalized_name[position + 1:], stop_idx)
+            for stop_idx, normalized_name in enumerate(self.normalized)
+            for position, char in enumerate(normalized_name) if char == " "
+        )
+        self.word_keys = [word for word, _ in words]
+        self.word_ids = [stop_idx for _, stop_idx in words]
+
+        # Trigrammes, pour les recherches au milieu d'un mot
+        self.postings: Dict[str, Set[int]] = {}
+        for stop_idx, normalized_name in enumerate(self.normalized):
+            for trigram in trigrams(normalized_name):
+                self.postings.setdefault(trigram, set()).add(stop_idx)
+
+    def __len__(self):
+        return len(self.names)
+
+    def substring_candidates(self, query: str) -> Set[int]:
+        '''
+        Retourner les arrêts dont le nom normalisé contient la requête
+        '''
+        postings = []
+        for trigram in trigrams(query):
+            posting = self.postings.get(trigram)
+            if not posting:
+                return set()
+            postings.append(posting)
+
+        postings.sort(key=len)
+        matches = postings[0].intersection(*postings[1:])
+        if len(query) == 3:
+            return matches
+        return {stop_idx for stop_idx in matches if query in self.normalized[stop_idx]}
+
+    def search(self, query: str, limit: int = 20, offset: int = 0) -> List[str]:
+        '''
+        Rechercher des arrêts par nom et retourner une page de noms uniques classés par pertinence :
+        nom exact, début du nom, début d'un mot, puis n'importe où dans le nom
+        '''
+        normalized_query = normalize_stop_name(query or "")
+        if not normalized_query:
+            return []
+
+        wanted = offset + limit
+
+        # Le nom exact est le plus court des noms qui commencent par la requête, il sort donc en premier
+        prefix_ids = prefix_range(self.name_keys, self.name_ids, normalized_query)
+        ranked = heapq.nsmallest(wanted, prefix_ids)
+
+        # Les rangs suivants ne sont calculés que si la page n'est pas encore remplie
+        if len(ranked) < wanted:
+            found = set(prefix_ids)
+            word_ids = set(prefix_range(self.word_keys, self.word_ids, normalized_query)) - found
+            ranked += heapq.nsmallest(wanted - len(ranked), word_ids)
+
+            if len(ranked) < wanted and len(normalized_query) >= 3:
+                other_ids = self.substring_candidates(normalized_query) - found - word_ids
+                ranked += heapq.nsmallest(wanted - len(ranked), other_ids)
+
+        return [self.names[stop_idx] for stop_idx in ranked[offset:]]
+
+
+class StopResolver:
+    '''
+    Résolution d'un nom d'arrêt saisi par l'utilisateur vers l'arrêt canonique (ID et nom),
+    tolérante aux accents, à la casse et aux fautes de frappe
+    '''
+
+    def __init__(self, stops: Iterable[Dict] = (), min_similarity: float = 0.75):
+        self.min_similarity = min_similarity
+
+        # Pour chaque nom normalisé, on garde de préférence la station parente, puis l'ID le plus court
+        best: Dict[str, Tuple] = {}
+        for stop in stops:
+            normalized_name = normalize_stop_name(stop["stop_name"])
+            priority = (bool(stop.get("parent_station")), len(str(stop["stop_id"])), str(stop["stop_id"]))
+            if normalized_name not in best or priority < best[normalized_name][0]:
+                best[normalized_name] = (priority, str(stop["stop_id"]), stop["stop_name"])
+
+        self.by_name: Dict[str, Tuple[str, str]] = {
+            normalized_name: (stop_id, stop_name) for normalized_name, (_, stop_id, stop_name) in best.items()
+        }
+
+        # Trigrammes des noms entourés d'espaces, pour la recherche approchée
+        self.fuzzy_names = list(self.by_name)
+        self.fuzzy_trigrams = [trigrams(f"  {normalized_name} ") for normalized_name in self.fuzzy_names]
+        self.postings: Dict[str, List[int]] = {}
+        for name_idx, name_trigrams in enumerate(self.fuzzy_trigrams):
+            for trigram in name_trigrams:
+                self.postings.setdefault(trigram, []).append(name_idx)
+
+        # Listes triées par nombre de trigrammes, pour ne parcourir que les noms de longueur compatible
+        self.posting_sizes: Dict[str, List[int]] = {}
+        for trigram, posting in self.postings.items():
+            posting.sort(key=lambda name_idx: len(self.fuzzy_trigrams[name_idx]))
+            self.posting_sizes[trigram] = [len(self.fuzzy_trigrams[name_idx]) for name_idx in posting]
+
+    def __len__(self):
+        return len(self.by_name)
+
+    def resolve(self, stop_name: str) -> Optional[Tuple[str, str]]:
+        '''
+        Retourner l'ID et le nom canonique de l'arrêt correspondant, ou None si aucun arrêt n'est assez proche
+        '''
+        normalized_name = normalize_stop_name(stop_name or "")
+        if not normalized_name:
+            return None
+
+        exact = self.by_name.get(normalized_name)
+        if exact:
+            return exact
+
+        # Similarité de Dice sur les trigrammes : 2 * trigrammes communs / (trigrammes de la requête + du nom).
+        # Un nom assez similaire partage au moins `min_shared` trigrammes avec la requête, il contient donc
+        # forcément l'un des trigrammes les plus rares : seuls ceux-ci servent à générer les candidats
+        query_trigrams = trigrams(f"  {normalized_name} ")
+        min_shared = math.ceil(self.min_similarity * len(query_trigrams) / (2 - self.min_similarity))
+
+        # Seuls les noms de longueur compatible peuvent atteindre la similarité minimale
+        min_size = len(query_trigrams) * self.min_similarity / (2 - self.min_similarity)
+        max_size = len(query_trigrams) * (2 - self.min_similarity) / self.min_similarity
+
+        candidate_postings = []
+        for trigram in query_trigrams:
+            sizes = self.posting_sizes.get(trigram, [])
+            start = bisect.bisect_left(sizes, min_size)
+            end = bisect.bisect_right(sizes, max_size, start)
+            candidate_postings.append(self.postings.get(trigram, [])[start:end])
+
+        candidate_postings.sort(key=len)
+        candidates = set()
+        for posting in candidate_postings[:len(query_trigrams) - min_shared + 1]:
+            candidates.update(posting)
+
+        best_similarity, best_idx = 0.0, None
+        for name_idx in candidates:
+            name_trigrams = self.fuzzy_trigrams[name_idx]
+            similarity = 2 * len(query_trigrams & name_trigrams) / (len(query_trigrams) + len(name_trigrams))
+            if similarity > best_similarity:
+                best_similarity, best_idx = similarity, name_idx
+
+        if best_idx is None or best_similarity < self.min_similarity:
+            return None
+        return self.by_name[self.fuzzy_names[best_idx]]
+
+
+# Index partagés par l'application, reconstruits à chaque nouvelle version des données
+stop_search_index = StopSearchIndex()
+stop_resolver = StopResolver()
+
+
+@register_loader
+def load_stop_indexes():
+    '''
+    Construire l'index de recherche et le résolveur à partir de la collection des arrêts
+    '''
+    global stop_search_index, stop_resolver
+
+    stops = [
+        stop for stop in db.stops.find({}, {"stop_id": 1, "stop_name": 1, "parent_station": 1, "_id": 0})
+        if stop.get("stop_name") and stop.get("stop_id")
+    ]
+    stop_search_index = StopSearchIndex(stop["stop_name"] for stop in stops)
+    stop_resolver = StopResolver(stops)
+
+
+def resolve_stop(stop_name: str) -> Optional[Tuple[str, str]]:
+    '''
+    Résoudre un nom d'arrêt avec le résolveur partagé
+    '''
+    return stop_resolver.resolve(stop_name)
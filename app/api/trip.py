@@ -1,12 +1,45 @@
-import requests
+import asyncio
+import httpx
+import os
 
-from datetime import datetime
-from fastapi import HTTPException
+from datetime import datetime, timezone
 from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+from typing import Iterable, Iterator, List, Literal
 from xml.etree import ElementTree as ET
+from xml.sax.saxutils import escape
 
+from app.api import journey_planner
 from app.api.config import ojp_api_key, ojp_api_url
-from app.api.utils import find_stop_id, format_datetime
+from app.api.http_clients import ojp_client
+from app.api.itinerary import Leg, Trip
+from app.api.realtime import apply_realtime, GTFS_TIMEZONE
+from app.api.trip_cache import trip_cache
+from app.api.utils import find_stop_id
+
+
+# Profils de requête OJP : "lean" ne demande que ce qui est affiché, "rich" demande tous les détails
+TRIP_REQUEST_PROFILES = {
+    "lean": {
+        "number_of_results": 3,
+        "include_track_sections": False,
+        "include_turn_description": False,
+        "include_intermediate_stops": False,
+    },
+    "rich": {
+        "number_of_results": 10,
+        "include_track_sections": True,
+        "include_turn_description": True,
+        "include_intermediate_stops": True,
+    },
+}
+DEFAULT_TRIP_PROFILE = os.getenv("OJP_TRIP_PROFILE", "lean")
+
+# Source des itinéraires : API OJP ou calcul local sur les horaires GTFS (voir journey_planner)
+DEFAULT_TRIP_MODE = "local" if journey_planner.LOCAL_ROUTING == "local" else "ojp"
+
+# En mode "fallback", délai au-delà duquel l'API OJP est abandonnée au profit du calcul local
+OJP_FALLBACK_TIMEOUT = float(os.getenv("OJP_FALLBACK_TIMEOUT", "5"))
 
 
 class TripRequestModel(BaseModel):
@@ -17,61 +50,132 @@ class TripRequestModel(BaseModel):
     destination_name: str
     date: str  # En format string pour l'API OJP
     time: str  # En format string pour l'API OJP
+    profile: Literal["lean", "rich"] = DEFAULT_TRIP_PROFILE
+    mode: Literal["ojp", "local"] = DEFAULT_TRIP_MODE
 
 
-def parse_response(response_xml):
+# Espaces de noms OJP et SIRI (OJP 1.0 reprend certains éléments de SIRI, ex. siri:StopPointRef)
+# et balises des éléments à traiter
+OJP_NAMESPACE = "{http://www.vdv.de/ojp}"
+SIRI_NAMESPACE = "{http://www.siri.org.uk/siri}"
+NAMESPACES = {"ojp": OJP_NAMESPACE, "siri": SIRI_NAMESPACE}
+TRIP_TAG = f"{OJP_NAMESPACE}Trip"
+TIMED_LEG_TAG = f"{OJP_NAMESPACE}TimedLeg"
+
+
+def qualified_tag(tag):
     '''
-    Analyser la réponse XML de l'API OJP et extraire les détails du trajet pour chaque itinéraire trouvé
+    Balise avec son espace de noms : "siri:StopPointRef" -> "{http://www.siri.org.uk/siri}StopPointRef"
     '''
-    # Parse the XML response
-    root = ET.fromstring(response_xml)
+    prefix, _, name = tag.rpartition(":")
+    return f"{NAMESPACES[prefix or 'ojp']}{name}"
 
-    trip_details = []
-    trip_counter = 1
 
-    # Extraire les détails de chaque trajet
-    for trip in root.findall(".//ojp:Trip", namespaces={"ojp": "http://www.vdv.de/ojp"}):
+def build_leg_fields_tree(paths):
+    '''
+    Transformer les chemins des champs (relatifs à TimedLeg) en arbre de balises parcouru en une seule descente.
+    Une balise est dans l'espace de noms OJP, sauf si elle porte son préfixe ("siri:StopPointRef")
+    '''
+    tree = {}
+    for field, path in paths.items():
+        node = tree
+        tags = [qualified_tag(tag) for tag in path.split("/")]
+        for tag in tags[:-1]:
+            node = node.setdefault(tag, {})
+        node[tags[-1]] = field
+    return tree
+
+
+LEG_FIELDS = build_leg_fields_tree({
+    "origin_stop_ref": "LegBoard/siri:StopPointRef",
+    "origin_name": "LegBoard/StopPointName/Text",
+    "departure_time": "LegBoard/ServiceDeparture/TimetabledTime",
+    "departure_estimated": "LegBoard/ServiceDeparture/EstimatedTime",
+    "destination_stop_ref": "LegAlight/siri:StopPointRef",
+    "destination_name": "LegAlight/StopPointName/Text",
+    "arrival_time": "LegAlight/ServiceArrival/TimetabledTime",
+    "arrival_estimated": "LegAlight/ServiceArrival/EstimatedTime",
+    "journey_ref": "Service/JourneyRef",
+    "line": "Service/PublishedLineName/Text",
+    "direction": "Service/DestinationText/Text",
+})
 
-        trip_description = [f"Trajet n°{trip_counter}:"]  # Initialiser la description du trajet
 
-        # Extraire les détails de chaque étape du trajet
-        for leg in trip.findall(".//ojp:TimedLeg", namespaces={"ojp": "http://www.vdv.de/ojp"}):
-            origin_stop_name_elem = leg.find(".//ns0:LegBoard/ns0:StopPointName/ns0:Text", namespaces={"ns0": "http://www.vdv.de/ojp"})
-            origin_stop_name = origin_stop_name_elem.text if origin_stop_name_elem is not None else "Unknown"
+def extract_leg_fields(elem, tree, fields):
+    '''
+    Extraire les champs d'une étape en ne descendant que dans les balises utiles
+    '''
+    for child in elem:
+        target = tree.get(child.tag)
+        if target is None:
+            continue
+        if isinstance(target, str):
+            # Seule la première valeur trouvée pour un champ est conservée
+            if target not in fields and child.text:
+                fields[target] = child.text
+        else:
+            extract_leg_fields(child, target, fields)
+    return fields
 
-            departure_time_elem = leg.find(".//ns0:LegBoard/ns0:ServiceDeparture/ns0:TimetabledTime", namespaces={"ns0": "http://www.vdv.de/ojp"})
-            departure_time = format_datetime(departure_time_elem.text) if departure_time_elem is not None else "Unknown"
 
-            destination_stop_name_elem = leg.find(".//ns0:LegAlight/ns0:StopPointName/ns0:Text", namespaces={"ns0": "http://www.vdv.de/ojp"})
-            destination_stop_name = destination_stop_name_elem.text if destination_stop_name_elem is not None else "Unknown"
+class TripParser:
+    '''
+    Analyse incrémentale de la réponse XML de l'API OJP : chaque morceau reçu est analysé dès son arrivée
+    et les itinéraires complets sont retournés au fur et à mesure
+    '''
+
+    def __init__(self):
+        self.parser = ET.XMLPullParser(events=("end",))
+        self.legs = []
 
-            arrival_time_elem = leg.find(".//ns0:LegAlight/ns0:ServiceArrival/ns0:TimetabledTime", namespaces={"ns0": "http://www.vdv.de/ojp"})
-            arrival_time = format_datetime(arrival_time_elem.text) if arrival_time_elem is not None else "Unknown"
+    def read_trips(self) -> List[Trip]:
+        trips = []
+        for _, elem in self.parser.read_events():
+            if elem.tag == TIMED_LEG_TAG:
+                self.legs.append(Leg(**extract_leg_fields(elem, LEG_FIELDS, {})))
+                # Libérer la mémoire de l'étape déjà traitée (arrêts intermédiaires, tracés, etc.)
+                elem.clear()
+            elif elem.tag == TRIP_TAG:
+                trips.append(Trip(legs=self.legs))
+                self.legs = []
+                elem.clear()
+        return trips
 
-            line_elem = leg.find(".//ns0:Service/ns0:PublishedLineName/ns0:Text", namespaces={"ns0": "http://www.vdv.de/ojp"})
-            line = line_elem.text if line_elem is not None else "Unknown line"
+    def feed(self, chunk: bytes) -> List[Trip]:
+        self.parser.feed(chunk)
+        return self.read_trips()
 
-            destination_line_elem = leg.find(".//ns0:Service/ns0:DestinationText/ns0:Text", namespaces={"ns0": "http://www.vdv.de/ojp"})
-            destination_line = destination_line_elem.text if destination_line_elem is not None else "Unknown destination"
+    def close(self) -> List[Trip]:
+        self.parser.close()
+        return self.read_trips()
 
-            # Ajouter les détails de l'étape du trajet à la description du trajet
-            trip_description.append(
-                f"Prenez la ligne {line} (direction {destination_line}) de {origin_stop_name} à {departure_time}, puis descendez à {destination_stop_name} à {arrival_time}."
-            )
 
-        # Combiner les détails du trajet en une seule chaîne de caractères
-        full_trip_description = " ".join(trip_description)
-        trip_details.append(full_trip_description)
+def iter_trips(chunks: Iterable[bytes]) -> Iterator[Trip]:
+    '''
+    Analyser la réponse XML de l'API OJP en un seul passage, au fil des morceaux reçus,
+    et produire chaque itinéraire dès qu'il est complet
+    '''
+    parser = TripParser()
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    yield from parser.close()
 
-        trip_counter += 1  # Incrémenter le compteur de trajet pour le prochain trajet
 
-    return trip_details
+def parse_response(response_xml):
+    '''
+    Analyser la réponse XML de l'API OJP et extraire les détails du trajet pour chaque itinéraire trouvé
+    '''
+    return [trip.describe(trip_number) for trip_number, trip in enumerate(iter_trips([response_xml]), start=1)]
 
 
-def create_trip_request_xml(origin_stop_id, origin_name, destination_stop_id, destination_name, date_time_iso):
+def create_trip_request_xml(origin_stop_id, origin_name, destination_stop_id, destination_name, date_time_iso, profile=DEFAULT_TRIP_PROFILE):
     '''
-    Créer une requête XML pour l'API OJP à partir des détails du trajet
+    Créer une requête XML pour l'API OJP à partir des détails du trajet et du profil de requête choisi
     '''
+    params = TRIP_REQUEST_PROFILES[profile]
+    origin_name = escape(origin_name)
+    destination_name = escape(destination_name)
+
     return f"""
     <OJP xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:xsd="http://www.w3.org/2001/XMLSchema" 
     xmlns="http://www.siri.org.uk/siri" version="1.0" xmlns:ojp="http://www.vdv.de/ojp" xsi:schemaLocation="http://www.siri.org.uk/siri ../ojp-xsd-v1.0/OJP.xsd">
@@ -99,11 +203,11 @@ def create_trip_request_xml(origin_stop_id, origin_name, destination_stop_id, de
                         </ojp:PlaceRef>
                     </ojp:Destination>
                     <ojp:Params>
-                        <ojp:NumberOfResults>10</ojp:NumberOfResults>
+                        <ojp:NumberOfResults>{params["number_of_results"]}</ojp:NumberOfResults>
                         <ojp:OptimisationMethod>fastest</ojp:OptimisationMethod>
-                        <ojp:IncludeTrackSections>true</ojp:IncludeTrackSections>
-                        <ojp:IncludeTurnDescription>true</ojp:IncludeTurnDescription>
-                        <ojp:IncludeIntermediateStops>true</ojp:IncludeIntermediateStops>
+                        <ojp:IncludeTrackSections>{str(params["include_track_sections"]).lower()}</ojp:IncludeTrackSections>
+                        <ojp:IncludeTurnDescription>{str(params["include_turn_description"]).lower()}</ojp:IncludeTurnDescription>
+                        <ojp:IncludeIntermediateStops>{str(params["include_intermediate_stops"]).lower()}</ojp:IncludeIntermediateStops>
                     </ojp:Params>
                 </ojp:OJPTripRequest>
             </ServiceRequest>
@@ -112,39 +216,144 @@ def create_trip_request_xml(origin_stop_id, origin_name, destination_stop_id, de
     """
 
 
-def get_trip(trip_request: TripRequestModel):
+def resolve_trip_request(trip_request: TripRequestModel):
     '''
-    Obtenir les détails du trajet entre deux arrêts à une date et une heure spécifiques
+    Résoudre les arrêts et la date de départ d'une demande de trajet
     '''
     origin_stop_id, origin_name = find_stop_id(trip_request.origin_name)
     destination_stop_id, destination_name = find_stop_id(trip_request.destination_name)
 
     date_time_str = f"{trip_request.date}T{trip_request.time}"
-    date_time_iso = datetime.strptime(date_time_str, "%Y-%m-%dT%H:%M:%S").isoformat() + "Z"
+    departure = datetime.strptime(date_time_str, "%Y-%m-%dT%H:%M:%S")
 
-    ojp_request_xml = create_trip_request_xml(
+    return origin_stop_id, origin_name, destination_stop_id, destination_name, departure, trip_request.profile
+
+
+def plan_trip_locally(origin_stop_id, origin_name, destination_stop_id, destination_name, departure, profile):
+    '''
+    Calculer les itinéraires d'une demande de trajet résolue à partir des horaires GTFS locaux
+    '''
+    number_of_results = TRIP_REQUEST_PROFILES[profile]["number_of_results"]
+    trips = journey_planner.plan_trips(origin_stop_id, destination_stop_id, departure, number_of_results)
+    if not trips:
+        return {
+            "response": f"Error: aucun itinéraire trouvé dans les horaires locaux entre {origin_name} et {destination_name}",
+        }
+
+    return {
+        "response": "Itinéraires calculés à partir des horaires théoriques GTFS",
+        "trips": trips,
+        "trip_details": [trip.describe(trip_number) for trip_number, trip in enumerate(trips, start=1)],
+        "source": "local"
+    }
+
+
+def departure_utc(departure: datetime) -> datetime:
+    '''
+    Heure de départ demandée (heure locale suisse, comme les horaires GTFS) convertie en UTC pour l'API OJP
+    '''
+    if departure.tzinfo is None:
+        departure = departure.replace(tzinfo=GTFS_TIMEZONE)
+    return departure.astimezone(timezone.utc)
+
+
+def build_trip_request(origin_stop_id, origin_name, destination_stop_id, destination_name, departure, profile):
+    '''
+    Construire la requête XML OJP correspondant à une demande de trajet résolue
+    '''
+    return create_trip_request_xml(
         origin_stop_id,
         origin_name,
         destination_stop_id,
         destination_name,
-        date_time_iso
+        departure_utc(departure).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        profile
     )
 
-    headers = {
-        'Content-Type': 'application/xml',
-        'Authorization': f'Bearer {ojp_api_key}'
+
+def trip_result(trips: List[Trip]):
+    '''
+    Construire le résultat d'une demande de trajet à partir des itinéraires de l'API OJP. La réponse XML brute
+    n'est pas conservée : seuls les itinéraires extraits sont retournés et mis en cache
+    '''
+    return {
+        "trips": trips,
+        "trip_details": [trip.describe(trip_number) for trip_number, trip in enumerate(trips, start=1)],
+        "source": "ojp"
     }
 
-    response = requests.post(ojp_api_url, data=ojp_request_xml, headers=headers)
 
-    if response.status_code == 200:
-        root = ET.fromstring(response.content)
-        response_text = ET.tostring(root, encoding='unicode', method='xml')
+async def stream_trip(ojp_request_xml):
+    '''
+    Envoyer une requête de trajet à l'API OJP et analyser la réponse au fil des morceaux reçus, sans la conserver
+    en entier ni l'analyser d'un seul bloc dans la boucle d'événements
+    '''
+    async with ojp_client.stream("POST", ojp_api_url, content=ojp_request_xml) as response:
+        if response.status_code != 200:
+            await response.aread()
+            return {
+                "response": f"Error: {response.status_code} - {response.text}",
+            }
+
+        parser = TripParser()
+        trips = []
+        async for chunk in response.aiter_bytes():
+            trips.extend(parser.feed(chunk))
+        trips.extend(parser.close())
+    return trip_result(trips)
+
+
+async def fetch_trip(ojp_request_xml):
+    '''
+    Obtenir les itinéraires d'une requête de trajet auprès de l'API OJP via le client partagé. En mode "fallback",
+    une réponse (reçue en entier) plus lente que OJP_FALLBACK_TIMEOUT est traitée comme une erreur
+    '''
+    timeout = OJP_FALLBACK_TIMEOUT if journey_planner.LOCAL_ROUTING == "fallback" else None
+    try:
+        return await asyncio.wait_for(stream_trip(ojp_request_xml), timeout)
+    except asyncio.TimeoutError:
+        return {
+            "response": f"Error: TimeoutError - pas de réponse de l'API OJP après {timeout} s",
+        }
+    except httpx.HTTPError as e:
         return {
-            "response": response_text,
-            "trip_details": parse_response(response.content)
+            "response": f"Error: {type(e).__name__} - {e}",
         }
-    else:
+    except ET.ParseError as e:
         return {
-            "response": f"Error: {response.status_code} - {response.text}",
+            "response": f"Error: ParseError - réponse XML de l'API OJP invalide ({e})",
         }
+
+
+async def get_resolved_trip_async(resolved, mode):
+    '''
+    Obtenir les détails du trajet d'une demande déjà résolue (arrêts et date de départ) sans bloquer la boucle
+    d'événements. Les demandes pour les mêmes arrêts dans la même tranche horaire partagent le même appel OJP
+    et son résultat en cache. Selon le mode, les itinéraires sont calculés localement, directement ou lorsque
+    l'API OJP échoue. Les étapes sont complétées par les heures estimées de l'index temps réel
+    '''
+    if mode == "local":
+        return apply_realtime(await run_in_threadpool(plan_trip_locally, *resolved))
+
+    origin_stop_id, _, destination_stop_id, _, departure, profile = resolved
+    cache_key = trip_cache.make_key(origin_stop_id, destination_stop_id, departure_utc(departure), profile)
+    result = await trip_cache.get_or_fetch(
+        cache_key,
+        lambda: fetch_trip(build_trip_request(*resolved)),
+        cacheable=lambda result: bool(result.get("trip_details"))
+    )
+
+    if journey_planner.LOCAL_ROUTING == "fallback" and "trip_details" not in result:
+        local_result = await run_in_threadpool(plan_trip_locally, *resolved)
+        if local_result.get("trip_details"):
+            return apply_realtime(local_result)
+    # Les heures estimées sont ajoutées après le cache : elles suivent les dernières données temps réel
+    return apply_realtime(result)
+
+
+async def get_trip_async(trip_request: TripRequestModel):
+    '''
+    Obtenir les détails du trajet entre deux arrêts sans bloquer la boucle d'événements
+    '''
+    resolved = await run_in_threadpool(resolve_trip_request, trip_request)
+    return await get_resolved_trip_async(resolved, trip_request.mode)
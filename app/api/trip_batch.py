@@ -0,0 +1,114 @@
+import asyncio
+import json
+import os
+
+from datetime import datetime
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel, Field
+from starlette.concurrency import run_in_threadpool
+from typing import AsyncIterator, Dict, List, Optional
+
+from app.api.trip import get_resolved_trip_async, TripRequestModel
+from app.api.utils import find_stop_ids
+
+
+# Nombre maximal de demandes par lot et d'itinéraires calculés simultanément pour un lot
+TRIP_BATCH_MAX_SIZE = int(os.getenv("TRIP_BATCH_MAX_SIZE", "5000"))
+TRIP_BATCH_CONCURRENCY = int(os.getenv("TRIP_BATCH_CONCURRENCY", "8"))
+
+
+class TripBatchModel(BaseModel):
+    '''
+    Modèle de données pour un lot de demandes de trajet
+    '''
+    requests: List[TripRequestModel] = Field(min_length=1, max_length=TRIP_BATCH_MAX_SIZE)
+    concurrency: Optional[int] = Field(None, ge=1, le=64)
+
+
+def format_line(data: dict) -> str:
+    '''
+    Ligne NDJSON (un objet JSON compact par ligne)
+    '''
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+def batch_result(result: dict) -> dict:
+    '''
+    Résultat d'une demande du lot prêt à sérialiser : itinéraires, ou message d'erreur
+    (la réponse XML brute de l'API OJP n'est pas renvoyée)
+    '''
+    if result.get("trip_details"):
+        return jsonable_encoder({"trips": result["trips"], "trip_details": result["trip_details"], "source": result["source"]})
+    return {"error": result.get("response")}
+
+
+def resolve_batch(trip_requests: List[TripRequestModel]):
+    '''
+    Résoudre en un seul passage les arrêts de toutes les demandes, puis regrouper les demandes identiques.
+    Retourne les demandes résolues avec les indices du lot qu'elles servent, et les erreurs par indice
+    '''
+    stops = find_stop_ids(
+        name for trip_request in trip_requests for name in (trip_request.origin_name, trip_request.destination_name)
+    )
+
+    groups: Dict[tuple, List[int]] = {}
+    resolved_requests: Dict[tuple, tuple] = {}
+    errors: Dict[int, str] = {}
+    for index, trip_request in enumerate(trip_requests):
+        origin, destination = stops[trip_request.origin_name], stops[trip_request.destination_name]
+        if origin is None or destination is None:
+            missing = trip_request.origin_name if origin is None else trip_request.destination_name
+            errors[index] = f"Stop '{missing}' not found"
+            continue
+        try:
+            departure = datetime.strptime(f"{trip_request.date}T{trip_request.time}", "%Y-%m-%dT%H:%M:%S")
+        except ValueError as e:
+            errors[index] = f"Invalid date or time: {e}"
+            continue
+
+        resolved = (*origin, *destination, departure, trip_request.profile)
+        key = resolved + (trip_request.mode,)
+        groups.setdefault(key, []).append(index)
+        resolved_requests[key] = resolved
+    return groups, resolved_requests, errors
+
+
+async def plan_trips_batch(batch: TripBatchModel) -> AsyncIterator[str]:
+    '''
+    Calculer les itinéraires d'un lot de demandes et les transmettre en NDJSON au fur et à mesure,
+    dans l'ordre où ils sont obtenus (chaque ligne indique l'indice de la demande dans le lot).
+    Les demandes identiques ne sont calculées qu'une fois, avec au plus `concurrency` calculs simultanés
+    '''
+    groups, resolved_requests, errors = await run_in_threadpool(resolve_batch, batch.requests)
+    for index, error in errors.items():
+        yield format_line({"index": index, "error": error})
+
+    # Pool de `concurrency` tâches qui prennent les demandes dans une file : le nombre de tâches ne dépend pas
+    # de la taille du lot
+    concurrency = min(batch.concurrency or TRIP_BATCH_CONCURRENCY, len(groups))
+    requests: asyncio.Queue = asyncio.Queue()
+    for key in groups:
+        requests.put_nowait(key)
+    results: asyncio.Queue = asyncio.Queue(maxsize=concurrency)
+
+    async def worker():
+        while not requests.empty():
+            key = requests.get_nowait()
+            try:
+                result = await get_resolved_trip_async(resolved_requests[key], key[-1])
+            except Exception as e:
+                result = {"response": f"Error: {type(e).__name__} - {e}"}
+            await results.put((key, result))
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        for _ in range(len(groups)):
+            key, result = await results.get()
+            # Résultat sérialisé une seule fois pour toutes les demandes identiques
+            payload = batch_result(result)
+            for index in groups[key]:
+                yield format_line({"index": index, **payload})
+    finally:
+        # Client déconnecté : abandonner les calculs restants
+        for task in workers:
+            task.cancel()
@@ -0,0 +1,133 @@
+import asyncio
+import functools
+import os
+import time
+
+from collections import OrderedDict
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Hashable
+
+
+class InFlight:
+    '''
+    Appel OJP en cours, exécuté dans sa propre tâche, et nombre de requêtes qui attendent son résultat
+    '''
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class TripCache:
+    '''
+    Cache LRU à durée de vie limitée des résultats OJP, avec regroupement des requêtes identiques simultanées
+    '''
+
+    def __init__(self, max_size: int, ttl: float, bucket_seconds: int):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.bucket_seconds = bucket_seconds
+        self.entries: OrderedDict = OrderedDict()
+        self.in_flight: Dict[Hashable, InFlight] = {}
+
+        # Compteurs pour ajuster la taille des tranches horaires
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def make_key(self, origin_stop_id: str, destination_stop_id: str, departure: datetime, *extra) -> tuple:
+        '''
+        Clé du cache : arrêts de départ et d'arrivée, tranche horaire de départ et paramètres supplémentaires
+        '''
+        bucket = int(departure.timestamp()) // self.bucket_seconds
+        return (origin_stop_id, destination_stop_id, bucket) + extra
+
+    def get(self, key):
+        '''
+        Retourner le résultat en cache s'il est encore valide
+        '''
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self.entries[key]
+            return None
+
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        '''
+        Ajouter un résultat au cache en évinçant les moins récemment utilisés au-delà de la taille maximale
+        '''
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    async def fetch_and_store(self, key, fetch: Callable[[], Awaitable[dict]], cacheable: Callable[[dict], bool]):
+        value = await fetch()
+        if cacheable(value):
+            self.put(key, value)
+        return value
+
+    def forget(self, key, flight: InFlight, _task=None):
+        if self.in_flight.get(key) is flight:
+            del self.in_flight[key]
+
+    async def get_or_fetch(self, key, fetch: Callable[[], Awaitable[dict]], cacheable: Callable[[dict], bool] = bool):
+        '''
+        Retourner le résultat en cache, ou l'obtenir une seule fois pour toutes les requêtes identiques en cours.
+        L'appel s'exécute dans une tâche du cache : l'annulation d'une requête (client déconnecté) ne touche pas
+        les autres requêtes qui attendent le même résultat, et l'appel n'est abandonné que si plus personne ne l'attend
+        '''
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        flight = self.in_flight.get(key)
+        if flight is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            flight = InFlight(asyncio.get_running_loop().create_task(self.fetch_and_store(key, fetch, cacheable)))
+            self.in_flight[key] = flight
+            flight.task.add_done_callback(functools.partial(self.forget, key, flight))
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                flight.task.cancel()
+
+    def stats(self) -> dict:
+        '''
+        Statistiques d'utilisation du cache
+        '''
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "bucket_seconds": self.bucket_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "hit_ratio": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+        }
+
+
+# Cache partagé des résultats de trajets OJP
+trip_cache = TripCache(
+    max_size=int(os.getenv("TRIP_CACHE_SIZE", "1000")),
+    ttl=float(os.getenv("TRIP_CACHE_TTL", "300")),
+    bucket_seconds=int(os.getenv("TRIP_CACHE_BUCKET", "300"))
+)
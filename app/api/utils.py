@@ -1,10 +1,12 @@
-import requests
+import json
+import re
 
 from datetime import datetime
 from fastapi import HTTPException
 from pymongo.collection import Collection
-from typing import List, Dict
+from typing import Dict, Iterable, List, Optional, Tuple
 
+from app.api import spatial_index, stop_index
 from app.api.config import db
 
 
@@ -12,89 +14,130 @@ def format_datetime(datetime_str):
     '''
     Formater une date et heure au format "dd.mm.yyyy HH:MM:SS"
     '''
-    dt = datetime.strptime(datetime_str, "%Y-%m-%dT%H:%M:%SZ")
+    # Format habituel de l'API OJP "YYYY-MM-DDTHH:MM:SSZ" : découpage direct, sans passer par strptime
+    if len(datetime_str) == 20 and datetime_str[10] == "T" and datetime_str[19] == "Z":
+        return f"{datetime_str[8:10]}.{datetime_str[5:7]}.{datetime_str[:4]} {datetime_str[11:19]}"
+
+    dt = datetime.fromisoformat(datetime_str)
     return dt.strftime("%d.%m.%Y %H:%M:%S")
 
 
+def format_event(event: str, data: Dict) -> str:
+    '''
+    Message au format Server-Sent Events
+    '''
+    return f"event: {event}\ndata: {json.dumps(data, default=str, separators=(',', ':'))}\n\n"
+
+
+def find_stop_in_db(stop_name: str):
+    '''
+    Rechercher un arrêt par son nom exact (sans tenir compte de la casse) directement dans MongoDB
+    '''
+    return db.stops.find_one({"stop_name": {"$regex": f"^{re.escape(stop_name)}$", "$options": "i"}})
+
+
 def find_stop_id(stop_name: str):
     '''
     Rechercher un arrêt par son nom et retourner son ID et son nom
     '''
-    stop = db.stops.find_one({"stop_name": {"$regex": f"^{stop_name}$", "$options": "i"}})
-    if stop:
-        return stop["stop_id"], stop["stop_name"]
+    if len(stop_index.stop_resolver):
+        stop = stop_index.resolve_stop(stop_name)
+        if stop:
+            return stop
     else:
-        raise HTTPException(status_code=404, detail=f"Stop '{stop_name}' not found")
+        stop = find_stop_in_db(stop_name)
+        if stop:
+            return stop["stop_id"], stop["stop_name"]
+
+    raise HTTPException(status_code=404, detail=f"Stop '{stop_name}' not found")
+
+
+def find_stop_ids(stop_names: Iterable[str]) -> Dict[str, Optional[Tuple[str, str]]]:
+    '''
+    Rechercher en un seul passage l'ID et le nom de plusieurs arrêts (None pour les arrêts introuvables)
+    '''
+    stop_names = set(stop_names)
+    if len(stop_index.stop_resolver):
+        return {stop_name: stop_index.resolve_stop(stop_name) for stop_name in stop_names}
+
+    # L'index n'est pas encore construit : une seule requête MongoDB pour tous les noms exacts
+    patterns = [re.compile(f"^{re.escape(stop_name)}$", re.IGNORECASE) for stop_name in stop_names]
+    found = {}
+    for stop in db.stops.find({"stop_name": {"$in": patterns}}, {"stop_id": 1, "stop_name": 1, "_id": 0}):
+        found.setdefault(stop["stop_name"].casefold(), (stop["stop_id"], stop["stop_name"]))
+    return {stop_name: found.get(stop_name.casefold()) for stop_name in stop_names}
 
 
 def verify_stop_exists(stop_name: str):
     '''
     Vérifier si un arrêt existe dans la base de données
     '''
-    stop = db.stops.find_one({"stop_name": {"$regex": f"^{stop_name}$", "$options": "i"}})
+    if len(stop_index.stop_resolver):
+        stop = stop_index.resolve_stop(stop_name)
+        return stop[1] if stop else None
+
+    stop = find_stop_in_db(stop_name)
     if stop:
         return stop['stop_name']
     return None
 
 
-def search_stops(db_collection: Collection, query: str) -> List[Dict[str, str]]:
+def search_stops(db_collection: Collection, query: str, limit: int = 20, offset: int = 0) -> List[Dict[str, str]]:
     '''
     Rechercher des arrêts par nom et retourner une liste d'arrêts uniques
     '''
-    stops_cursor = db_collection.find({"stop_name": {"$regex": query, "$options": "i"}})
-    stops = list(stops_cursor)
-    unique_stops = {}
+    if not query:
+        return []
 
-    for stop in stops:
-        stop_name = stop["stop_name"]
-        if stop_name not in unique_stops:
-            unique_stops[stop_name] = stop
+    if len(stop_index.stop_search_index):
+        stop_names = stop_index.stop_search_index.search(query, limit, offset)
+    else:
+        # L'index n'est pas encore construit : recherche directe dans MongoDB
+        stop_names = db_collection.distinct("stop_name", {"stop_name": {"$regex": re.escape(query), "$options": "i"}})
+        stop_names = stop_names[offset:offset + limit]
 
-    return [{"stop_name": stop["stop_name"]} for stop in unique_stops.values()]
+    return [{"stop_name": stop_name} for stop_name in stop_names]
 
 
-def get_coordinates_from_address(address):
+def find_nearest_stops(latitude, longitude, k=5, radius=None):
     """
-    Utilise l'API Nominatim d'OpenStreetMap pour obtenir les coordonnées (latitude et longitude) d'une adresse donnée.
+    Trouve les arrêts les plus proches de coordonnées géographiques, avec leur distance en mètres.
     """
-    url = "https://nominatim.openstreetmap.org/search"
-    params = {
-        'q': address,
-        'format': 'json',
-        'limit': 1,
-        'countrycodes': 'CH',
-        'accept-language': 'fr'
-    }
-    headers = {
-        'User-Agent': 'API Client'
-    }
-
-    response = requests.get(url, params=params, headers=headers)
-    if response.status_code == 200 and response.json():
-        result = response.json()[0]
-        return float(result['lat']), float(result['lon'])
-    else:
-        return None
+    if len(spatial_index.stop_spatial_index):
+        return spatial_index.stop_spatial_index.query(latitude, longitude, k=k, radius=radius)
+
+    # L'index n'est pas encore construit : recherche géospatiale directe dans MongoDB
+    query = {"$geometry": {"type": "Point", "coordinates": [longitude, latitude]}}
+    if radius is not None:
+        query["$maxDistance"] = radius
+
+    nearest_stops = []
+    for stop in db.stops.find({"location": {"$near": query}}, {"stop_id": 1, "stop_name": 1, "stop_lat": 1, "stop_lon": 1}):
+        if any(nearest_stop["stop_name"] == stop["stop_name"] for nearest_stop in nearest_stops):
+            continue
+        distance = spatial_index.haversine(latitude, longitude, stop["stop_lat"], stop["stop_lon"])
+        nearest_stops.append({"stop_id": str(stop["stop_id"]), "stop_name": stop["stop_name"], "distance": round(float(distance), 1)})
+        if k is not None and len(nearest_stops) >= k:
+            break
+    return nearest_stops
+
+
+def find_nearest_stops_batch(coordinates, k=5, radius=None):
+    """
+    Trouve les arrêts les plus proches pour un lot de coordonnées (latitude, longitude).
+    """
+    if len(spatial_index.stop_spatial_index):
+        return spatial_index.stop_spatial_index.query_many(coordinates, k=k, radius=radius)
+    return [find_nearest_stops(latitude, longitude, k=k, radius=radius) for latitude, longitude in coordinates]
 
 
 def find_nearest_stop(latitude, longitude):
     """
-    Trouve l'arrêt de bus le plus proche dans MongoDB à partir de coordonnées géographiques.
+    Trouve l'arrêt de bus le plus proche à partir de coordonnées géographiques.
     """
-    location_requested = [longitude, latitude]
-
-    nearest_stop = db.stops.find_one({
-        "location": {
-            "$near": {
-                "$geometry": {
-                    "type": "Point",
-                    "coordinates": location_requested
-                }
-            }
-        }
-    })
-
-    if nearest_stop:
-        return nearest_stop['stop_name']
+    nearest_stops = find_nearest_stops(latitude, longitude, k=1)
+
+    if nearest_stops:
+        return nearest_stops[0]['stop_name']
     else:
         return None
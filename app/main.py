@@ -1,11 +1,35 @@
+import asyncio
+import os
+
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.responses import FileResponse
 from fastapi.staticfiles import StaticFiles
 
+from app.api.chatbot import warm_up_response_cache
+from app.api.dataset import watch_dataset
+from app.api.http_clients import close_http_clients
+from app.api.realtime import watch_realtime
 from app.api.routes import router as api_router
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    '''
+    Charger les données GTFS en mémoire au démarrage, générer les réponses en cache du chatbot et surveiller
+    les rechargements de l'ETL et les mises à jour temps réel, puis fermer les connexions HTTP persistantes à l'arrêt
+    '''
+    response_cache_warmup = asyncio.create_task(warm_up_response_cache())
+    dataset_watcher = asyncio.create_task(watch_dataset(float(os.getenv("DATASET_REFRESH_INTERVAL", "60"))))
+    realtime_watcher = asyncio.create_task(watch_realtime(float(os.getenv("REALTIME_REFRESH_INTERVAL", "15"))))
+    yield
+    response_cache_warmup.cancel()
+    realtime_watcher.cancel()
+    dataset_watcher.cancel()
+    await close_http_clients()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.include_router(api_router)
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
@@ -39,20 +39,52 @@ async function sendMessage() {
     chatBox.scrollTop = chatBox.scrollHeight;
 
     try {
-        // Envoyer le message au serveur FastAPI
-        const response = await fetch('/ask', {
+        // Envoyer le message au serveur FastAPI et afficher la réponse au fil de sa génération
+        const response = await fetch('/ask/stream', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ query: message, session_id: sessionId })
+            body: JSON.stringify({ query: message, session_id: sessionId, language: navigator.language })
         });
+        if (!response.ok) throw new Error(`HTTP ${response.status}`);
 
-        const data = await response.json();
         const botReply = document.createElement('div');
         botReply.classList.add('message', 'bot');
-        
-        botReply.innerHTML = marked.parse(data.gpt_answer);
-        chatBox.appendChild(botReply);
-        chatBox.scrollTop = chatBox.scrollHeight;
+        let answer = '';
+        let renderScheduled = false;
+
+        // Le Markdown est rendu au plus une fois par image affichée
+        const render = () => {
+            if (renderScheduled) return;
+            renderScheduled = true;
+            requestAnimationFrame(() => {
+                renderScheduled = false;
+                botReply.innerHTML = marked.parse(answer);
+                chatBox.scrollTop = chatBox.scrollHeight;
+            });
+        };
+
+        await readEvents(response, (event, data) => {
+            if (event === 'token') {
+                if (!botReply.isConnected) {
+                    spinner.classList.add('hidden');
+                    chatBox.appendChild(botReply);
+                }
+                answer += data.text;
+                render();
+            } else if (event === 'reset') {
+                answer = '';
+                render();
+            } else if (event === 'done') {
+                answer = data.gpt_answer;
+                if (!botReply.isConnected) chatBox.appendChild(botReply);
+                render();
+                if (data.follow && data.follow.length) {
+                    followTrips(data.follow);
+                }
+            } else if (event === 'error') {
+                throw new Error(data.detail);
+            }
+        });
     } catch (error) {
         console.error('Error:', error);
         const botReply = document.createElement('div');
@@ -70,6 +102,83 @@ async function sendMessage() {
     }
 }
 
+// Lire une réponse Server-Sent Events envoyée à une requête POST (EventSource ne gère que GET)
+async function readEvents(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const block = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+
+            let event = 'message';
+            let data = '';
+            block.split('\n').forEach(line => {
+                if (line.startsWith('event: ')) event = line.slice(7);
+                else if (line.startsWith('data: ')) data += line.slice(6);
+            });
+            if (data) onEvent(event, JSON.parse(data));
+        }
+    }
+}
+
+// Suivi en direct des courses de l'itinéraire proposé (Server-Sent Events)
+let liveSource = null;
+
+function followTrips(trips) {
+    if (liveSource) {
+        liveSource.close();
+    }
+
+    const followed = {};
+    const params = new URLSearchParams();
+    trips.forEach(trip => {
+        followed[trip.trip] = trip;
+        params.append('trip', trip.trip);
+    });
+
+    liveSource = new EventSource(`/live?${params.toString()}`);
+    liveSource.addEventListener('trip_update', event => {
+        const update = JSON.parse(event.data);
+        const key = followed[update.trip_id] ? update.trip_id : update.journey_ref;
+        const trip = followed[key];
+        if (!trip || update.removed) return;
+
+        const name = `Ligne ${trip.line} (${trip.origin_name} → ${trip.destination_name})`;
+        let text = null;
+        if (update.canceled) {
+            text = `⚠️ ${name} : course supprimée`;
+        } else if (update.delay >= 60) {
+            text = `⏱️ ${name} : retard jusqu'à ${Math.round(update.delay / 60)} min`;
+        } else {
+            text = `✅ ${name} : à l'heure`;
+        }
+        showLiveStatus(key, text, update.canceled || update.delay >= 60);
+    });
+}
+
+function showLiveStatus(key, text, important) {
+    const chatBox = document.getElementById('chat-box');
+    let status = document.getElementById(`live-${key}`);
+    if (!status) {
+        // Une course à l'heure n'est signalée que si elle a été annoncée en retard
+        if (!important) return;
+        status = document.createElement('div');
+        status.id = `live-${key}`;
+        status.classList.add('message', 'bot');
+        chatBox.appendChild(status);
+    }
+    status.textContent = text;
+    chatBox.scrollTop = chatBox.scrollHeight;
+}
+
 // Activer les entrées utilisateur après le chargement de la page
 window.onload = function() {
     document.getElementById('user-input').disabled = false;
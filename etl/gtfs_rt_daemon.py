@@ -0,0 +1,183 @@
+import os
+import requests
+import time
+
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+from google.protobuf.message import DecodeError
+from google.transit import gtfs_realtime_pb2
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from gtfs_rt_download import trip_update_document
+
+
+load_dotenv()
+
+
+# Les données temps réel sont indépendantes des versions des données statiques : elles sont dans la base principale
+mongo_client = MongoClient(os.getenv('MONGO_URI'))
+base_db = mongo_client[os.getenv('MONGO_DB')]
+
+# Intervalle entre deux interrogations du flux et durée de vie d'une mise à jour qui n'est plus publiée (secondes)
+GTFS_RT_INTERVAL = float(os.getenv('GTFS_RT_INTERVAL', '30'))
+GTFS_RT_TTL = int(os.getenv('GTFS_RT_TTL', '1800'))
+
+UPSERT_BATCH_SIZE = 1000
+
+# Code d'erreur MongoDB d'une clé unique déjà présente
+DUPLICATE_KEY_ERROR = 11000
+
+
+def remove_duplicate_trips(collection):
+    '''
+    Ne garder que le document le plus récent de chaque course (avant la création de l'index unique)
+    '''
+    duplicates = collection.aggregate([
+        {"$sort": {"updated_at": -1}},
+        {"$group": {"_id": "$trip_id", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ], allowDiskUse=True)
+    for duplicate in duplicates:
+        collection.delete_many({"_id": {"$in": duplicate["ids"][1:]}})
+
+
+def ensure_indexes(db):
+    '''
+    Index de la collection des mises à jour : clé unique par course, date de mise à jour et expiration automatique
+    '''
+    collection = db.trip_updates
+    # Migration : les documents des anciens imports sans date de mise à jour ne seraient jamais expirés
+    collection.delete_many({"updated_at": {"$exists": False}})
+
+    index = collection.index_information().get("trip_id_1")
+    if index is not None and not index.get("unique"):
+        remove_duplicate_trips(collection)
+        collection.drop_index("trip_id_1")
+    collection.create_index([("trip_id", 1)], unique=True)
+    collection.create_index([("updated_at", 1)], expireAfterSeconds=GTFS_RT_TTL)
+
+
+def fetch_feed(session, url, last_modified=None):
+    '''
+    Télécharger le flux GTFS Realtime (protobuf). Retourne (contenu, Last-Modified), contenu None si inchangé
+    '''
+    headers = {'If-Modified-Since': last_modified} if last_modified else {}
+    response = session.get(url, headers=headers, timeout=(5, 30))
+    if response.status_code == 304:
+        return None, last_modified
+    response.raise_for_status()
+    return response.content, response.headers.get('Last-Modified')
+
+
+def trip_update_operation(trip_update, feed_timestamp, updated_at):
+    '''
+    Upsert d'une course qui ne remplace que les données d'un flux plus ancien. Une course plus récente en base
+    ne correspond pas au filtre : l'insertion échoue alors sur l'index unique et la course est conservée.
+    Sans horodatage (ancien instantané de l'ETL), seules les courses absentes sont ajoutées
+    '''
+    document = {**trip_update, "feed_timestamp": feed_timestamp, "updated_at": updated_at}
+    if feed_timestamp is None:
+        return UpdateOne({"trip_id": trip_update['trip_id']}, {"$setOnInsert": document}, upsert=True)
+    return UpdateOne(
+        {
+            "trip_id": trip_update['trip_id'],
+            "$or": [{"feed_timestamp": {"$lt": feed_timestamp}}, {"feed_timestamp": None}],
+        },
+        {"$set": document},
+        upsert=True
+    )
+
+
+def upsert_trip_updates(collection, trip_updates, feed_timestamp):
+    '''
+    Enregistrer les mises à jour par course (upserts en bulk par trip_id) si elles sont plus récentes que
+    celles en base. La date de mise à jour sert à l'expiration et au rafraîchissement incrémental côté API.
+    Retourne le nombre de courses enregistrées
+    '''
+    updated_at = datetime.now(timezone.utc)
+    operations = [
+        trip_update_operation(trip_update, feed_timestamp, updated_at)
+        for trip_update in trip_updates
+        if trip_update['trip_id']
+    ]
+
+    stale = 0
+    for start in range(0, len(operations), UPSERT_BATCH_SIZE):
+        try:
+            collection.bulk_write(operations[start:start + UPSERT_BATCH_SIZE], ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get('writeErrors', [])
+            if any(error['code'] != DUPLICATE_KEY_ERROR for error in errors):
+                raise
+            # Courses déjà enregistrées depuis un flux plus récent
+            stale += len(errors)
+    return len(operations) - stale
+
+
+def poll_once(session, state):
+    '''
+    Interroger le flux une fois et appliquer les mises à jour si son horodatage a changé
+    '''
+    started = time.monotonic()
+    content, state['last_modified'] = fetch_feed(session, os.getenv('GTFS_RT_URL'), state.get('last_modified'))
+    state['polls'] += 1
+    if content is None:
+        state['skipped'] += 1
+        return
+
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.ParseFromString(content)
+    feed_timestamp = feed.header.timestamp
+    if feed_timestamp and feed_timestamp == state.get('feed_timestamp'):
+        state['skipped'] += 1
+        return
+
+    trip_updates = [trip_update_document(entity.trip_update) for entity in feed.entity if entity.HasField('trip_update')]
+    # Flux sans horodatage : les données sont datées de leur réception
+    upserts = upsert_trip_updates(base_db.trip_updates, trip_updates, feed_timestamp or int(time.time()))
+    duration = time.monotonic() - started
+
+    state['feed_timestamp'] = feed_timestamp
+    state['upserts'] += upserts
+    status = {
+        "feed_timestamp": feed_timestamp,
+        "fetched_at": datetime.now(timezone.utc),
+        # Retard du flux : âge des données au moment où elles sont enregistrées
+        "lag_seconds": round(time.time() - feed_timestamp, 1) if feed_timestamp else None,
+        "entities": len(feed.entity),
+        "upserts": upserts,
+        "duration_seconds": round(duration, 3),
+        "upserts_per_second": round(upserts / duration, 1) if duration else None,
+        "polls": state['polls'],
+        "skipped_polls": state['skipped'],
+        "total_upserts": state['upserts'],
+    }
+    base_db.gtfs_metadata.replace_one({"_id": "realtime"}, status, upsert=True)
+    print(f"{upserts} courses mises à jour en {duration:.2f} s (retard du flux {status['lag_seconds']} s)")
+
+
+def run_daemon():
+    '''
+    Interroger le flux GTFS Realtime en continu
+    '''
+    ensure_indexes(base_db)
+    session = requests.Session()
+    session.headers['Authorization'] = f"Bearer {os.getenv('GTFS_RT_TOKEN')}"
+    state = {'polls': 0, 'skipped': 0, 'upserts': 0}
+
+    print(f"Interrogation du flux GTFS Realtime toutes les {GTFS_RT_INTERVAL} s")
+    while True:
+        started = time.monotonic()
+        try:
+            poll_once(session, state)
+        except (requests.RequestException, DecodeError, PyMongoError) as e:
+            print(f"Erreur lors de la récupération des données GTFS Realtime : {e}")
+        time.sleep(max(GTFS_RT_INTERVAL - (time.monotonic() - started), 0))
+
+
+if __name__ == '__main__':
+    try:
+        run_daemon()
+    except KeyboardInterrupt:
+        print('Arrêt du démon GTFS Realtime')
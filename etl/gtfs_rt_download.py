@@ -35,38 +35,54 @@ def parse_gtfs_realtime_data(data):
     feed = gtfs_realtime_pb2.FeedMessage()
     feed.ParseFromString(data)
 
-    trip_updates = []
-
     print(f"Number of entities: {len(feed.entity)}")
 
-    for entity in feed.entity:
-        if entity.HasField('trip_update'):
-            trip_update = entity.trip_update
-            stop_time_updates = []
-            for update in trip_update.stop_time_update:
-                stop_time_updates.append({
-                    'stop_id': update.stop_id,
-                    'arrival': update.arrival.time if update.HasField('arrival') else None,
-                    'departure': update.departure.time if update.HasField('departure') else None
-                })
-            trip_updates.append({
-                'type': 'trip_update',
-                'trip_id': trip_update.trip.trip_id,
-                'route_id': trip_update.trip.route_id,
-                'stop_time_updates': stop_time_updates
-            })
+    trip_updates = [
+        trip_update_document(entity.trip_update)
+        for entity in feed.entity
+        if entity.HasField('trip_update')
+    ]
 
     return {
+        'feed_timestamp': feed.header.timestamp or None,
         'trip_updates': trip_updates
     }
 
 
+def trip_update_document(trip_update):
+    """
+    Convertir une entité TripUpdate en document (heures prévues en timestamps Unix, retards en secondes)
+    """
+    stop_time_updates = []
+    for update in trip_update.stop_time_update:
+        has_arrival = update.HasField('arrival')
+        has_departure = update.HasField('departure')
+        stop_time_updates.append({
+            'stop_id': update.stop_id,
+            'stop_sequence': update.stop_sequence if update.HasField('stop_sequence') else None,
+            'arrival': update.arrival.time if has_arrival and update.arrival.time else None,
+            'arrival_delay': update.arrival.delay if has_arrival and update.arrival.HasField('delay') else None,
+            'departure': update.departure.time if has_departure and update.departure.time else None,
+            'departure_delay': update.departure.delay if has_departure and update.departure.HasField('delay') else None,
+            'skipped': update.schedule_relationship == update.SKIPPED,
+        })
+
+    return {
+        'type': 'trip_update',
+        'trip_id': trip_update.trip.trip_id,
+        'route_id': trip_update.trip.route_id,
+        'start_date': trip_update.trip.start_date or None,
+        'canceled': trip_update.trip.schedule_relationship == trip_update.trip.CANCELED,
+        'stop_time_updates': stop_time_updates
+    }
+
+
 def save_data_to_json(data, filename):
     """
     Enregistrer les données GTFS Realtime dans un fichier JSON
     """
     with open(filename, 'w') as f:
-        json.dump(data, f, indent=4)
+        json.dump(data, f, separators=(',', ':'))
     print(f'Données GTFS Realtime enregistrées dans {filename}')
 
 
@@ -79,4 +95,4 @@ if __name__ == '__main__':
         parsed_data = parse_gtfs_realtime_data(realtime_data)
 
         # Enregistrer les données dans des fichiers JSON
-        save_data_to_json(parsed_data['trip_updates'], 'etl/gtfs_rt_data/trip_updates.json')
+        save_data_to_json(parsed_data, 'etl/gtfs_rt_data/trip_updates.json')
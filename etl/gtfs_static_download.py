@@ -1,3 +1,7 @@
+import base64
+import binascii
+import hashlib
+import json
 import os
 import requests
 import zipfile
@@ -9,13 +13,21 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
+GTFS_DATA_DIR = os.path.join('etl', 'gtfs_data')
+
+# Métadonnées du dernier téléchargement (URL, fichier, ETag, Last-Modified, taille, SHA-256)
+DOWNLOAD_METADATA_PATH = os.path.join(GTFS_DATA_DIR, 'gtfs_static.json')
+
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+
+
 def get_latest_zip_url():
     '''
     Obtenir l'URL du dernier fichier zip de données GTFS statiques
     '''
     # Obtenir l'URL du dernier fichier zip
     dataset_url = os.getenv('GTFS_STATIC_URL')
-    response = requests.get(dataset_url)
+    response = requests.get(dataset_url, timeout=30)
     soup = BeautifulSoup(response.text, 'html.parser')
 
     # Trouver la section contenant les ressources et les liens
@@ -30,67 +42,200 @@ def get_latest_zip_url():
     return None
 
 
-def get_existing_zip_file(directory):
+def load_download_metadata():
+    '''
+    Lire les métadonnées du dernier téléchargement
     '''
-    Trouver le fichier zip existant dans le répertoire courant
+    if not os.path.exists(DOWNLOAD_METADATA_PATH):
+        return {}
+    with open(DOWNLOAD_METADATA_PATH, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def save_download_metadata(metadata):
+    with open(DOWNLOAD_METADATA_PATH, 'w', encoding='utf-8') as file:
+        json.dump(metadata, file, indent=2)
+
+
+def get_gtfs_zip_path():
     '''
-    files = os.listdir(directory)
-    zip_files = [f for f in files if f.endswith('.zip')]
-    if zip_files:
-        return zip_files[0]  # Assumons qu'il n'y a qu'un seul fichier zip
+    Chemin du fichier zip GTFS téléchargé, None s'il n'y en a pas
+    '''
+    file_name = load_download_metadata().get('file')
+    if file_name and os.path.exists(os.path.join(GTFS_DATA_DIR, file_name)):
+        return os.path.join(GTFS_DATA_DIR, file_name)
+
+    # Fichier téléchargé avant l'enregistrement des métadonnées
+    zip_files = [f for f in os.listdir(GTFS_DATA_DIR) if f.endswith('.zip')] if os.path.isdir(GTFS_DATA_DIR) else []
+    return os.path.join(GTFS_DATA_DIR, zip_files[0]) if zip_files else None
+
+
+def file_sha256(file_path):
+    '''
+    Empreinte SHA-256 d'un fichier, lu par blocs
+    '''
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(DOWNLOAD_CHUNK_SIZE), b''):
+            sha256.update(block)
+    return sha256
+
+
+def published_sha256(headers):
+    '''
+    Empreinte SHA-256 du fichier complet annoncée par le serveur (en-têtes Repr-Digest ou Digest), None sinon
+    '''
+    for header in ('Repr-Digest', 'Digest'):
+        for value in (headers.get(header) or '').split(','):
+            algorithm, _, digest = value.strip().partition('=')
+            if algorithm.lower() != 'sha-256' or not digest:
+                continue
+            try:
+                return base64.b64decode(digest.strip(':'), validate=True).hex()
+            except (binascii.Error, ValueError):
+                return None
     return None
 
 
-def extract_zip(zip_filename, directory):
+def is_intact(zip_path, metadata):
+    '''
+    Vérifier qu'un fichier déjà téléchargé correspond à l'empreinte enregistrée lors de son téléchargement
+    '''
+    expected = metadata.get('sha256')
+    return not expected or file_sha256(zip_path).hexdigest() == expected
+
+
+def verify_zip(zip_path, expected_size=None):
+    '''
+    Vérifier la taille annoncée et le CRC de chaque fichier de l'archive (lecture en flux)
+    '''
+    if expected_size is not None and os.path.getsize(zip_path) != expected_size:
+        print(f'Taille inattendue pour {zip_path} : {os.path.getsize(zip_path)} au lieu de {expected_size} octets')
+        return False
+    try:
+        with zipfile.ZipFile(zip_path) as archive:
+            corrupted = archive.testzip()
+    except zipfile.BadZipFile as e:
+        print(f'Archive {zip_path} invalide : {e}')
+        return False
+    if corrupted:
+        print(f'Fichier corrompu dans l\'archive {zip_path} : {corrupted}')
+        return False
+    return True
+
+
+def download_zip(zip_url, zip_path, metadata):
     '''
-    Extraire le contenu du fichier zip
+    Télécharger le fichier zip en flux vers un fichier partiel, en reprenant un téléchargement interrompu.
+    L'archive est vérifiée (taille, CRC et empreinte SHA-256 publiée ou déjà connue) avant de remplacer l'ancienne.
+    Retourne les métadonnées du fichier téléchargé, ou None si le fichier n'a pas changé sur le serveur
     '''
-    with zipfile.ZipFile(zip_filename, 'r') as zip_ref:
-        zip_ref.extractall(directory)
-    print(f'Le fichier zip {zip_filename} a été extrait avec succès.')
+    part_path = zip_path + '.part'
+    headers = {}
+
+    # Téléchargement conditionnel : le serveur répond 304 si le fichier n'a pas changé.
+    # Un fichier local qui ne correspond plus à son empreinte est téléchargé à nouveau
+    if metadata.get('url') == zip_url and os.path.exists(zip_path) and not is_intact(zip_path, metadata):
+        print(f'Le fichier {os.path.basename(zip_path)} ne correspond pas à son empreinte SHA-256, nouveau téléchargement')
+    elif metadata.get('url') == zip_url and os.path.exists(zip_path):
+        if not metadata.get('etag') and not metadata.get('last_modified'):
+            # Sans validateur HTTP, le nom du fichier (daté) identifie la version
+            return None
+        if metadata.get('etag'):
+            headers['If-None-Match'] = metadata['etag']
+        if metadata.get('last_modified'):
+            headers['If-Modified-Since'] = metadata['last_modified']
+
+    # Reprise d'un téléchargement interrompu du même fichier
+    partial = metadata.get('partial') or {}
+    resume_from = os.path.getsize(part_path) if os.path.exists(part_path) and partial.get('url') == zip_url else 0
+    if resume_from and partial.get('etag'):
+        headers['Range'] = f'bytes={resume_from}-'
+        headers['If-Range'] = partial['etag']
+
+    with requests.get(zip_url, headers=headers, stream=True, timeout=(10, 60)) as response:
+        if response.status_code == 304:
+            return None
+        response.raise_for_status()
+
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if response.status_code == 206:
+            sha256 = file_sha256(part_path)
+            mode = 'ab'
+            print(f'Reprise du téléchargement à {resume_from} octets')
+        else:
+            sha256 = hashlib.sha256()
+            mode = 'wb'
+            resume_from = 0
+
+        content_length = response.headers.get('Content-Length')
+        expected_size = resume_from + int(content_length) if content_length else None
+
+        # Empreinte attendue : celle publiée par le serveur, sinon celle du précédent téléchargement de la même version
+        expected_sha256 = published_sha256(response.headers)
+        if expected_sha256 is None and etag and metadata.get('url') == zip_url and metadata.get('etag') == etag:
+            expected_sha256 = metadata.get('sha256')
+
+        # Noter le téléchargement en cours pour pouvoir le reprendre
+        metadata['partial'] = {'url': zip_url, 'etag': etag}
+        save_download_metadata(metadata)
+
+        with open(part_path, mode) as file:
+            for block in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                file.write(block)
+                sha256.update(block)
+
+    valid = verify_zip(part_path, expected_size)
+    if valid and expected_sha256 and sha256.hexdigest() != expected_sha256:
+        print(f'Empreinte SHA-256 inattendue pour {part_path} : {sha256.hexdigest()} au lieu de {expected_sha256}')
+        valid = False
+    if not valid:
+        os.remove(part_path)
+        metadata.pop('partial', None)
+        save_download_metadata(metadata)
+        raise IOError(f'Le fichier téléchargé depuis {zip_url} est invalide')
+
+    os.replace(part_path, zip_path)
+    return {
+        'url': zip_url,
+        'file': os.path.basename(zip_path),
+        'etag': etag,
+        'last_modified': last_modified,
+        'size': os.path.getsize(zip_path),
+        'sha256': sha256.hexdigest(),
+    }
 
 
 def download_latest_zip():
     '''
-    Télécharger le dernier fichier zip de données GTFS statiques
+    Télécharger le dernier fichier zip de données GTFS statiques s'il a changé. L'archive n'est pas extraite :
+    le chargement lit directement les fichiers qu'elle contient
     '''
     zip_link = get_latest_zip_url()
-    if zip_link:
-        if not zip_link.startswith('http'):
-            zip_url = 'https://opentransportdata.swiss' + zip_link
-        else:
-            zip_url = zip_link
-
-        # Extraire le nom du fichier zip
-        zip_filename = os.path.join('etl', 'gtfs_data', os.path.basename(zip_link))
-        existing_zip = get_existing_zip_file('etl/gtfs_data')
-        if existing_zip and existing_zip != zip_filename:
-            # Télécharger le nouveau fichier zip
-            zip_response = requests.get(zip_url)
-            with open(zip_filename, 'wb') as f:
-                f.write(zip_response.content)
-            print(f'Le fichier zip {zip_filename} a été téléchargé avec succès.')
-
-            # Supprimer l'ancien fichier zip
-            os.remove(os.path.join('etl', 'gtfs_data', existing_zip))
-            print(f'L\'ancien fichier zip {existing_zip} a été supprimé.')
-
-            # Extraire le contenu du nouveau fichier zip
-            extract_zip(zip_filename, 'etl/gtfs_data')
-
-        elif not existing_zip:
-            # Télécharger le fichier zip car aucun fichier existant n'a été trouvé
-            zip_response = requests.get(zip_url)
-            with open(zip_filename, 'wb') as f:
-                f.write(zip_response.content)
-            print(f'Le fichier zip {zip_filename} a été téléchargé avec succès.')
-
-            # Extraire le contenu du nouveau fichier zip
-            extract_zip(zip_filename, 'etl/gtfs_data')
-        else:
-            print(f'Le fichier existant {existing_zip} est déjà à jour.')
-    else:
+    if not zip_link:
         print('Aucun fichier zip trouvé.')
+        return
+
+    zip_url = zip_link if zip_link.startswith('http') else 'https://opentransportdata.swiss' + zip_link
+    os.makedirs(GTFS_DATA_DIR, exist_ok=True)
+    zip_filename = os.path.join(GTFS_DATA_DIR, os.path.basename(zip_link))
+
+    metadata = load_download_metadata()
+    previous_zip = get_gtfs_zip_path()
+
+    downloaded = download_zip(zip_url, zip_filename, metadata)
+    if downloaded is None:
+        print(f'Le fichier existant {os.path.basename(zip_filename)} est déjà à jour.')
+        return
+
+    save_download_metadata(downloaded)
+    print(f'Le fichier zip {zip_filename} a été téléchargé avec succès (sha256 {downloaded["sha256"]}).')
+
+    # Supprimer l'ancien fichier zip
+    if previous_zip and os.path.abspath(previous_zip) != os.path.abspath(zip_filename) and os.path.exists(previous_zip):
+        os.remove(previous_zip)
+        print(f'L\'ancien fichier zip {os.path.basename(previous_zip)} a été supprimé.')
 
 
 if __name__ == '__main__':
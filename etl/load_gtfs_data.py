@@ -1,24 +1,75 @@
+import io
 import json
+import numpy as np
 import os
 import pandas as pd
+import sys
 import time
+import zipfile
 
-from concurrent.futures import ThreadPoolExecutor
+from bson.binary import Binary
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import contextmanager
+from datetime import datetime, timezone
 from dotenv import load_dotenv
-from pymongo import InsertOne, MongoClient, GEOSPHERE, WriteConcern
+from pymongo import MongoClient, GEOSPHERE
+
+from gtfs_rt_daemon import ensure_indexes as ensure_realtime_indexes, upsert_trip_updates
+from gtfs_static_download import GTFS_DATA_DIR, file_sha256, get_gtfs_zip_path
 
 
 load_dotenv()
 
 
-# Connexion à la base de données MongoDB
+# Connexion à la base de données MongoDB. Chaque version des données GTFS est chargée dans sa propre base
+# ("<MONGO_DB>_<version>"), la base principale ne contient que le pointeur vers la version active
 mongo_client = MongoClient(os.getenv('MONGO_URI'))
-db = mongo_client[os.getenv('MONGO_DB')].with_options(write_concern=WriteConcern(w=0))
-
-# Configurer un WriteConcern faible pour certaines collections
-stop_times_collection = db['stop_times'].with_options(write_concern=WriteConcern(w=0))
-trips_collection = db['trips'].with_options(write_concern=WriteConcern(w=0))
-calendar_dates_collection = db['calendar_dates'].with_options(write_concern=WriteConcern(w=0))
+base_db = mongo_client[os.getenv('MONGO_DB')]
+
+# Base de la version en cours de chargement (voir use_version_database)
+db = None
+
+# Format des versions des données (date et heure UTC du chargement), suffixe du nom de leur base
+VERSION_FORMAT = '%Y%m%dT%H%M%S'
+
+# Processus d'insertion en parallèle et nombre maximal de chunks en attente (borne la mémoire utilisée)
+ETL_WORKERS = int(os.getenv('ETL_WORKERS', str(os.cpu_count() or 4)))
+ETL_MAX_PENDING_CHUNKS = int(os.getenv('ETL_MAX_PENDING_CHUNKS', str(2 * ETL_WORKERS)))
+
+# Types des colonnes GTFS numériques, toutes les autres colonnes sont lues comme du texte
+# (pas d'inférence : un identifiant reste du texte même s'il ne contient que des chiffres)
+GTFS_NUMERIC_COLUMNS = {
+    'stop_lat': 'float64',
+    'stop_lon': 'float64',
+    'location_type': 'Int8',
+    'wheelchair_boarding': 'Int8',
+    'route_type': 'Int16',
+    'direction_id': 'Int8',
+    'stop_sequence': 'int32',
+    'pickup_type': 'Int8',
+    'drop_off_type': 'Int8',
+    'shape_dist_traveled': 'float64',
+    'transfer_type': 'Int8',
+    'min_transfer_time': 'Int32',
+    'monday': 'int8',
+    'tuesday': 'int8',
+    'wednesday': 'int8',
+    'thursday': 'int8',
+    'friday': 'int8',
+    'saturday': 'int8',
+    'sunday': 'int8',
+    'start_date': 'int32',
+    'end_date': 'int32',
+    'date': 'int32',
+    'exception_type': 'int8',
+}
+
+# Répertoire de l'état du dernier import (empreintes des fichiers et des lignes) pour l'import différentiel
+GTFS_STATE_DIR = os.getenv('GTFS_STATE_DIR', 'etl/gtfs_state')
+
+# Connexion à la base de données propre à chaque processus d'insertion
+worker_db = None
 
 
 def create_indexes():
@@ -30,133 +81,692 @@ def create_indexes():
     db.routes.create_index([("route_id", 1), ("route_short_name", 1)])
     db.trips.create_index([("trip_id", 1), ("route_id", 1), ("service_id", 1), ("trip_headsign", 1)])
     db.stop_times.create_index([("trip_id", 1), ("stop_id", 1), ("departure_time", 1)])
-    db.trip_updates.create_index([("trip_id", 1)])
     db.calendar_dates.create_index([("service_id", 1), ("date", 1)])
     db.calendar.create_index([("service_id", 1)])
     db.transfers.create_index([("from_stop_id", 1), ("to_stop_id", 1)])
+    db.service_calendar.create_index([("service_id", 1)])
+    db.stop_departures.create_index([("station_id", 1), ("hour", 1)])
     db.stops.create_index([("location", GEOSPHERE)])
+    db.gazetteer.create_index([("name", 1)])
+    for table in GTFS_TABLES.values():
+        db[table['collection']].create_index([("_key", 1)])
     print("Indexes created successfully")
 
 
-def insert_data_in_chunks(file_path, collection, chunksize=50000):
+def gtfs_dtypes():
+    '''
+    Types explicites des colonnes GTFS pour pandas.read_csv
+    '''
+    return defaultdict(lambda: str, GTFS_NUMERIC_COLUMNS)
+
+
+def dataframe_to_documents(frame):
+    '''
+    Convertir un DataFrame en documents MongoDB colonne par colonne (valeurs manquantes -> None)
+    '''
+    columns = []
+    for name in frame.columns:
+        series = frame[name]
+        if series.hasnans:
+            columns.append(series.astype(object).where(series.notna(), None).tolist())
+        else:
+            columns.append(series.tolist())
+    names = list(frame.columns)
+    return [dict(zip(names, row)) for row in zip(*columns)]
+
+
+def init_worker(mongo_uri, db_name):
+    '''
+    Ouvrir la connexion MongoDB d'un processus d'insertion (un client ne peut pas être partagé entre processus)
+    '''
+    global worker_db
+    worker_db = MongoClient(mongo_uri)[db_name]
+
+
+def insert_chunk(collection_name, chunk, replaced_keys):
+    '''
+    Insérer un chunk dans une collection depuis un processus d'insertion, après avoir supprimé
+    les anciennes versions des lignes modifiées
+    '''
+    collection = worker_db[collection_name]
+    if len(replaced_keys):
+        collection.delete_many({"_key": {"$in": replaced_keys.tolist()}})
+
+    documents = dataframe_to_documents(chunk)
+    if documents:
+        collection.insert_many(documents, ordered=False)
+    return len(documents)
+
+
+def hash_rows(chunk, key_columns):
+    '''
+    Empreintes des lignes d'un chunk : clé (colonnes identifiant la ligne) et contenu complet
+    '''
+    row_hashes = pd.util.hash_pandas_object(chunk, index=False).to_numpy()
+    if not key_columns or not all(column in chunk.columns for column in key_columns):
+        return row_hashes, row_hashes
+    return pd.util.hash_pandas_object(chunk[key_columns], index=False).to_numpy(), row_hashes
+
+
+def insert_data_in_chunks(file_name, collection_name, chunksize=50000, key_columns=None, previous=None, prepare=None, dtypes=None):
+    '''
+    Insérer un fichier GTFS en chunks répartis sur un pool de processus, avec un nombre borné de chunks en attente.
+    Avec les empreintes des lignes de la version précédente (`previous`, la collection ayant été copiée),
+    seules les lignes ajoutées ou modifiées sont écrites et les lignes disparues sont supprimées
+    '''
+    start_time = time.time()
+    previous_keys, previous_hashes = previous if previous is not None else (np.empty(0, dtype=np.uint64),) * 2
+    seen_keys, seen_hashes = [], []
+    counts = {'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0}
+    pending = set()
+    column_dtypes = gtfs_dtypes()
+    column_dtypes.update(dtypes or {})
+
+    with ProcessPoolExecutor(max_workers=ETL_WORKERS, initializer=init_worker, initargs=(os.getenv('MONGO_URI'), db.name)) as executor, \
+            open_gtfs_file(file_name) as file:
+        for chunk in pd.read_csv(file, chunksize=chunksize, dtype=column_dtypes):
+            keys, hashes = hash_rows(chunk, key_columns)
+            seen_keys.append(keys)
+            seen_hashes.append(hashes)
+
+            # Comparaison avec la version précédente (clés triées) : lignes nouvelles, modifiées ou inchangées
+            positions = np.minimum(np.searchsorted(previous_keys, keys), max(len(previous_keys) - 1, 0))
+            found = previous_keys[positions] == keys if len(previous_keys) else np.zeros(len(keys), dtype=bool)
+            changed = found & (previous_hashes[positions] != hashes) if len(previous_keys) else found
+            written = ~found | changed
+            counts['inserted'] += int((~found).sum())
+            counts['updated'] += int(changed.sum())
+            counts['unchanged'] += int((found & ~changed).sum())
+            if not written.any():
+                continue
+
+            chunk = chunk[written].copy()
+            chunk['_key'] = keys[written].view(np.int64)
+            if prepare is not None:
+                chunk = prepare(chunk)
+
+            if len(pending) >= ETL_MAX_PENDING_CHUNKS:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+            pending.add(executor.submit(insert_chunk, collection_name, chunk, keys[changed].view(np.int64)))
+
+        for future in pending:
+            future.result()
+
+    keys = np.concatenate(seen_keys) if seen_keys else np.empty(0, dtype=np.uint64)
+    hashes = np.concatenate(seen_hashes) if seen_hashes else np.empty(0, dtype=np.uint64)
+    order = np.argsort(keys, kind='stable')
+    keys, hashes = keys[order], hashes[order]
+
+    # Lignes de la version précédente absentes du nouveau fichier
+    deleted = np.setdiff1d(previous_keys, keys, assume_unique=False).view(np.int64)
+    for start in range(0, len(deleted), 10000):
+        db[collection_name].delete_many({"_key": {"$in": deleted[start:start + 10000].tolist()}})
+    counts['deleted'] = len(deleted)
+
+    elapsed = time.time() - start_time
+    rows = counts['inserted'] + counts['updated'] + counts['unchanged']
+    print(f"{collection_name} : {rows} lignes lues en {elapsed:.1f} s ({rows / max(elapsed, 1e-9):.0f} lignes/s), "
+          f"{counts['inserted']} ajoutées, {counts['updated']} modifiées, {counts['deleted']} supprimées")
+    return counts, (keys, hashes)
+
+
+def prepare_stops(chunk):
     '''
-    Insérer les données en chunks pour optimiser les performances
+    Filtrer les arrêts sans coordonnées valides et ajouter le champ `location` pour l'index géospatial
     '''
-    with open(file_path, 'r', encoding='utf-8-sig') as file:
-        for chunk in pd.read_csv(file, chunksize=chunksize):
-            operations = [InsertOne(row) for row in chunk.to_dict(orient='records')]
-            collection.bulk_write(operations, ordered=False)
-            print(f"{len(chunk)} records insérés dans {collection.name}")
+    # Convertir les colonnes de latitude et de longitude en numériques
+    chunk['stop_lat'] = pd.to_numeric(chunk['stop_lat'], errors='coerce')
+    chunk['stop_lon'] = pd.to_numeric(chunk['stop_lon'], errors='coerce')
+
+    # Supprimer les lignes avec des valeurs NaN dans stop_lat ou stop_lon
+    chunk = chunk.dropna(subset=['stop_lat', 'stop_lon'])
+
+    # Filtrer les coordonnées géographiques valides
+    chunk = chunk[(chunk['stop_lat'].between(-90, 90)) & (chunk['stop_lon'].between(-180, 180))].copy()
+
+    # Remplir les valeurs manquantes
+    chunk.fillna({'location_type': 0, 'parent_station': ''}, inplace=True)
+
+    # Créer le champ `location` en format GeoJSON pour MongoDB
+    chunk['location'] = [
+        {"type": "Point", "coordinates": [lon, lat]}
+        for lon, lat in zip(chunk['stop_lon'].tolist(), chunk['stop_lat'].tolist())
+    ]
+    return chunk
+
+
+# Tables GTFS importées : collection, colonnes identifiant une ligne (toute la ligne si None) et options de lecture
+GTFS_TABLES = {
+    'agency.txt': {'collection': 'agency', 'key_columns': ['agency_id']},
+    'routes.txt': {'collection': 'routes', 'key_columns': ['route_id']},
+    'stops.txt': {
+        'collection': 'stops',
+        'key_columns': ['stop_id'],
+        'chunksize': 10000,
+        'prepare': prepare_stops,
+        # Coordonnées lues comme du texte puis converties, pour ignorer les valeurs invalides au lieu d'échouer
+        'dtypes': {'stop_lat': str, 'stop_lon': str},
+    },
+    'transfers.txt': {'collection': 'transfers', 'key_columns': None},
+    'calendar.txt': {'collection': 'calendar', 'key_columns': ['service_id']},
+    'calendar_dates.txt': {'collection': 'calendar_dates', 'key_columns': ['service_id', 'date']},
+    'trips.txt': {'collection': 'trips', 'key_columns': ['trip_id']},
+    'stop_times.txt': {'collection': 'stop_times', 'key_columns': ['trip_id', 'stop_sequence'], 'chunksize': 200000},
+}
+
+
+def find_zip_member(archive, file_name):
+    '''
+    Fichier GTFS dans l'archive (à la racine ou dans un sous-dossier), None s'il est absent
+    '''
+    for info in archive.infolist():
+        if os.path.basename(info.filename) == file_name:
+            return info
+    return None
 
 
-def insert_agency():
-    insert_data_in_chunks('etl/gtfs_data/agency.txt', db.agency)
+@contextmanager
+def open_gtfs_file(file_name):
+    '''
+    Ouvrir un fichier GTFS en flux texte, directement dans l'archive téléchargée (sans extraction),
+    ou à défaut dans le dossier des données extraites
+    '''
+    zip_path = get_gtfs_zip_path()
+    if zip_path:
+        with zipfile.ZipFile(zip_path) as archive:
+            member = find_zip_member(archive, file_name)
+            if member is None:
+                raise FileNotFoundError(f'{file_name} absent de {zip_path}')
+            with archive.open(member) as stream, io.TextIOWrapper(stream, encoding='utf-8-sig') as file:
+                yield file
+    else:
+        with open(os.path.join(GTFS_DATA_DIR, file_name), 'r', encoding='utf-8-sig') as file:
+            yield file
+
+
+def gtfs_file_fingerprint(file_name):
+    '''
+    Empreinte d'un fichier GTFS : CRC et taille enregistrés dans l'archive (sans la relire),
+    SHA-256 d'un fichier extrait, None si le fichier est absent
+    '''
+    zip_path = get_gtfs_zip_path()
+    if zip_path:
+        with zipfile.ZipFile(zip_path) as archive:
+            member = find_zip_member(archive, file_name)
+        return f'crc32:{member.CRC:08x}:{member.file_size}' if member else None
+
+    file_path = os.path.join(GTFS_DATA_DIR, file_name)
+    return f'sha256:{file_sha256(file_path).hexdigest()}' if os.path.exists(file_path) else None
+
+
+def load_import_state():
+    '''
+    Lire l'état du dernier import publié (base de données et empreintes des fichiers). L'import différentiel
+    n'est possible que si cette base est toujours la version active (pas de retour arrière entre-temps)
+    '''
+    manifest_path = os.path.join(GTFS_STATE_DIR, 'manifest.json')
+    state = {'database': None, 'files': {}, 'new_files': {}}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as file:
+            state.update(json.load(file))
 
+    active = base_db.gtfs_metadata.find_one({"_id": "active"}) or {}
+    if not state['database'] or state['database'] != active.get('database') \
+            or state['database'] not in mongo_client.list_database_names():
+        state['database'] = None
+        state['files'] = {}
+    return state
 
-def insert_routes():
-    insert_data_in_chunks('etl/gtfs_data/routes.txt', db.routes)
 
+def load_row_hashes(file_name):
+    '''
+    Empreintes des lignes d'un fichier lors du dernier import (clés triées et contenus), None si absentes
+    '''
+    path = os.path.join(GTFS_STATE_DIR, f'{file_name}.npz')
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as hashes:
+        return hashes['keys'], hashes['hashes']
 
-def insert_stops():
+
+def save_row_hashes(file_name, keys, hashes):
     '''
-    Insérer les données des arrêts en chunks pour optimiser les performances et ajouter un index géospatial
+    Enregistrer les empreintes des lignes du nouvel import, validées seulement après la publication
     '''
-    stops_iter = pd.read_csv('etl/gtfs_data/stops.txt', encoding='utf-8-sig', chunksize=10000)
+    os.makedirs(GTFS_STATE_DIR, exist_ok=True)
+    with open(os.path.join(GTFS_STATE_DIR, f'{file_name}.next.npz'), 'wb') as file:
+        np.savez(file, keys=keys, hashes=hashes)
 
-    for chunk in stops_iter:
-        # Convertir les colonnes de latitude et de longitude en numériques
-        chunk['stop_lat'] = pd.to_numeric(chunk['stop_lat'], errors='coerce')
-        chunk['stop_lon'] = pd.to_numeric(chunk['stop_lon'], errors='coerce')
-        
-        # Supprimer les lignes avec des valeurs NaN dans stop_lat ou stop_lon
-        chunk = chunk.dropna(subset=['stop_lat', 'stop_lon'])
-        
-        # Filtrer les coordonnées géographiques valides
-        chunk = chunk[(chunk['stop_lat'].between(-90, 90)) & (chunk['stop_lon'].between(-180, 180))]
-        
-        # Créer le champ `location` en format GeoJSON pour MongoDB
-        chunk['location'] = chunk.apply(lambda x: {
-            "type": "Point",
-            "coordinates": [x['stop_lon'], x['stop_lat']]
-        }, axis=1)
-        
-        # Remplir les valeurs manquantes
-        chunk.fillna({'location_type': '0', 'parent_station': ''}, inplace=True)
-        
-        # Préparer les opérations pour l'insertion
-        operations = [InsertOne(row) for row in chunk.to_dict(orient='records')]
-        
-        # Exécuter l'insertion en bulk
-        db.stops.bulk_write(operations, ordered=False)
-        print(f"{len(chunk)} stops insérés")
 
+def commit_import_state(state, database_name):
+    '''
+    Valider l'état du nouvel import une fois la version publiée
+    '''
+    for file_name in state['new_files']:
+        next_path = os.path.join(GTFS_STATE_DIR, f'{file_name}.next.npz')
+        if os.path.exists(next_path):
+            os.replace(next_path, os.path.join(GTFS_STATE_DIR, f'{file_name}.npz'))
 
-def insert_trips():
-    insert_data_in_chunks('etl/gtfs_data/trips.txt', trips_collection)
+    with open(os.path.join(GTFS_STATE_DIR, 'manifest.json'), 'w', encoding='utf-8') as file:
+        json.dump({'database': database_name, 'files': state['new_files']}, file, indent=2)
 
 
-def insert_stop_times():
-    insert_data_in_chunks('etl/gtfs_data/stop_times.txt', stop_times_collection)
+def copy_collection(source_database, collection_name):
+    '''
+    Copier une collection de la version précédente dans la nouvelle base, côté serveur
+    '''
+    mongo_client[source_database][collection_name].aggregate([
+        {"$out": {"db": db.name, "coll": collection_name}}
+    ])
+    db[collection_name].create_index([("_key", 1)])
 
 
-def insert_transfers():
-    insert_data_in_chunks('etl/gtfs_data/transfers.txt', db.transfers)
+def import_table(file_name, state, summary):
+    '''
+    Importer une table GTFS : copie de la version précédente si le fichier est inchangé, sinon application
+    des seules différences (ou import complet sans version précédente). Retourne True si la table a changé
+    '''
+    table = GTFS_TABLES[file_name]
+    collection_name = table['collection']
+    fingerprint = gtfs_file_fingerprint(file_name)
+    if fingerprint is None:
+        summary[collection_name] = 'absent'
+        return False
+
+    state['new_files'][file_name] = fingerprint
+    previous = load_row_hashes(file_name) if state['database'] else None
+
+    if previous is not None and state['files'].get(file_name) == fingerprint:
+        copy_collection(state['database'], collection_name)
+        summary[collection_name] = 'inchangée'
+        print(f"{collection_name} : fichier inchangé, collection copiée de la version précédente")
+        return False
+
+    if previous is not None:
+        copy_collection(state['database'], collection_name)
+    counts, (keys, hashes) = insert_data_in_chunks(
+        file_name,
+        collection_name,
+        chunksize=table.get('chunksize', 50000),
+        key_columns=table['key_columns'],
+        previous=previous,
+        prepare=table.get('prepare'),
+        dtypes=table.get('dtypes')
+    )
+    save_row_hashes(file_name, keys, hashes)
+    summary[collection_name] = counts
+    return True
+
+
+def rebuild_or_copy(collection_name, changed, build, state, summary):
+    '''
+    Reconstruire une collection dérivée si l'une de ses tables sources a changé, sinon la copier
+    '''
+    if changed or not state['database']:
+        build()
+        summary[collection_name] = 'reconstruite'
+    else:
+        copy_collection(state['database'], collection_name)
+        summary[collection_name] = 'inchangée'
 
 
-def insert_calendar():
-    insert_data_in_chunks('etl/gtfs_data/calendar.txt', db.calendar)
+def build_gazetteer():
+    '''
+    Construire le gazetteer local (arrêts et communes) utilisé par l'API pour géocoder sans appeler Nominatim
+    '''
+    with open_gtfs_file('stops.txt') as file:
+        stops = pd.read_csv(
+            file,
+            usecols=['stop_name', 'stop_lat', 'stop_lon'],
+            dtype={'stop_name': str}
+        )
+    stops['stop_lat'] = pd.to_numeric(stops['stop_lat'], errors='coerce')
+    stops['stop_lon'] = pd.to_numeric(stops['stop_lon'], errors='coerce')
+    stops = stops.dropna()
+    stops = stops[(stops['stop_lat'].between(-90, 90)) & (stops['stop_lon'].between(-180, 180))]
+
+    # Un seul point par nom d'arrêt : le centre de ses quais
+    stop_places = stops.groupby('stop_name', as_index=False)[['stop_lat', 'stop_lon']].mean()
+    stop_places['kind'] = 'stop'
+
+    # Communes : partie du nom avant la virgule ("Lausanne, Flon" -> "Lausanne"), au centre de leurs arrêts.
+    # Si un arrêt porte exactement le nom de la commune (souvent la gare), c'est lui qui est retenu
+    stops['stop_name'] = stops['stop_name'].str.split(',', n=1).str[0].str.strip()
+    municipalities = stops.groupby('stop_name', as_index=False)[['stop_lat', 'stop_lon']].mean()
+    municipalities = municipalities[~municipalities['stop_name'].isin(stop_places['stop_name'])]
+    municipalities['kind'] = 'municipality'
+
+    places = pd.concat([stop_places, municipalities], ignore_index=True)
+    places = places.rename(columns={'stop_name': 'name', 'stop_lat': 'lat', 'stop_lon': 'lon'})
+    db.gazetteer.insert_many(places.to_dict(orient='records'), ordered=False)
+    print(f"{len(places)} lieux insérés dans le gazetteer")
+
+
+def build_service_calendar():
+    '''
+    Précalculer pour chaque service un bitset des jours de circulation sur la période de validité des données
+    (calendrier hebdomadaire combiné aux exceptions), pour que l'API n'ait plus à le faire à chaque requête
+    '''
+    weekdays = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+    with open_gtfs_file('calendar.txt') as file:
+        calendar = pd.read_csv(
+            file,
+            dtype={'service_id': str, 'start_date': str, 'end_date': str}
+        )
+    with open_gtfs_file('calendar_dates.txt') as file:
+        calendar_dates = pd.read_csv(
+            file,
+            dtype={'service_id': str, 'date': str}
+        )
+    calendar['start_date'] = pd.to_datetime(calendar['start_date'], format='%Y%m%d')
+    calendar['end_date'] = pd.to_datetime(calendar['end_date'], format='%Y%m%d')
+    calendar_dates['date'] = pd.to_datetime(calendar_dates['date'], format='%Y%m%d')
+
+    start = pd.concat([calendar['start_date'], calendar_dates['date']]).min()
+    end = pd.concat([calendar['end_date'], calendar_dates['date']]).max()
+    if pd.isna(start) or pd.isna(end):
+        print('Aucun calendrier de service trouvé')
+        return
+    dates = pd.date_range(start, end, freq='D')
+
+    service_ids = pd.Index(pd.concat([calendar['service_id'], calendar_dates['service_id']]).unique())
+    days = np.zeros((len(service_ids), len(dates)), dtype=bool)
+
+    # Calendrier hebdomadaire : jour dans la période du service et jour de la semaine circulé
+    rows = service_ids.get_indexer(calendar['service_id'])
+    day_numbers = dates.values[np.newaxis, :]
+    in_range = (day_numbers >= calendar['start_date'].values[:, np.newaxis]) & (day_numbers <= calendar['end_date'].values[:, np.newaxis])
+    runs_on_weekday = calendar[weekdays].to_numpy(dtype=bool)[:, dates.weekday]
+    days[rows] = in_range & runs_on_weekday
+
+    # Exceptions : 1 = service ajouté, 2 = service supprimé
+    rows = service_ids.get_indexer(calendar_dates['service_id'])
+    columns = (calendar_dates['date'] - start).dt.days.to_numpy()
+    days[rows, columns] = calendar_dates['exception_type'].to_numpy() == 1
+
+    bitsets = np.packbits(days, axis=1)
+    start_date = start.strftime('%Y%m%d')
+    documents = [
+        {"service_id": service_id, "start_date": start_date, "days": len(dates), "bits": Binary(bitset.tobytes())}
+        for service_id, bitset in zip(service_ids, bitsets)
+    ]
+    if documents:
+        db.service_calendar.insert_many(documents, ordered=False)
+    print(f"{len(documents)} calendriers de service précalculés du {start_date} au {end.strftime('%Y%m%d')}")
+
+
+def parse_gtfs_times(times):
+    '''
+    Convertir des heures GTFS "HH:MM:SS" (pouvant dépasser 24h) en secondes depuis le début du jour de service
+    '''
+    parts = times.str.split(':', expand=True).astype('int32')
+    return parts[0] * 3600 + parts[1] * 60 + parts[2]
 
 
-def insert_calendar_dates():
-    insert_data_in_chunks('etl/gtfs_data/calendar_dates.txt', calendar_dates_collection)
+def insert_stop_departures(stop_times, trips, stations, bucket_seconds):
+    '''
+    Écrire les départs d'un chunk de stop_times (courses complètes), regroupés par gare et par heure de départ.
+    Retourne le nombre de départs et les gares concernées
+    '''
+    # Pas de départ au dernier arrêt d'une course ni aux arrêts où la montée est impossible
+    last_stop = stop_times['stop_sequence'] == stop_times.groupby('trip_id')['stop_sequence'].transform('max')
+    keep = ~last_stop & stop_times['departure_time'].notna()
+    if 'pickup_type' in stop_times:
+        keep &= stop_times['pickup_type'].fillna(0) != 1
+    departures = stop_times.loc[keep, ['trip_id', 'stop_id', 'departure_time']]
+
+    # Départs regroupés par gare (arrêt parent des quais)
+    departures = departures.merge(stations, on='stop_id', how='inner').merge(trips, on='trip_id', how='inner')
+    if departures.empty:
+        return 0, set()
+    departures['departure_time'] = parse_gtfs_times(departures['departure_time'])
+    departures['hour'] = departures['departure_time'] // bucket_seconds
+    departures = departures.sort_values(['station_id', 'hour', 'departure_time'], kind='stable').reset_index(drop=True)
+
+    station_ids = departures['station_id'].to_numpy()
+    hours = departures['hour'].to_numpy()
+    boundaries = np.flatnonzero((station_ids[1:] != station_ids[:-1]) | (hours[1:] != hours[:-1])) + 1
+    starts = np.concatenate(([0], boundaries)).tolist()
+    ends = np.concatenate((boundaries, [len(departures)])).tolist()
+
+    columns = {
+        'times': departures['departure_time'].tolist(),
+        'services': departures['service_id'].tolist(),
+        'trips': departures['trip_id'].tolist(),
+        'lines': departures['route_short_name'].tolist(),
+        'directions': departures['trip_headsign'].tolist(),
+        'stops': departures['stop_id'].tolist(),
+    }
+    documents = []
+    for start, end in zip(starts, ends):
+        document = {'station_id': station_ids[start], 'hour': int(hours[start])}
+        document.update({name: values[start:end] for name, values in columns.items()})
+        documents.append(document)
+        if len(documents) >= 1000:
+            db.stop_departures.insert_many(documents, ordered=False)
+            documents = []
+    if documents:
+        db.stop_departures.insert_many(documents, ordered=False)
+    return len(departures), set(station_ids.tolist())
+
+
+def build_stop_departures(bucket_seconds=3600, chunksize=1000000):
+    '''
+    Précalculer les départs de chaque gare, en secondes et triés, regroupés par heure de départ
+    pour que l'API réponde aux tableaux des départs par recherche binaire. stop_times.txt est lu en chunks :
+    une gare et une heure peuvent donc avoir plusieurs documents, que l'API fusionne
+    '''
+    with open_gtfs_file('trips.txt') as file:
+        trips = pd.read_csv(
+            file,
+            usecols=['trip_id', 'route_id', 'service_id', 'trip_headsign'],
+            dtype=str
+        )
+    with open_gtfs_file('routes.txt') as file:
+        routes = pd.read_csv(
+            file,
+            usecols=['route_id', 'route_short_name'],
+            dtype=str
+        )
+    with open_gtfs_file('stops.txt') as file:
+        stops = pd.read_csv(
+            file,
+            usecols=['stop_id', 'stop_name', 'parent_station'],
+            dtype=str
+        )
+
+    # Tables de correspondance jointes à chaque chunk : ligne et direction des courses, gare des quais
+    trips = trips.merge(routes, on='route_id', how='left').drop(columns='route_id')
+    trips['route_short_name'] = trips['route_short_name'].fillna('')
+    trips['trip_headsign'] = trips['trip_headsign'].fillna('')
+    stops['station_id'] = stops['parent_station'].fillna(stops['stop_id'])
+    stops.loc[stops['station_id'] == '', 'station_id'] = stops['stop_id']
+    stations = stops[['stop_id', 'station_id']]
+
+    total, station_ids, carry = 0, set(), None
+    with open_gtfs_file('stop_times.txt') as file:
+        for chunk in pd.read_csv(
+            file,
+            chunksize=chunksize,
+            usecols=lambda column: column in ('trip_id', 'stop_id', 'stop_sequence', 'departure_time', 'pickup_type'),
+            dtype={'trip_id': str, 'stop_id': str, 'stop_sequence': 'int32', 'departure_time': str}
+        ):
+            if carry is not None:
+                chunk = pd.concat([carry, chunk], ignore_index=True)
+            # Les lignes d'une course sont consécutives : la dernière course du chunk peut continuer
+            # dans le suivant, elle est reportée pour que son dernier arrêt soit bien identifié
+            tail = chunk['trip_id'] == chunk['trip_id'].iat[-1]
+            carry = chunk[tail]
+            count, stations_in_chunk = insert_stop_departures(chunk[~tail], trips, stations, bucket_seconds)
+            total += count
+            station_ids |= stations_in_chunk
+        if carry is not None:
+            count, stations_in_chunk = insert_stop_departures(carry, trips, stations, bucket_seconds)
+            total += count
+            station_ids |= stations_in_chunk
+    print(f"{total} départs précalculés pour {len(station_ids)} gares")
 
 
 def insert_realtime_data(file_path, collection):
     '''
-    Insérer les données GTFS Realtime dans la collection spécifiée
+    Enregistrer l'instantané GTFS Realtime téléchargé par l'ETL dans la collection spécifiée (upserts par course,
+    comme le démon gtfs_rt_daemon.py qui met ensuite ces données à jour en continu). Seules les courses absentes
+    ou provenant d'un flux plus ancien sont remplacées ; un ancien instantané sans horodatage (simple liste)
+    n'ajoute que les courses absentes
     '''
     with open(file_path, 'r', encoding='utf-8') as file:
         data = json.load(file)
-        if not data:
-            print(f"Aucune donnée trouvée dans {file_path}")
-        else:
-            collection.insert_many(data)
-            print(f'Données GTFS Realtime insérées depuis {file_path}')
+    if isinstance(data, list):
+        data = {'feed_timestamp': None, 'trip_updates': data}
+
+    if not data['trip_updates']:
+        print(f"Aucune donnée trouvée dans {file_path}")
+    else:
+        count = upsert_trip_updates(collection, data['trip_updates'], data['feed_timestamp'])
+        print(f'{count} courses GTFS Realtime insérées depuis {file_path}')
+
+
+def is_version_database(database_name):
+    '''
+    Base d'une version des données : "<MONGO_DB>_<version>", la version étant au format VERSION_FORMAT
+    '''
+    prefix = f"{base_db.name}_"
+    if not database_name.startswith(prefix):
+        return False
+    try:
+        datetime.strptime(database_name[len(prefix):], VERSION_FORMAT)
+    except ValueError:
+        return False
+    return True
+
+
+def use_version_database(version):
+    '''
+    Préparer une base vide pour charger une nouvelle version des données, sans toucher à la version active.
+    La base est enregistrée dans les métadonnées : seules les bases créées par l'ETL sont supprimées ensuite
+    '''
+    global db
+
+    database_name = f"{base_db.name}_{version}"
+    mongo_client.drop_database(database_name)
+    base_db.gtfs_metadata.update_one({"_id": "versions"}, {"$addToSet": {"databases": database_name}}, upsert=True)
+    db = mongo_client[database_name]
+    return database_name
+
+
+def publish_dataset_version(version, database_name):
+    '''
+    Basculer l'API sur la nouvelle version en remplaçant le document pointeur (opération atomique),
+    en gardant la version précédente pour un retour arrière
+    '''
+    active = base_db.gtfs_metadata.find_one({"_id": "active"})
+    previous = {"version": active["version"], "database": active.get("database", base_db.name)} if active else None
+
+    base_db.gtfs_metadata.replace_one(
+        {"_id": "active"},
+        {"version": version, "database": database_name, "loaded_at": datetime.now(timezone.utc), "previous": previous},
+        upsert=True
+    )
+    print(f'Version des données {version} publiée (base {database_name})')
+
+
+def drop_old_versions():
+    '''
+    Supprimer les bases des versions qui ne sont ni active ni précédente. Seules les bases enregistrées
+    par l'ETL et nommées d'après une version sont concernées (jamais "<MONGO_DB>_test" ou "<MONGO_DB>_backup")
+    '''
+    active = base_db.gtfs_metadata.find_one({"_id": "active"}) or {}
+    kept = {active.get("database"), (active.get("previous") or {}).get("database")}
+    recorded = (base_db.gtfs_metadata.find_one({"_id": "versions"}) or {}).get("databases", [])
+    existing = set(mongo_client.list_database_names())
+    for database_name in recorded:
+        if database_name in kept or not is_version_database(database_name):
+            continue
+        if database_name in existing:
+            mongo_client.drop_database(database_name)
+            print(f'Ancienne version supprimée : {database_name}')
+        base_db.gtfs_metadata.update_one({"_id": "versions"}, {"$pull": {"databases": database_name}})
+
+
+def rollback_dataset_version():
+    '''
+    Revenir à la version précédente des données (la version active devient la version précédente)
+    '''
+    active = base_db.gtfs_metadata.find_one({"_id": "active"})
+    previous = active.get("previous") if active else None
+    if not previous or previous["database"] not in mongo_client.list_database_names():
+        print('Aucune version précédente disponible')
+        return
+
+    base_db.gtfs_metadata.replace_one(
+        {"_id": "active"},
+        {
+            "version": previous["version"],
+            "database": previous["database"],
+            "loaded_at": datetime.now(timezone.utc),
+            "previous": {"version": active["version"], "database": active["database"]},
+        }
+    )
+    print(f'Retour à la version {previous["version"]} (base {previous["database"]})')
 
 
 def import_gtfs_data():
     '''
-    Importer les données GTFS statiques et en temps réel dans la base de données MongoDB
+    Importer les données GTFS statiques et en temps réel dans une nouvelle base MongoDB, puis y basculer l'API.
+    La version active reste disponible et indexée pendant tout le chargement
     '''
-    # Drop l'entièreté de la base de données
-    mongo_client.drop_database(os.getenv('MONGO_DB'))
-    print('Database dropped')
+    version = datetime.now(timezone.utc).strftime(VERSION_FORMAT)
+    database_name = use_version_database(version)
+    print(f'Chargement de la version {version} dans la base {database_name}')
 
     start_time = time.time()
     print('Démarrage de l\'insertion des données GTFS à :', time.ctime())
 
-    # Insertion des données statiques
-    insert_agency()
-    insert_routes()
-    insert_stops()
-    insert_transfers()
-    insert_calendar()
-
-    # Insertion des données statiques en parallèle
-    with ThreadPoolExecutor(max_workers=8) as executor:
-        executor.submit(insert_stop_times)
-        executor.submit(insert_trips)
-        executor.submit(insert_calendar_dates)
+    state = load_import_state()
+    if state['database']:
+        print(f"Import différentiel par rapport à la base {state['database']}")
+
+    # Tables GTFS : seules les différences avec la version précédente sont écrites
+    summary = {}
+    changed = {file_name: import_table(file_name, state, summary) for file_name in GTFS_TABLES}
+
+    # Collections dérivées, reconstruites seulement si leurs sources ont changé
+    rebuild_or_copy('gazetteer', changed['stops.txt'], build_gazetteer, state, summary)
+    rebuild_or_copy(
+        'service_calendar', changed['calendar.txt'] or changed['calendar_dates.txt'], build_service_calendar, state, summary
+    )
+    rebuild_or_copy(
+        'stop_departures',
+        any(changed[file_name] for file_name in ('stop_times.txt', 'trips.txt', 'routes.txt', 'stops.txt')),
+        build_stop_departures,
+        state,
+        summary
+    )
 
     # Insertion des données en temps réel
-    insert_realtime_data('etl/gtfs_rt_data/trip_updates.json', db.trip_updates)
+    ensure_realtime_indexes(base_db)
+    insert_realtime_data('etl/gtfs_rt_data/trip_updates.json', base_db.trip_updates)
 
-    # Créer les index après l'insertion
+    # Créer les index avant la bascule : l'API ne voit jamais de collection sans index
     create_indexes()
 
+    # Basculer l'API sur la nouvelle version
+    publish_dataset_version(version, database_name)
+    commit_import_state(state, database_name)
+    drop_old_versions()
+
+    print('Résumé de l\'import :')
+    for collection_name, result in summary.items():
+        print(f'  {collection_name} : {result}')
+
     print(f'Insertion des données GTFS terminée en {time.time() - start_time} secondes')
     print('Fin de l\'insertion des données GTFS à :', time.ctime())
 
 
 if __name__ == '__main__':
-    import_gtfs_data()
+    if '--rollback' in sys.argv[1:]:
+        rollback_dataset_version()
+    else:
+        import_gtfs_data()
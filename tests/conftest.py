@@ -0,0 +1,16 @@
+import os
+import sys
+import tempfile
+
+# Configuration minimale pour importer l'application sans service externe (le client MongoDB ne se connecte
+# qu'à la première requête)
+os.environ.setdefault("MONGO_DB", "test")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("OJP_API_URL", "http://ojp.test")
+os.environ.setdefault("GTFS_TIMEZONE", "Europe/Zurich")
+os.environ.setdefault("GEOCODING_CACHE_PATH", os.path.join(tempfile.mkdtemp(), "geocoding_cache.sqlite3"))
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Les scripts de l'ETL s'importent entre eux depuis leur répertoire
+sys.path.insert(0, os.path.join(ROOT, "etl"))
@@ -0,0 +1,61 @@
+from app.api.conversation_history import build_prompt_history, count_leading_messages, estimate_tokens, split_exchanges
+
+
+STEPS = {"destination": "Lausanne", "origin": "Genève", "date": None, "time": None}
+
+
+def conversation(exchanges, length=40):
+    history = [
+        {"role": "system", "content": "Tu es un assistant de transports publics."},
+        {"role": "assistant", "content": "Bonjour, où souhaitez-vous aller ?"},
+    ]
+    for number in range(exchanges):
+        history.append({"role": "user", "content": f"message {number} " + "x" * length})
+        history.append({"role": "assistant", "content": f"réponse {number} " + "y" * length})
+    return history
+
+
+def test_leading_messages():
+    assert count_leading_messages(conversation(2)) == 2
+    assert count_leading_messages([{"role": "user", "content": "bonjour"}]) == 0
+
+
+def test_split_exchanges():
+    exchanges = split_exchanges(conversation(3)[2:])
+    assert [len(exchange) for exchange in exchanges] == [2, 2, 2]
+    assert all(exchange[0]["role"] == "user" for exchange in exchanges)
+
+
+def test_short_history_is_sent_unchanged():
+    history = conversation(2)
+    assert build_prompt_history(history, STEPS, budget=1000, keep_exchanges=3) is history
+
+
+def test_old_exchanges_are_summarized():
+    history = conversation(6)
+    prompt_history = build_prompt_history(history, STEPS, budget=1000, keep_exchanges=2)
+
+    assert prompt_history[:2] == history[:2]
+    summary = prompt_history[2]
+    assert summary["role"] == "system"
+    assert "Résumé des 8 messages précédents" in summary["content"]
+    assert "destination : Lausanne" in summary["content"] and "point de départ : Genève" in summary["content"]
+    assert "Informations manquantes : date, heure." in summary["content"]
+    assert prompt_history[3:] == history[-4:]
+    # L'historique de la session n'est pas modifié
+    assert len(history) == 14
+
+
+def test_budget_limits_kept_exchanges_but_keeps_the_current_message():
+    history = conversation(4, length=400)
+    prompt_history = build_prompt_history(history, STEPS, budget=150, keep_exchanges=3)
+    assert prompt_history[-2:] == history[-2:]
+    assert prompt_history[2]["role"] == "system"
+    assert len(prompt_history) == 5
+
+
+def test_prompt_stays_within_budget():
+    history = conversation(10)
+    budget = 200
+    prompt_history = build_prompt_history(history, STEPS, budget=budget, keep_exchanges=3)
+    assert sum(estimate_tokens(message) for message in prompt_history if "Résumé" not in message["content"]) <= budget
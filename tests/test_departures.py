@@ -0,0 +1,126 @@
+from datetime import date, datetime
+
+import numpy as np
+import pytest
+
+from app.api import departures, service_calendar
+from app.api.departures import get_departures
+from app.api.service_calendar import ServiceCalendar
+
+
+START = date(2026, 10, 18)
+DAYS = 3
+
+
+def bitset(active_days):
+    bits = np.zeros(DAYS, dtype=bool)
+    bits[list(active_days)] = True
+    return np.packbits(bits).tobytes()
+
+
+def bucket(station_id, hour, rows):
+    '''
+    Document de stop_departures : départs (heure GTFS en secondes, service, course, ligne) d'une gare pour une heure
+    '''
+    return {
+        "station_id": station_id,
+        "hour": hour,
+        "times": [row[0] for row in rows],
+        "services": [row[1] for row in rows],
+        "trips": [row[2] for row in rows],
+        "lines": [row[3] for row in rows],
+        "directions": ["Terminus"] * len(rows),
+        "stops": [f"{station_id}:0:1"] * len(rows),
+    }
+
+
+BUCKETS = [
+    # Service du samedi 17 (hors calendrier) et du dimanche 18 après minuit, heures GTFS au-delà de 24h
+    bucket("8501120", 24, [(24 * 3600 + 600, "daily", "night-daily", "N1"), (24 * 3600 + 900, "sunday", "night-sunday", "N2")]),
+    bucket("8501120", 23, [(23 * 3600 + 3000, "daily", "late", "S1")]),
+    bucket("8501120", 0, [(300, "daily", "early", "S2"), (600, "never", "inactive", "S3")]),
+    bucket("8501120", 8, [(8 * 3600 + minute * 60, "daily", f"t{minute}", "IR") for minute in range(0, 60, 5)]),
+    # Deux documents pour la même heure (chunks de l'ETL)
+    bucket("8501120", 9, [(9 * 3600 + 1800, "daily", "t-b", "IC")]),
+    bucket("8501120", 9, [(9 * 3600 + 600, "daily", "t-a", "IC")]),
+]
+
+
+class FakeStopDepartures:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def find(self, query, projection=None):
+        return [
+            document for document in self.documents
+            if document["station_id"] == query["station_id"] and any(
+                hour_filter["hour"]["$gte"] <= document["hour"] <= hour_filter["hour"]["$lte"] for hour_filter in query["$or"]
+            )
+        ]
+
+
+class FakeStops:
+    def find_one(self, query, projection=None):
+        return {"parent_station": "8501120"} if query["stop_id"] == "8501120:0:7" else None
+
+
+class FakeDb:
+    stop_departures = FakeStopDepartures(BUCKETS)
+    stops = FakeStops()
+
+
+@pytest.fixture(autouse=True)
+def timetable(monkeypatch):
+    calendar = ServiceCalendar(
+        service_ids=["daily", "sunday", "never"],
+        start=START,
+        bitsets=[bitset([0, 1, 2]), bitset([0]), bitset([])],
+        days=DAYS
+    )
+    monkeypatch.setattr(service_calendar, "service_calendar", calendar)
+    monkeypatch.setattr(departures, "db", FakeDb())
+    monkeypatch.setattr(departures, "find_stop_id", lambda name: {"Lausanne": ("8501120", "Lausanne"), "Lausanne quai 7": ("8501120:0:7", "Lausanne"), "Nowhere": ("8599999", "Nowhere")}[name])
+
+
+def summary(result):
+    return [(departure["trip_id"], departure["departure_time"]) for departure in result["departures"]]
+
+
+def test_window_crossing_midnight_uses_previous_current_and_next_service_days():
+    result = get_departures("Lausanne", datetime(2026, 10, 19, 23, 45), window_minutes=30)
+    assert summary(result) == [
+        ("late", "2026-10-19T23:50:00"),
+        # Course du 19 après minuit (heure GTFS 24:10) et course du 20 partant juste après minuit
+        ("early", "2026-10-20T00:05:00"),
+        ("night-daily", "2026-10-20T00:10:00"),
+    ]
+
+
+def test_after_midnight_trips_of_the_previous_day_and_inactive_services():
+    result = get_departures("Lausanne", datetime(2026, 10, 19, 0, 0), window_minutes=20)
+    # night-sunday : service du 18 actif, course de 24:15 ; inactive : service jamais actif
+    assert summary(result) == [
+        ("early", "2026-10-19T00:05:00"),
+        ("night-daily", "2026-10-19T00:10:00"),
+        ("night-sunday", "2026-10-19T00:15:00"),
+    ]
+    result = get_departures("Lausanne", datetime(2026, 10, 20, 0, 0), window_minutes=20)
+    assert summary(result) == [("early", "2026-10-20T00:05:00"), ("night-daily", "2026-10-20T00:10:00")]
+
+
+def test_limit_and_merged_buckets_are_sorted():
+    result = get_departures("Lausanne", datetime(2026, 10, 19, 8, 30), window_minutes=90, limit=8)
+    assert [trip_id for trip_id, _ in summary(result)] == ["t30", "t35", "t40", "t45", "t50", "t55", "t-a", "t-b"]
+    result = get_departures("Lausanne", datetime(2026, 10, 19, 8, 30), window_minutes=90, limit=3)
+    assert [trip_id for trip_id, _ in summary(result)] == ["t30", "t35", "t40"]
+
+
+def test_stop_without_departures():
+    result = get_departures("Nowhere", datetime(2026, 10, 19, 8, 0))
+    assert result == {"stop_id": "8599999", "stop_name": "Nowhere", "departures": []}
+
+
+def test_platform_falls_back_to_parent_station():
+    result = get_departures("Lausanne quai 7", datetime(2026, 10, 19, 9, 0), window_minutes=60)
+    assert result["stop_id"] == "8501120"
+    assert [trip_id for trip_id, _ in summary(result)] == ["t-a", "t-b"]
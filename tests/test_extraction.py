@@ -0,0 +1,70 @@
+from datetime import datetime
+
+import pytest
+
+from app.api import stop_index
+from app.api.extraction import extract_date_time, extract_stop
+
+
+# Dimanche 18 octobre 2026, 14h05
+NOW = datetime(2026, 10, 18, 14, 5)
+
+
+@pytest.fixture(autouse=True)
+def stop_resolver(monkeypatch):
+    monkeypatch.setattr(stop_index, "stop_resolver", stop_index.StopResolver([
+        {"stop_id": "8501120", "stop_name": "Lausanne"},
+        {"stop_id": "8501008", "stop_name": "Genève"},
+        {"stop_id": "8503000", "stop_name": "Zürich HB"},
+    ]))
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("le 25.12 à 18h", ("2026-12-25", "18:00:00")),
+    ("le 3/11/2026 à 7h45", ("2026-11-03", "07:45:00")),
+    ("30.10. 14h", ("2026-10-30", "14:00:00")),
+    ("le 1er novembre", ("2026-11-01", None)),
+    ("March 3 at 5pm", ("2027-03-03", "17:00:00")),
+    ("après-demain vers 19:15", ("2026-10-20", "19:15:00")),
+    ("morgen um 8.30 Uhr", ("2026-10-19", "08:30:00")),
+    ("in 2 days at 9am", ("2026-10-20", "09:00:00")),
+    ("lundi", ("2026-10-19", None)),
+    ("dimanche", ("2026-10-25", None)),
+    ("dans 20 minutes", ("2026-10-18", "14:25:00")),
+    ("maintenant", ("2026-10-18", "14:05:00")),
+])
+def test_extract_date_time(text, expected):
+    assert extract_date_time(text, NOW) == expected
+
+
+def test_clock_time_with_dot_is_not_a_date():
+    assert extract_date_time("demain à 8.30", NOW)[0] == "2026-10-19"
+
+
+def test_invalid_date_is_ignored():
+    assert extract_date_time("le 31.02 à 10h", NOW) == (None, "10:00:00")
+
+
+def test_no_date_or_time():
+    assert extract_date_time("je vais à Lausanne", NOW) == (None, None)
+
+
+@pytest.mark.parametrize("text, role, expected", [
+    ("Je vais à Lausanne", "destination", "Lausanne"),
+    ("zurich hb", "origin", "Zürich HB"),
+    ("de Genève à Lausanne", "destination", "Lausanne"),
+    ("de Genève à Lausanne", "origin", "Genève"),
+    ("Lausane", "destination", "Lausanne"),
+])
+def test_extract_stop(text, role, expected):
+    assert extract_stop(text, role) == expected
+
+
+def test_ambiguous_or_missing_stop_falls_back_to_gpt():
+    assert extract_stop("Genève Lausanne", "origin") is None
+    assert extract_stop("je veux partir demain matin", "origin") is None
+
+
+def test_no_stop_index_loaded(monkeypatch):
+    monkeypatch.setattr(stop_index, "stop_resolver", stop_index.StopResolver())
+    assert extract_stop("Lausanne", "destination") is None
@@ -0,0 +1,123 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from app.api import geocoding
+from app.api.geocoding import GeocodingCache, get_coordinates_from_address_async
+
+
+LAUSANNE = (46.5167, 6.6291)
+
+
+def make_cache(tmp_path, **kwargs):
+    return GeocodingCache(**{"path": str(tmp_path / "cache.sqlite3"), "ttl": 100, "negative_ttl": 10, "max_entries": 1000, **kwargs})
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    return now
+
+
+def test_cache_ttl_and_negative_ttl(tmp_path, clock):
+    cache = make_cache(tmp_path)
+    assert cache.get("lausanne") == (False, None)
+
+    cache.put("lausanne", LAUSANNE)
+    cache.put("nulle part", None)
+    assert cache.get("lausanne") == (True, LAUSANNE)
+    assert cache.get("nulle part") == (True, None)
+
+    # Le résultat négatif expire avant le résultat positif
+    clock[0] += 11
+    assert cache.get("nulle part") == (False, None)
+    assert cache.get("lausanne") == (True, LAUSANNE)
+    clock[0] += 90
+    assert cache.get("lausanne") == (False, None)
+
+
+def test_cache_persists_on_disk(tmp_path, clock):
+    make_cache(tmp_path).put("lausanne", LAUSANNE)
+    assert make_cache(tmp_path).get("lausanne") == (True, LAUSANNE)
+
+
+def test_cache_evicts_least_recently_used_entries(tmp_path, clock):
+    cache = make_cache(tmp_path, max_entries=50)
+    for index in range(60):
+        clock[0] += 1
+        cache.put(f"lieu {index}", (46.0, 6.0 + index / 100))
+    # Lecture d'une des plus anciennes entrées : sa date d'utilisation est enregistrée avec l'écriture suivante
+    clock[0] += 1
+    assert cache.get("lieu 0")[0]
+    for index in range(60, 100):
+        clock[0] += 1
+        cache.put(f"lieu {index}", (46.0, 6.0))
+
+    # L'éviction a lieu à la 100e écriture : les 50 entrées les plus récemment utilisées sont conservées
+    count = cache.connection.execute("SELECT COUNT(*) FROM geocoding").fetchone()[0]
+    assert count == 50
+    assert cache.get("lieu 0")[0]
+    assert not cache.get("lieu 1")[0]
+    assert cache.get("lieu 99")[0]
+
+
+@pytest.fixture
+def lookup(monkeypatch, tmp_path):
+    '''
+    Gazetteer, cache et Nominatim isolés ; retourne la liste des adresses envoyées à Nominatim
+    '''
+    calls = []
+    responses = {}
+
+    async def fake_get(url, params=None):
+        calls.append(params["q"])
+        return responses.get(params["q"], httpx.Response(200, json=[], request=httpx.Request("GET", url)))
+
+    async def no_wait():
+        pass
+
+    monkeypatch.setattr(geocoding, "gazetteer", {"lausanne": LAUSANNE})
+    monkeypatch.setattr(geocoding, "geocoding_cache", make_cache(tmp_path))
+    monkeypatch.setattr(geocoding.geocoding_client, "get", fake_get)
+    monkeypatch.setattr(geocoding.nominatim_rate_limiter, "wait", no_wait)
+    return calls, responses
+
+
+def test_gazetteer_is_used_before_cache_and_nominatim(lookup):
+    calls, _ = lookup
+    geocoding.geocoding_cache.put("lausanne", (0.0, 0.0))
+    assert asyncio.run(get_coordinates_from_address_async("  LAUSANNE ")) == LAUSANNE
+    assert calls == []
+
+
+def test_cache_is_used_before_nominatim(lookup):
+    calls, responses = lookup
+    request = httpx.Request("GET", geocoding.NOMINATIM_URL)
+    responses["Rue du Midi 4, Vevey"] = httpx.Response(200, json=[{"lat": "46.46", "lon": "6.84"}], request=request)
+
+    assert asyncio.run(get_coordinates_from_address_async("Rue du Midi 4, Vevey")) == (46.46, 6.84)
+    assert asyncio.run(get_coordinates_from_address_async("rue du midi 4 vevey")) == (46.46, 6.84)
+    # Absence de résultat mise en cache elle aussi
+    assert asyncio.run(get_coordinates_from_address_async("Introuvable")) is None
+    assert asyncio.run(get_coordinates_from_address_async("Introuvable")) is None
+    assert calls == ["Rue du Midi 4, Vevey", "Introuvable"]
+
+
+@pytest.mark.parametrize("body", [b"", b"<html>Too Many Requests</html>"])
+def test_non_json_response_is_a_miss_and_not_cached(lookup, body):
+    calls, responses = lookup
+    responses["Vevey"] = httpx.Response(200, content=body, request=httpx.Request("GET", geocoding.NOMINATIM_URL))
+
+    assert asyncio.run(get_coordinates_from_address_async("Vevey")) is None
+    assert geocoding.geocoding_cache.get("vevey") == (False, None)
+
+
+def test_http_error_is_a_miss_and_not_cached(lookup):
+    calls, responses = lookup
+    responses["Vevey"] = httpx.Response(503, request=httpx.Request("GET", geocoding.NOMINATIM_URL))
+
+    assert asyncio.run(get_coordinates_from_address_async("Vevey")) is None
+    assert geocoding.geocoding_cache.get("vevey") == (False, None)
@@ -0,0 +1,128 @@
+import base64
+import hashlib
+import io
+import os
+import zipfile
+
+import pytest
+
+import gtfs_static_download
+from gtfs_static_download import download_zip, published_sha256
+
+
+ZIP_URL = "https://opentransportdata.swiss/dataset/timetable/gtfs_fp2026_2026-10-15.zip"
+
+
+def make_zip(content="stop_id,stop_name\n8501120,Lausanne\n"):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("stops.txt", content)
+    return buffer.getvalue()
+
+
+def digest_header(data):
+    return "sha-256=:" + base64.b64encode(hashlib.sha256(data).digest()).decode() + ":"
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=b"", headers=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = {"Content-Length": str(len(body)), **(headers or {})}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise IOError(self.status_code)
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), chunk_size):
+            yield self.body[start:start + chunk_size]
+
+
+@pytest.fixture
+def server(monkeypatch, tmp_path):
+    '''
+    Répertoire de téléchargement temporaire et serveur simulé : `responses` est la file des réponses,
+    `requests` les en-têtes reçus
+    '''
+    state = {"responses": [], "requests": []}
+
+    def fake_get(url, headers=None, stream=False, timeout=None):
+        state["requests"].append(headers or {})
+        return state["responses"].pop(0)
+
+    monkeypatch.setattr(gtfs_static_download, "GTFS_DATA_DIR", str(tmp_path))
+    monkeypatch.setattr(gtfs_static_download, "DOWNLOAD_METADATA_PATH", str(tmp_path / "gtfs_static.json"))
+    monkeypatch.setattr(gtfs_static_download, "DOWNLOAD_CHUNK_SIZE", 64)
+    monkeypatch.setattr(gtfs_static_download.requests, "get", fake_get)
+    state["zip_path"] = str(tmp_path / os.path.basename(ZIP_URL))
+    return state
+
+
+def test_published_sha256_headers():
+    data = make_zip()
+    assert published_sha256({"Repr-Digest": digest_header(data)}) == hashlib.sha256(data).hexdigest()
+    legacy = "SHA-256=" + base64.b64encode(hashlib.sha256(data).digest()).decode()
+    assert published_sha256({"Digest": "md5=abc, " + legacy}) == hashlib.sha256(data).hexdigest()
+    assert published_sha256({"Repr-Digest": "sha-256=:not base64!:"}) is None
+    assert published_sha256({}) is None
+
+
+def test_download_checks_published_sha256(server):
+    data = make_zip()
+    server["responses"].append(FakeResponse(200, data, {"ETag": '"v1"', "Repr-Digest": digest_header(data)}))
+    downloaded = download_zip(ZIP_URL, server["zip_path"], {})
+    assert downloaded["sha256"] == hashlib.sha256(data).hexdigest()
+
+    # Archive valide (CRC correct) mais différente de celle annoncée par le serveur
+    server["responses"].append(FakeResponse(200, make_zip("autre"), {"ETag": '"v2"', "Repr-Digest": digest_header(data)}))
+    with pytest.raises(IOError):
+        download_zip(ZIP_URL, server["zip_path"] + ".new", {})
+    assert not os.path.exists(server["zip_path"] + ".new.part")
+
+
+def test_resumed_download_is_checked_against_stored_sha256(server):
+    data = make_zip()
+    metadata = {"url": ZIP_URL, "etag": '"v1"', "sha256": hashlib.sha256(data).hexdigest(), "partial": {"url": ZIP_URL, "etag": '"v1"'}}
+    part_path = server["zip_path"] + ".part"
+
+    # Début du fichier altéré localement : la reprise produit une archive dont l'empreinte ne correspond pas
+    with open(part_path, "wb") as file:
+        file.write(b"X" + data[1:40])
+    server["responses"].append(FakeResponse(206, data[40:], {"ETag": '"v1"'}))
+    with pytest.raises(IOError):
+        download_zip(ZIP_URL, server["zip_path"], dict(metadata))
+    assert server["requests"][-1]["Range"] == "bytes=40-"
+
+    with open(part_path, "wb") as file:
+        file.write(data[:40])
+    server["responses"].append(FakeResponse(206, data[40:], {"ETag": '"v1"'}))
+    downloaded = download_zip(ZIP_URL, server["zip_path"], dict(metadata))
+    assert downloaded["sha256"] == metadata["sha256"]
+    with open(server["zip_path"], "rb") as file:
+        assert file.read() == data
+
+
+def test_unchanged_file_is_verified_before_trusting_the_etag(server):
+    data = make_zip()
+    with open(server["zip_path"], "wb") as file:
+        file.write(data)
+    metadata = {"url": ZIP_URL, "file": os.path.basename(server["zip_path"]), "etag": '"v1"', "sha256": hashlib.sha256(data).hexdigest()}
+
+    server["responses"].append(FakeResponse(304))
+    assert download_zip(ZIP_URL, server["zip_path"], dict(metadata)) is None
+    assert server["requests"][-1]["If-None-Match"] == '"v1"'
+
+    # Fichier local corrompu : téléchargement complet sans en-tête conditionnel
+    with open(server["zip_path"], "wb") as file:
+        file.write(data[:-1] + bytes([data[-1] ^ 1]))
+    server["responses"].append(FakeResponse(200, data, {"ETag": '"v1"'}))
+    downloaded = download_zip(ZIP_URL, server["zip_path"], dict(metadata))
+    assert "If-None-Match" not in server["requests"][-1]
+    assert downloaded["sha256"] == metadata["sha256"]
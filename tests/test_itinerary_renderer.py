@@ -0,0 +1,60 @@
+from app.api.itinerary import Leg, Trip
+from app.api.itinerary_renderer import local_time, render_itineraries
+
+
+def leg(origin, departure, destination, arrival, **kwargs):
+    return Leg(origin_name=origin, departure_time=departure, destination_name=destination, arrival_time=arrival,
+               line=kwargs.pop("line", "IR15"), direction=kwargs.pop("direction", destination), **kwargs)
+
+
+def test_ojp_times_are_rendered_in_swiss_local_time():
+    # Heure d'été : UTC+2
+    trip = Trip(legs=[leg("Lausanne", "2026-10-19T06:30:00Z", "Genève", "2026-10-19T07:05:00Z")])
+    text = render_itineraries([trip], "fr")
+    assert "### Trajet 1 : 08:30 → 09:05 (35 min, direct)" in text
+    assert "- **08:30** Lausanne → **09:05** Genève · IR15 direction Genève" in text
+
+
+def test_local_planner_times_are_already_local():
+    trip = Trip(legs=[leg("A", "2026-12-01T23:50:00", "B", "2026-12-02T00:20:00")])
+    assert "23:50 → 00:20 (30 min, direct)" in render_itineraries([trip], "fr")
+
+
+def test_date_heading_uses_the_local_day():
+    # 22h30 UTC le dimanche 18 octobre : déjà lundi à Zurich
+    trip = Trip(legs=[leg("A", "2026-10-18T22:30:00Z", "B", "2026-10-18T23:00:00Z")])
+    assert "*lundi 19.10.2026*" in render_itineraries([trip], "fr")
+
+
+def test_duration_across_daylight_saving_change():
+    # Passage à l'heure d'été le 29 mars 2026 à 02h00 : 01h50 CET -> 03h20 CEST
+    trip = Trip(legs=[leg("A", "2026-03-29T00:50:00Z", "B", "2026-03-29T01:20:00Z")])
+    assert "01:50 → 03:20 (30 min, direct)" in render_itineraries([trip], "fr")
+    assert local_time("2026-03-29T01:20:00Z").utcoffset().total_seconds() == 7200
+
+
+def test_transfers_delays_and_cancellations_in_german():
+    trip = Trip(legs=[
+        leg("Lausanne", "2026-10-19T06:30:00Z", "Genève", "2026-10-19T07:05:00Z", departure_estimated="2026-10-19T06:33:00Z"),
+        leg("Genève", "2026-10-19T07:12:00Z", "Genève-Aéroport", "2026-10-19T07:19:00Z", line="RE", canceled=True),
+    ])
+    text = render_itineraries([trip], "de-CH")
+    assert "### Verbindung 1: 08:30 → 09:19 (49 min, 1 Umstieg)" in text
+    assert "- **08:30 (+3 Min.)** Lausanne" in text
+    assert "- *Umsteigen in Genève: 7 Min.*" in text
+    assert "⚠️ **Fahrt fällt aus**" in text
+
+
+def test_walk_between_stations():
+    trip = Trip(legs=[
+        leg("A", "2026-10-19T06:00:00Z", "B", "2026-10-19T06:10:00Z"),
+        leg("C", "2026-10-19T06:20:00Z", "D", "2026-10-19T06:30:00Z"),
+    ])
+    assert "- *Change from B to C: 10 min*" in render_itineraries([trip], "en")
+
+
+def test_unknown_language_and_empty_trips():
+    trip = Trip(legs=[leg("A", "2026-10-19T06:00:00Z", "B", "2026-10-19T06:10:00Z")])
+    assert render_itineraries([trip], "xx").endswith("Vous pouvez demander une nouvelle recherche à tout moment.")
+    assert render_itineraries([], "fr") == ""
+    assert render_itineraries([Trip()], "fr") == ""
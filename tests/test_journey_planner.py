@@ -0,0 +1,124 @@
+from datetime import date, datetime
+
+import numpy as np
+
+from app.api.journey_planner import parse_gtfs_time, Timetable
+from app.api.service_calendar import ServiceCalendar
+
+
+STATIONS = ["A", "B", "C", "D", "E"]
+A, B, C, D, E = range(len(STATIONS))
+
+
+def make_timetable(start, days, services, trips, transfer_times=None, footpaths=None):
+    '''
+    Horaires synthétiques : `services` associe chaque service à ses jours actifs (décalages depuis `start`),
+    `trips` donne pour chaque course son service et ses passages [(gare, heure GTFS)]
+    '''
+    bitsets = []
+    for active_days in services.values():
+        bits = np.zeros(days, dtype=bool)
+        bits[list(active_days)] = True
+        bitsets.append(np.packbits(bits).tobytes())
+    calendar = ServiceCalendar(service_ids=list(services), start=start, bitsets=bitsets, days=days)
+
+    connections = []
+    for trip, (_, stops) in enumerate(trips):
+        for (dep_station, dep_time), (arr_station, arr_time) in zip(stops, stops[1:]):
+            connections.append((parse_gtfs_time(dep_time), parse_gtfs_time(arr_time), trip, dep_station, arr_station))
+    connections.sort()
+    dep_times, arr_times, conn_trips, dep_stations, arr_stations = (np.array(column) for column in zip(*connections))
+
+    return Timetable(
+        STATIONS, [f"Gare {station}" for station in STATIONS], {station: index for index, station in enumerate(STATIONS)},
+        [f"t{trip}" for trip in range(len(trips))], [f"j{trip}" for trip in range(len(trips))],
+        [f"L{trip}" for trip in range(len(trips))], ["Terminus"] * len(trips),
+        np.array([calendar.index(service) for service, _ in trips], dtype=np.int32), calendar,
+        conn_trips.astype(np.int32), dep_stations.astype(np.int32), arr_stations.astype(np.int32),
+        dep_times.astype(np.int64), arr_times.astype(np.int64),
+        transfer_times or [120] * len(STATIONS), footpaths or {}
+    )
+
+
+START = date(2026, 10, 18)
+DAY = date(2026, 10, 19)
+
+
+def network():
+    return make_timetable(START, 3, {"daily": [0, 1, 2], "saturday_night": [0], "never": []}, [
+        ("daily", [(A, "08:00:00"), (B, "08:30:00")]),
+        # Correspondance trop courte à B (120 s)
+        ("daily", [(B, "08:31:00"), (C, "09:00:00")]),
+        ("daily", [(B, "08:35:00"), (C, "09:05:00")]),
+        # Course du service de la veille, après minuit
+        ("saturday_night", [(A, "24:30:00"), (B, "25:00:00")]),
+        ("never", [(A, "08:10:00"), (B, "08:20:00")]),
+        ("daily", [(A, "09:00:00"), (B, "09:30:00")]),
+    ], footpaths={C: [(D, 300)]})
+
+
+def summary(trip):
+    return [(leg.trip_id, leg.origin_stop_ref, leg.departure_time, leg.destination_stop_ref, leg.arrival_time) for leg in trip.legs]
+
+
+def test_direct_ride():
+    timetable = network()
+    legs = timetable.earliest_arrival(A, B, DAY, 7 * 3600)
+    assert [(int(timetable.conn_trips[enter]), shift) for enter, _, shift in legs] == [(0, 0)]
+
+    trips = timetable.plan("A", "B", datetime(2026, 10, 19, 7, 50), max_results=1)
+    assert summary(trips[0]) == [("t0", "A", "2026-10-19T08:00:00", "B", "2026-10-19T08:30:00")]
+
+
+def test_transfer_respects_transfer_time():
+    trips = network().plan("A", "C", datetime(2026, 10, 19, 7, 50), max_results=1)
+    assert summary(trips[0]) == [
+        ("t0", "A", "2026-10-19T08:00:00", "B", "2026-10-19T08:30:00"),
+        ("t2", "B", "2026-10-19T08:35:00", "C", "2026-10-19T09:05:00"),
+    ]
+
+
+def test_footpath_transfer():
+    timetable = network()
+    trips = timetable.plan("A", "D", datetime(2026, 10, 19, 7, 50), max_results=1)
+    # La marche finale n'est pas une étape : l'itinéraire s'arrête à la gare d'où part le trajet à pied
+    assert [leg.destination_stop_ref for leg in trips[0].legs] == ["B", "C"]
+    assert timetable.earliest_arrival(A, D, DAY, 7 * 3600) == timetable.earliest_arrival(A, C, DAY, 7 * 3600)
+
+
+def test_after_midnight_trip_of_previous_service_day():
+    trips = network().plan("A", "B", datetime(2026, 10, 19, 0, 10), max_results=1)
+    assert summary(trips[0]) == [("t3", "A", "2026-10-19T00:30:00", "B", "2026-10-19T01:00:00")]
+
+
+def test_inactive_service_is_skipped():
+    trips = network().plan("A", "B", datetime(2026, 10, 19, 8, 5), max_results=1)
+    assert summary(trips[0])[0][0] == "t5"
+
+
+def test_unreachable_destination():
+    timetable = network()
+    assert timetable.earliest_arrival(A, E, DAY, 7 * 3600) is None
+    assert timetable.plan("A", "E", datetime(2026, 10, 19, 7, 50)) == []
+    assert timetable.plan("A", "unknown", datetime(2026, 10, 19, 7, 50)) == []
+
+
+def test_plan_returns_successive_itineraries():
+    trips = network().plan("A", "B", datetime(2026, 10, 19, 7, 50), max_results=3)
+    assert [summary(trip)[0][:3] for trip in trips] == [
+        ("t0", "A", "2026-10-19T08:00:00"),
+        ("t5", "A", "2026-10-19T09:00:00"),
+    ]
+
+
+def test_times_follow_noon_minus_twelve_hours_on_dst_change():
+    # 29 mars 2026 : passage à l'heure d'été, l'origine des heures GTFS est 23:00 la veille
+    timetable = make_timetable(date(2026, 3, 28), 2, {"sunday": [1]}, [
+        ("sunday", [(A, "01:30:00"), (B, "02:30:00")]),
+        ("sunday", [(A, "05:00:00"), (B, "05:30:00")]),
+    ])
+    trips = timetable.plan("A", "B", datetime(2026, 3, 29, 0, 0), max_results=2)
+    assert [summary(trip)[0][2:] for trip in trips] == [
+        ("2026-03-29T00:30:00", "B", "2026-03-29T01:30:00"),
+        ("2026-03-29T05:00:00", "B", "2026-03-29T05:30:00"),
+    ]
@@ -0,0 +1,102 @@
+import asyncio
+import json
+
+import pytest
+
+from app.api import live, realtime
+from app.api.live import LiveHub, live_updates
+from app.api.realtime import RealtimeIndex
+
+
+def update(trip_id, delay):
+    return {"trip_id": trip_id, "start_date": "20261019", "stop_time_updates": [{"stop_id": "8501120:0:3", "departure_delay": delay}]}
+
+
+@pytest.fixture
+def index(monkeypatch):
+    index = RealtimeIndex()
+    index.apply([update("t1", 60), update("t2", 120)])
+    index.journey_trips["ch:1:sjyid:100001:1715-001"] = "t1"
+    index.trip_journeys["t1"] = "ch:1:sjyid:100001:1715-001"
+    monkeypatch.setattr(realtime, "realtime_index", index)
+    return index
+
+
+def payload(message):
+    event, data = message.strip().split("\n")
+    assert event == "event: trip_update"
+    return json.loads(data[len("data: "):])
+
+
+def pending(subscription):
+    return [payload(message) for message in subscription.pending.values()]
+
+
+def test_publish_fans_out_by_trip_id_and_journey_ref(index):
+    hub = LiveHub()
+    by_trip = hub.subscribe(["t1"])
+    by_journey = hub.subscribe(["ch:1:sjyid:100001:1715-001"])
+    other = hub.subscribe(["t2"])
+    unrelated = hub.subscribe(["t3"])
+
+    hub.publish(["t1"])
+
+    assert [message["trip_id"] for message in pending(by_trip)] == ["t1"]
+    assert pending(by_journey) == pending(by_trip)
+    assert pending(other) == pending(unrelated) == []
+    assert hub.stats()["published"] == 1 and hub.stats()["delivered"] == 2
+
+
+def test_slow_client_gets_only_the_latest_state(index):
+    hub = LiveHub()
+    subscription = hub.subscribe(["t1", "t2"])
+    hub.publish(["t1", "t2"])
+    index.apply([update("t1", 300)])
+    hub.publish(["t1"])
+
+    messages = asyncio.run(subscription.next_messages(0.01))
+    assert [(message["trip_id"], message["delay"]) for message in map(payload, messages)] == [("t1", 300), ("t2", 120)]
+    assert asyncio.run(subscription.next_messages(0.01)) == []
+
+
+def test_snapshot_resolves_journey_refs(index):
+    hub = LiveHub()
+    messages = hub.snapshot(["ch:1:sjyid:100001:1715-001", "t2", "unknown"])
+    assert [payload(message)["trip_id"] for message in messages] == ["t1", "t2"]
+
+
+def test_live_updates_keepalive_and_unsubscribe(index, monkeypatch):
+    hub = LiveHub()
+    monkeypatch.setattr(live, "live_hub", hub)
+    monkeypatch.setattr(live, "LIVE_KEEPALIVE", 0.01)
+
+    async def follow():
+        stream = live_updates(["t1", "t3"])
+        received = [await stream.__anext__(), await stream.__anext__()]
+        assert hub.stats()["followed_trips"] == 2
+        # Aucune mise à jour pendant LIVE_KEEPALIVE : message de maintien de connexion
+        received.append(await stream.__anext__())
+        hub.publish(["t1"])
+        received.append(await stream.__anext__())
+        await stream.aclose()
+        return received
+
+    subscribed, snapshot, keepalive, published = asyncio.run(follow())
+    assert subscribed == 'event: subscribed\ndata: {"trips":["t1","t3"]}\n\n'
+    assert payload(snapshot)["delay"] == 60
+    assert keepalive == ": keepalive\n\n"
+    assert payload(published)["trip_id"] == "t1"
+    # Client déconnecté : plus aucun abonnement
+    assert hub.subscriptions == {}
+    assert hub.stats()["subscribers"] == 0
+
+
+def test_unsubscribe_keeps_other_subscribers(index):
+    hub = LiveHub()
+    first = hub.subscribe(["t1", "t2"])
+    second = hub.subscribe(["t1"])
+    hub.unsubscribe(first)
+    assert set(hub.subscriptions) == {"t1"}
+    hub.publish(["t1", "t2"])
+    assert [message["trip_id"] for message in pending(second)] == ["t1"]
+    assert pending(first) == []
@@ -0,0 +1,102 @@
+import pytest
+
+import load_gtfs_data
+
+
+class FakeMetadata:
+    '''
+    Collection gtfs_metadata en mémoire (find_one, update_one avec $addToSet / $pull)
+    '''
+
+    def __init__(self, documents):
+        self.documents = {document["_id"]: document for document in documents}
+
+    def find_one(self, query):
+        return self.documents.get(query["_id"])
+
+    def update_one(self, query, update, upsert=False):
+        document = self.documents.setdefault(query["_id"], {"_id": query["_id"]})
+        for field, value in update.get("$addToSet", {}).items():
+            values = document.setdefault(field, [])
+            if value not in values:
+                values.append(value)
+        for field, value in update.get("$pull", {}).items():
+            document[field] = [item for item in document.get(field, []) if item != value]
+
+
+class FakeClient:
+    def __init__(self, database_names):
+        self.database_names = set(database_names)
+        self.dropped = []
+
+    def list_database_names(self):
+        return sorted(self.database_names)
+
+    def drop_database(self, name):
+        self.dropped.append(name)
+        self.database_names.discard(name)
+
+    def __getitem__(self, name):
+        return name
+
+
+class FakeBaseDb:
+    name = "transport"
+
+    def __init__(self, metadata):
+        self.gtfs_metadata = metadata
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    client = FakeClient([
+        "transport", "transport_test", "transport_backup", "transport_20991231T000000_copy",
+        "transport_20260101T000000", "transport_20260201T000000", "transport_20260301T000000",
+        "transport_20260401T000000",
+    ])
+    metadata = FakeMetadata([
+        {
+            "_id": "active",
+            "database": "transport_20260401T000000",
+            "previous": {"database": "transport_20260301T000000"},
+        },
+        {
+            "_id": "versions",
+            "databases": [
+                "transport_20260201T000000", "transport_20260301T000000", "transport_20260401T000000",
+                "transport_backup",
+            ],
+        },
+    ])
+    monkeypatch.setattr(load_gtfs_data, "mongo_client", client)
+    monkeypatch.setattr(load_gtfs_data, "base_db", FakeBaseDb(metadata))
+    monkeypatch.setattr(load_gtfs_data, "db", None)
+    return client, metadata
+
+
+def test_is_version_database(mongo):
+    assert load_gtfs_data.is_version_database("transport_20260101T000000")
+    assert not load_gtfs_data.is_version_database("transport_test")
+    assert not load_gtfs_data.is_version_database("transport_20991231T000000_copy")
+    assert not load_gtfs_data.is_version_database("other_20260101T000000")
+
+
+def test_drop_old_versions_keeps_active_previous_and_unrelated_databases(mongo):
+    client, metadata = mongo
+    load_gtfs_data.drop_old_versions()
+
+    assert client.dropped == ["transport_20260201T000000"]
+    assert {"transport_test", "transport_backup", "transport_20991231T000000_copy"} <= client.database_names
+    # Une base de version non enregistrée par l'ETL n'est pas touchée
+    assert "transport_20260101T000000" in client.database_names
+    assert metadata.documents["versions"]["databases"] == [
+        "transport_20260301T000000", "transport_20260401T000000", "transport_backup",
+    ]
+
+
+def test_use_version_database_records_the_new_version(mongo):
+    client, metadata = mongo
+    database_name = load_gtfs_data.use_version_database("20260501T000000")
+
+    assert database_name == "transport_20260501T000000"
+    assert "transport_20260501T000000" in metadata.documents["versions"]["databases"]
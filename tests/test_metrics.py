@@ -0,0 +1,67 @@
+import asyncio
+import threading
+
+import pytest
+
+from app.api.metrics import Counter, Histogram, render_metrics, track_step
+
+
+def test_counter_render():
+    counter = Counter("tp_test_total", "Compteur de test", ("dependency",))
+    counter.inc("ojp")
+    counter.inc("ojp", amount=2)
+    counter.inc("mongo")
+    assert counter.render() == [
+        "# HELP tp_test_total Compteur de test",
+        "# TYPE tp_test_total counter",
+        'tp_test_total{dependency="mongo"} 1',
+        'tp_test_total{dependency="ojp"} 3',
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("tp_test_seconds", "Histogramme de test", ("step",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value, "origin")
+    assert histogram.render()[2:] == [
+        'tp_test_seconds_bucket{step="origin",le="0.1"} 2',
+        'tp_test_seconds_bucket{step="origin",le="1.0"} 3',
+        'tp_test_seconds_bucket{step="origin",le="+Inf"} 4',
+        'tp_test_seconds_sum{step="origin"} 2.65',
+        'tp_test_seconds_count{step="origin"} 4',
+    ]
+
+
+def test_render_while_observing_from_other_threads():
+    histogram = Histogram("tp_test_seconds", "Histogramme de test", ("label",))
+    done = threading.Event()
+
+    def observe():
+        for number in range(20000):
+            histogram.observe(0.01, str(number % 1000))
+        done.set()
+
+    thread = threading.Thread(target=observe)
+    thread.start()
+    while not done.is_set():
+        histogram.render()
+    thread.join()
+    assert 'tp_test_seconds_count{label="0"} 20' in histogram.render()
+
+
+def test_track_step_counts_errors():
+    @track_step
+    async def failing_step():
+        raise ValueError("erreur")
+
+    with pytest.raises(ValueError):
+        asyncio.run(failing_step())
+    assert 'tp_chatbot_step_errors_total{step="failing_step"} 1' in render_metrics({})
+
+
+def test_component_stats_are_exported_as_gauges():
+    text = render_metrics({"trip_cache": {"hits": 3, "hit_ratio": 0.75, "enabled": True, "backend": "memory"}})
+    assert "# TYPE tp_trip_cache_hits gauge\ntp_trip_cache_hits 3\n" in text
+    assert "tp_trip_cache_hit_ratio 0.75\n" in text
+    assert "tp_trip_cache_enabled" not in text and "tp_trip_cache_backend" not in text
+    assert text.endswith("\n")
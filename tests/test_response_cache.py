@@ -0,0 +1,74 @@
+from app.api.response_cache import ResponseCache, template_fields
+
+
+PARAMS = {"stop": "Lausanne"}
+
+
+def test_reply_is_served_once_enough_variants_are_cached():
+    cache = ResponseCache(max_size=10, variants=3)
+    for count, reply in enumerate(["Départ de Lausanne ?", "Vous partez de Lausanne ?", "Lausanne, c'est noté."], start=1):
+        assert cache.get("confirm", "fr", PARAMS) is None
+        cache.add("confirm", "fr", PARAMS, reply)
+        # Une formulation déjà connue ne compte pas
+        cache.add("confirm", "fr", PARAMS, reply)
+        assert len(cache.entries[cache.make_key("confirm", "fr", PARAMS)]) == count
+
+    assert cache.get("confirm", "fr", PARAMS) in {"Départ de Lausanne ?", "Vous partez de Lausanne ?", "Lausanne, c'est noté."}
+    # La langue et les paramètres font partie de la clé
+    assert cache.get("confirm", "de", PARAMS) is None
+    assert cache.get("confirm", "fr", {"stop": "Genève"}) is None
+    assert (cache.hits, cache.misses) == (1, 5)
+
+
+def test_templates_are_expanded_for_any_parameters():
+    cache = ResponseCache(max_size=10, variants=2)
+    assert cache.add_template("confirm", "fr", "Départ de {stop} ?", {"stop"})
+    assert cache.missing_templates("confirm", "fr") == 1
+    assert cache.get("confirm", "fr", PARAMS) is None
+
+    assert cache.add_template("confirm", "fr", "Vous partez de {stop} ?", {"stop"})
+    assert cache.missing_templates("confirm", "fr") == 0
+    assert cache.get("confirm", "fr", {"stop": "Genève"}) in {"Départ de Genève ?", "Vous partez de Genève ?"}
+    assert cache.get("confirm", "fr", PARAMS) in {"Départ de Lausanne ?", "Vous partez de Lausanne ?"}
+
+
+def test_add_template_rejects_mismatched_or_malformed_fields():
+    cache = ResponseCache(max_size=10, variants=3)
+    assert not cache.add_template("confirm", "fr", "Départ de Lausanne ?", {"stop"})
+    assert not cache.add_template("confirm", "fr", "Départ de {stop} le {date} ?", {"stop"})
+    assert not cache.add_template("confirm", "fr", "Départ de {arret} ?", {"stop"})
+    assert not cache.add_template("confirm", "fr", "Départ de {stop ?", {"stop"})
+    assert cache.missing_templates("confirm", "fr") == 3
+    assert template_fields("{stop} le {date} à {time}") == {"stop", "date", "time"}
+
+
+def test_least_recently_used_reply_is_evicted():
+    cache = ResponseCache(max_size=2, variants=1)
+    for stop in ("Lausanne", "Genève"):
+        cache.add("confirm", "fr", {"stop": stop}, f"Départ de {stop} ?")
+    assert cache.get("confirm", "fr", {"stop": "Lausanne"}) == "Départ de Lausanne ?"
+
+    cache.add("confirm", "fr", {"stop": "Berne"}, "Départ de Berne ?")
+    assert cache.get("confirm", "fr", {"stop": "Genève"}) is None
+    assert cache.get("confirm", "fr", {"stop": "Lausanne"}) == "Départ de Lausanne ?"
+    assert cache.evictions == 1
+    assert cache.stats()["entries"] == 2
+
+
+class FakeCollection:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def find(self, query):
+        return [document for document in self.documents if document["language"] == query["language"]]
+
+
+def test_load_templates_ignores_changed_prompts():
+    collection = FakeCollection([
+        {"name": "confirm", "language": "fr", "prompt": "Confirme {stop}", "templates": ["Départ de {stop} ?"]},
+        {"name": "ask_time", "language": "fr", "prompt": "Ancien prompt", "templates": ["À quelle heure ?"]},
+        {"name": "confirm", "language": "de", "prompt": "Confirme {stop}", "templates": ["Abfahrt in {stop}?"]},
+    ])
+    cache = ResponseCache(max_size=10, variants=1)
+    cache.load_templates(collection, {"confirm": "Confirme {stop}", "ask_time": "Demande l'heure"}, "fr")
+    assert cache.templates == {("confirm", "fr"): ["Départ de {stop} ?"]}
@@ -0,0 +1,69 @@
+from datetime import date, timedelta
+
+import numpy as np
+
+from app.api.service_calendar import ServiceCalendar
+
+
+START = date(2026, 10, 12)  # lundi
+DAYS = 14
+
+
+def bitset(active_days):
+    bits = np.zeros(DAYS, dtype=bool)
+    bits[list(active_days)] = True
+    return np.packbits(bits).tobytes()
+
+
+def make_calendar():
+    weekdays = [offset for offset in range(DAYS) if (START + timedelta(days=offset)).weekday() < 5]
+    return ServiceCalendar(
+        service_ids=["weekdays", "sunday", "holiday"],
+        start=START,
+        bitsets=[bitset(weekdays), bitset([6, 13]), bitset([3])],
+        days=DAYS
+    )
+
+
+def test_active_services_by_day():
+    calendar = make_calendar()
+    assert calendar.active_service_ids(date(2026, 10, 12)) == ["weekdays"]
+    assert calendar.active_service_ids(date(2026, 10, 15)) == ["weekdays", "holiday"]
+    assert calendar.active_service_ids(date(2026, 10, 17)) == []
+    assert calendar.active_service_ids(date(2026, 10, 25)) == ["sunday"]
+
+
+def test_is_active():
+    calendar = make_calendar()
+    assert calendar.is_active("sunday", date(2026, 10, 18))
+    assert not calendar.is_active("weekdays", date(2026, 10, 18))
+
+
+def test_days_outside_the_validity_period_have_no_service():
+    calendar = make_calendar()
+    assert calendar.end == date(2026, 10, 25)
+    assert calendar.day_offset(date(2026, 10, 11)) is None
+    assert calendar.day_offset(date(2026, 10, 26)) is None
+    assert not calendar.active_services(date(2026, 10, 26)).any()
+    assert not calendar.active_services(date(2026, 10, 11)).any()
+
+
+def test_unknown_service_is_never_active():
+    calendar = make_calendar()
+    assert calendar.index("unknown") == calendar.unknown_service == 3
+    for offset in range(DAYS):
+        assert not calendar.active_services(START + timedelta(days=offset))[calendar.unknown_service]
+
+
+def test_mask_indexes_trip_services():
+    calendar = make_calendar()
+    trip_services = np.array([calendar.index(service_id) for service_id in ["weekdays", "sunday", "unknown", "holiday"]])
+    active = calendar.active_services(date(2026, 10, 15))
+    assert active[trip_services].tolist() == [True, False, False, True]
+
+
+def test_empty_calendar():
+    calendar = ServiceCalendar()
+    assert len(calendar) == 0
+    assert calendar.end is None
+    assert calendar.active_service_ids(date(2026, 10, 18)) == []
@@ -0,0 +1,86 @@
+import time
+
+import pytest
+
+from app.api import session_store
+from app.api.session_store import compact_session, MemorySessionStore, trim_history
+
+
+def make_session(turns=1):
+    history = [
+        {"role": "system", "content": "Tu es un assistant."},
+        {"role": "assistant", "content": "Bonjour ! Où souhaitez-vous aller ?"},
+    ]
+    for turn in range(turns):
+        history.append({"role": "user", "content": f"question {turn}"})
+        history.append({"role": "assistant", "content": f"réponse {turn}"})
+    return {"steps": {"destination": "Genève"}, "conversation_history": history, "count_trip_details": 1}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_session_expires_after_ttl(clock):
+    store = MemorySessionStore(max_sessions=10, ttl=60)
+    store.save("a", make_session())
+    clock[0] += 59
+    assert store.get("a")["steps"] == {"destination": "Genève"}
+
+    # Chaque enregistrement repousse l'expiration
+    store.save("a", make_session())
+    clock[0] += 59
+    assert store.get("a") is not None
+    clock[0] += 2
+    assert store.get("a") is None
+    assert store.stats()["expirations"] == 1
+
+
+def test_expired_sessions_are_dropped_on_save(clock):
+    store = MemorySessionStore(max_sessions=10, ttl=60)
+    store.save("a", make_session())
+    store.save("b", make_session())
+    clock[0] += 61
+    store.save("c", make_session())
+    assert list(store.sessions) == ["c"]
+    assert store.stats()["expirations"] == 2
+
+
+def test_least_recently_saved_session_is_evicted(clock):
+    store = MemorySessionStore(max_sessions=2, ttl=60)
+    store.save("a", make_session())
+    store.save("b", make_session())
+    store.save("a", make_session())
+    store.save("c", make_session())
+
+    assert store.get("b") is None
+    assert store.get("a") is not None and store.get("c") is not None
+    assert store.stats()["evictions"] == 1
+    assert store.stats()["sessions"] == 2
+
+
+def test_trim_history_keeps_system_and_welcome_messages(monkeypatch):
+    monkeypatch.setattr(session_store, "SESSION_MAX_HISTORY", 6)
+    history = make_session(turns=5)["conversation_history"]
+
+    trimmed = trim_history(history)
+    assert len(trimmed) == 6
+    assert trimmed[:2] == history[:2]
+    assert trimmed[2:] == history[-4:]
+    # Historique assez court : inchangé
+    assert trim_history(history[:6]) == history[:6]
+
+
+def test_saved_session_is_compact(monkeypatch, clock):
+    monkeypatch.setattr(session_store, "SESSION_MAX_HISTORY", 4)
+    store = MemorySessionStore(max_sessions=10, ttl=60)
+    session = {**make_session(turns=3), "transient": "non conservé"}
+    store.save("a", session)
+
+    saved = store.get("a")
+    assert saved == compact_session(session)
+    assert "transient" not in saved
+    assert [message["content"] for message in saved["conversation_history"]][2:] == ["question 2", "réponse 2"]
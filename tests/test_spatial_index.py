@@ -0,0 +1,104 @@
+import math
+import random
+
+import pytest
+
+from app.api.spatial_index import EARTH_RADIUS_M, StopSpatialIndex
+
+
+def make_stops(count=400, seed=7):
+    '''
+    Arrêts aléatoires autour de Lausanne, quelques quais partageant le nom de leur gare,
+    et des arrêts placés exactement sur les limites des cellules
+    '''
+    rng = random.Random(seed)
+    stops = []
+    for index in range(count):
+        name = f"Arrêt {index // 2}" if index % 10 < 2 else f"Arrêt {index}"
+        stops.append({"stop_id": f"s{index}", "stop_name": name, "lat": rng.uniform(46.3, 46.7), "lon": rng.uniform(6.4, 6.9)})
+    for index, (lat, lon) in enumerate([(46.5, 6.6), (46.51, 6.6), (46.5, 6.61), (46.49, 6.59)]):
+        stops.append({"stop_id": f"edge{index}", "stop_name": f"Limite {index}", "lat": lat, "lon": lon})
+    return stops
+
+
+def distance(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def brute_force(stops, lat, lon, k=1, radius=None, unique_names=True):
+    ranked = sorted(((distance(lat, lon, stop["lat"], stop["lon"]), stop) for stop in stops), key=lambda item: item[0])
+    results = []
+    seen_names = set()
+    for stop_distance, stop in ranked:
+        if radius is not None and stop_distance > radius:
+            break
+        if unique_names:
+            if stop["stop_name"] in seen_names:
+                continue
+            seen_names.add(stop["stop_name"])
+        results.append((stop["stop_id"], stop_distance))
+        if k is not None and len(results) >= k:
+            break
+    return results
+
+
+def assert_matches(results, expected):
+    assert [result["stop_id"] for result in results] == [stop_id for stop_id, _ in expected]
+    assert [result["distance"] for result in results] == pytest.approx([value for _, value in expected], abs=0.1)
+
+
+QUERIES = [(46.52, 6.63), (46.5, 6.6), (46.51, 6.61), (46.3001, 6.4001), (46.9, 7.2), (45.0, 5.0)]
+
+
+@pytest.mark.parametrize("k", [1, 5, 20])
+@pytest.mark.parametrize("unique_names", [True, False])
+def test_k_nearest_matches_brute_force(k, unique_names):
+    stops = make_stops()
+    index = StopSpatialIndex(stops)
+    for lat, lon in QUERIES:
+        assert_matches(index.query(lat, lon, k=k, unique_names=unique_names), brute_force(stops, lat, lon, k=k, unique_names=unique_names))
+
+
+def test_stops_on_cell_boundaries_are_found():
+    stops = make_stops()
+    index = StopSpatialIndex(stops)
+    for stop in stops[-4:]:
+        results = index.query(stop["lat"], stop["lon"], k=1)
+        assert results[0]["stop_id"] == stop["stop_id"]
+        assert results[0]["distance"] == 0
+
+
+@pytest.mark.parametrize("radius", [50, 800, 3000])
+def test_radius_cutoff_matches_brute_force(radius):
+    stops = make_stops()
+    index = StopSpatialIndex(stops)
+    for lat, lon in QUERIES:
+        results = index.query(lat, lon, k=None, radius=radius)
+        assert_matches(results, brute_force(stops, lat, lon, k=None, radius=radius))
+        assert all(result["distance"] <= radius for result in results)
+        # Les deux critères combinés : au plus k arrêts, tous dans le rayon
+        assert_matches(index.query(lat, lon, k=3, radius=radius), brute_force(stops, lat, lon, k=3, radius=radius))
+
+
+def test_k_larger_than_stop_count_returns_every_stop():
+    stops = make_stops(count=6)
+    index = StopSpatialIndex(stops)
+    results = index.query(46.5, 6.6, k=50, unique_names=False)
+    assert len(results) == len(stops)
+    assert_matches(results, brute_force(stops, 46.5, 6.6, k=50, unique_names=False))
+
+
+def test_query_many_matches_individual_queries():
+    stops = make_stops()
+    index = StopSpatialIndex(stops)
+    assert index.query_many(QUERIES, k=3, radius=5000) == [index.query(lat, lon, k=3, radius=5000) for lat, lon in QUERIES]
+
+
+def test_empty_index():
+    index = StopSpatialIndex()
+    assert len(index) == 0
+    assert index.query(46.5, 6.6, k=5) == []
+    assert index.query(46.5, 6.6, k=None, radius=1000) == []
+    assert index.query_many([(46.5, 6.6), (47.0, 8.0)]) == [[], []]
@@ -0,0 +1,55 @@
+from app.api.stop_index import StopResolver, StopSearchIndex, normalize_stop_name
+
+
+STOPS = [
+    {"stop_id": "8501120", "stop_name": "Lausanne"},
+    {"stop_id": "8501120:0:3", "stop_name": "Lausanne", "parent_station": "8501120"},
+    {"stop_id": "8501008", "stop_name": "Genève"},
+    {"stop_id": "8503000", "stop_name": "Zürich HB"},
+    {"stop_id": "8592050", "stop_name": "Lausanne, Ouchy"},
+]
+
+
+def test_normalize_stop_name():
+    assert normalize_stop_name("  Zürich  HB ") == "zurich hb"
+    assert normalize_stop_name("Lausanne, Ouchy-Olympique") == "lausanne ouchy olympique"
+
+
+def test_resolver_exact_name_ignores_case_and_accents():
+    resolver = StopResolver(STOPS)
+    assert resolver.resolve("geneve") == ("8501008", "Genève")
+    assert resolver.resolve("ZURICH hb") == ("8503000", "Zürich HB")
+
+
+def test_resolver_prefers_parent_station():
+    resolver = StopResolver(STOPS)
+    assert resolver.resolve("Lausanne") == ("8501120", "Lausanne")
+
+
+def test_resolver_tolerates_typos():
+    resolver = StopResolver(STOPS)
+    assert resolver.resolve("Lausane") == ("8501120", "Lausanne")
+    assert resolver.resolve("Lausanne Ouchi") == ("8592050", "Lausanne, Ouchy")
+
+
+def test_resolver_rejects_distant_names():
+    resolver = StopResolver(STOPS)
+    assert resolver.resolve("Bern") is None
+    assert resolver.resolve("") is None
+    assert resolver.resolve(None) is None
+
+
+def test_search_ranks_exact_then_prefix_then_word_then_substring():
+    index = StopSearchIndex(["Lausanne", "Lausanne, Ouchy", "Renens VD, Lausanne-Ouest", "Prilly-Malley"])
+    assert index.search("lausanne") == ["Lausanne", "Lausanne, Ouchy", "Renens VD, Lausanne-Ouest"]
+    assert index.search("ouch") == ["Lausanne, Ouchy"]
+    assert index.search("alley") == ["Prilly-Malley"]
+
+
+def test_search_pagination():
+    index = StopSearchIndex(["Bern", "Bern Bümpliz", "Bern Wankdorf", "Bern Europaplatz"])
+    first_page = index.search("bern", limit=2)
+    second_page = index.search("bern", limit=2, offset=2)
+    assert first_page[0] == "Bern"
+    assert len(first_page) == 2 and len(second_page) == 2
+    assert not set(first_page) & set(second_page)
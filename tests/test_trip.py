@@ -0,0 +1,133 @@
+import asyncio
+import httpx
+
+from datetime import datetime, timezone
+from pathlib import Path
+
+from app.api import journey_planner, trip
+from app.api.http_clients import ojp_client
+from app.api.realtime import RealtimeIndex
+from app.api.trip import fetch_trip, iter_trips
+
+
+OJP_TRIP_RESPONSE = Path(__file__).parent / "data" / "ojp_trip_response.xml"
+
+
+def load_trips():
+    return list(iter_trips([OJP_TRIP_RESPONSE.read_bytes()]))
+
+
+def chunked(data, size):
+    return [data[start:start + size] for start in range(0, len(data), size)]
+
+
+def test_iter_trips_reads_timed_legs_of_each_trip():
+    trips = load_trips()
+    assert [len(trip.legs) for trip in trips] == [2, 1]
+
+    first, second = trips[0].legs
+    assert (first.origin_name, first.destination_name, first.line, first.direction) == (
+        "Lausanne", "Genève", "IR15", "Genève-Aéroport"
+    )
+    assert first.journey_ref == "ch:1:sjyid:100001:1715-001"
+    assert (first.departure_time, first.departure_estimated) == ("2026-10-19T06:30:00Z", "2026-10-19T06:33:00Z")
+    assert (first.arrival_time, first.arrival_estimated) == ("2026-10-19T07:05:00Z", None)
+    # Le TransferLeg (à pied) entre les deux courses n'est pas une étape, ni les arrêts intermédiaires
+    assert (second.origin_name, second.line) == ("Genève, gare Cornavin", "12")
+    assert (second.departure_estimated, second.arrival_estimated) == (None, "2026-10-19T07:21:00Z")
+    assert trips[1].legs[0].line == "IC1"
+
+
+def test_iter_trips_gives_same_result_for_any_chunking():
+    data = OJP_TRIP_RESPONSE.read_bytes()
+    assert list(iter_trips(chunked(data, 7))) == load_trips()
+
+
+def use_ojp_transport(monkeypatch, handler):
+    monkeypatch.setattr(ojp_client, "client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(ojp_client, "semaphore", asyncio.Semaphore(1))
+
+
+def test_fetch_trip_parses_streamed_response(monkeypatch):
+    chunks = chunked(OJP_TRIP_RESPONSE.read_bytes(), 512)
+
+    async def body():
+        for chunk in chunks:
+            await asyncio.sleep(0)
+            yield chunk
+
+    use_ojp_transport(monkeypatch, lambda request: httpx.Response(200, content=body()))
+    result = asyncio.run(fetch_trip("<OJP/>"))
+
+    assert result["source"] == "ojp"
+    assert result["trips"] == load_trips()
+    assert len(result["trip_details"]) == 2
+
+
+def test_fetch_trip_reports_http_errors(monkeypatch):
+    use_ojp_transport(monkeypatch, lambda request: httpx.Response(503, text="Service Unavailable"))
+    assert asyncio.run(fetch_trip("<OJP/>")) == {"response": "Error: 503 - Service Unavailable"}
+
+    def refuse(request):
+        raise httpx.ConnectError("connection refused", request=request)
+
+    use_ojp_transport(monkeypatch, refuse)
+    assert asyncio.run(fetch_trip("<OJP/>")) == {"response": "Error: ConnectError - connection refused"}
+
+    use_ojp_transport(monkeypatch, lambda request: httpx.Response(200, content=b"<OJP><unclosed>"))
+    assert asyncio.run(fetch_trip("<OJP/>"))["response"].startswith("Error: ParseError")
+
+
+def test_fetch_trip_times_out_while_streaming_in_fallback_mode(monkeypatch):
+    async def slow_body():
+        yield OJP_TRIP_RESPONSE.read_bytes()[:100]
+        await asyncio.sleep(10)
+        yield b""
+
+    monkeypatch.setattr(journey_planner, "LOCAL_ROUTING", "fallback")
+    monkeypatch.setattr(trip, "OJP_FALLBACK_TIMEOUT", 0.05)
+    use_ojp_transport(monkeypatch, lambda request: httpx.Response(200, content=slow_body()))
+
+    assert asyncio.run(fetch_trip("<OJP/>"))["response"].startswith("Error: TimeoutError")
+
+
+def test_stop_refs_are_read_from_siri_namespace():
+    trips = load_trips()
+    refs = [(leg.origin_stop_ref, leg.destination_stop_ref) for trip in trips for leg in trip.legs]
+    assert refs == [
+        ("8501120", "8501008"),
+        ("8587057", "8587058"),
+        ("ch:1:sloid:1120:3:5", "ch:1:sloid:1008:1:2"),
+    ]
+
+
+def test_realtime_annotation_matches_ojp_legs():
+    index = RealtimeIndex()
+    index.apply([
+        {
+            "trip_id": "1715.TA.91-15-j26-1.1.H",
+            "start_date": "20261019",
+            "stop_time_updates": [
+                {"stop_id": "8501120:0:5", "departure_delay": 240},
+                {"stop_id": "8501008:0:3", "arrival": int(datetime(2026, 10, 19, 7, 7, tzinfo=timezone.utc).timestamp())},
+            ],
+        },
+        {
+            "trip_id": "1419.TA.91-1-j26-1.1.H",
+            "start_date": "20261019",
+            "stop_time_updates": [{"stop_id": "Parent8501008", "arrival_delay": 120}],
+        },
+    ])
+    index.journey_trips["ch:1:sjyid:100001:1715-001"] = "1715.TA.91-15-j26-1.1.H"
+    index.journey_trips["ch:1:sjyid:100001:1419-001"] = "1419.TA.91-1-j26-1.1.H"
+
+    trips, changed = index.annotate(load_trips())
+
+    assert changed
+    first, second = trips[0].legs[0], trips[1].legs[0]
+    assert first.departure_estimated == "2026-10-19T06:34:00Z"
+    assert first.arrival_estimated == "2026-10-19T07:07:00Z"
+    # SLOID de l'étape OJP rapproché de la gare GTFS
+    assert second.arrival_estimated == "2026-10-19T07:23:00Z"
+    # Course sans mise à jour : l'heure estimée fournie par OJP est conservée
+    assert trips[0].legs[1].arrival_estimated == "2026-10-19T07:21:00Z"
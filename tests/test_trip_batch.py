@@ -0,0 +1,115 @@
+import asyncio
+import json
+
+import pytest
+
+from app.api import trip_batch
+from app.api.itinerary import Leg, Trip
+from app.api.trip import TripRequestModel
+from app.api.trip_batch import plan_trips_batch, TripBatchModel
+
+
+STOPS = {"Lausanne": ("8501120", "Lausanne"), "Genève": ("8501008", "Genève"), "Berne": ("8507000", "Bern")}
+
+
+def make_request(origin="Lausanne", destination="Genève", time="08:00:00", date="2026-10-19"):
+    return TripRequestModel(origin_name=origin, destination_name=destination, date=date, time=time, mode="ojp")
+
+
+class FakePlanner:
+    '''
+    Remplace get_resolved_trip_async : compte les calculs et les calculs simultanés
+    '''
+
+    def __init__(self, delay=0.01, fail_for=()):
+        self.delay = delay
+        self.fail_for = set(fail_for)
+        self.calls = []
+        self.running = 0
+        self.max_running = 0
+        self.cancelled = 0
+
+    async def __call__(self, resolved, mode):
+        self.calls.append(resolved)
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        finally:
+            self.running -= 1
+        origin_stop_id, origin_name, _, destination_name, departure, _ = resolved
+        if departure.strftime("%H:%M:%S") in self.fail_for:
+            raise RuntimeError("OJP indisponible")
+        trip = Trip(legs=[Leg(origin_name=origin_name, destination_name=destination_name, departure_time=departure.isoformat())])
+        return {"trips": [trip], "trip_details": [trip.describe(1)], "source": "ojp"}
+
+
+@pytest.fixture
+def planner(monkeypatch):
+    planner = FakePlanner()
+    monkeypatch.setattr(trip_batch, "find_stop_ids", lambda names: {name: STOPS.get(name) for name in names})
+    monkeypatch.setattr(trip_batch, "get_resolved_trip_async", planner)
+    return planner
+
+
+def run_batch(requests, concurrency=None):
+    async def collect():
+        return [json.loads(line) async for line in plan_trips_batch(TripBatchModel(requests=requests, concurrency=concurrency))]
+    return asyncio.run(collect())
+
+
+def test_identical_requests_are_computed_once(planner):
+    lines = run_batch([make_request(), make_request("Lausanne", "Berne"), make_request(), make_request()])
+    assert len(planner.calls) == 2
+    assert sorted(line["index"] for line in lines) == [0, 1, 2, 3]
+    by_index = {line["index"]: line for line in lines}
+    assert by_index[0]["trip_details"] == by_index[2]["trip_details"] == by_index[3]["trip_details"]
+    assert by_index[1]["trips"][0]["legs"][0]["destination_name"] == "Bern"
+
+
+def test_every_index_gets_exactly_one_line(planner):
+    planner.fail_for = {"09:00:00"}
+    requests = [
+        make_request(),
+        make_request("Nulle part", "Genève"),
+        make_request(time="25:99:00"),
+        make_request(time="09:00:00"),
+        make_request(time="09:00:00"),
+        make_request("Lausanne", "Berne"),
+    ]
+    lines = run_batch(requests)
+
+    assert sorted(line["index"] for line in lines) == list(range(len(requests)))
+    by_index = {line["index"]: line for line in lines}
+    assert by_index[1] == {"index": 1, "error": "Stop 'Nulle part' not found"}
+    assert by_index[2]["error"].startswith("Invalid date or time")
+    assert by_index[3]["error"] == by_index[4]["error"] == "Error: RuntimeError - OJP indisponible"
+    assert "trips" in by_index[0] and "trips" in by_index[5]
+
+
+def test_worker_count_stays_within_concurrency(planner):
+    requests = [make_request(time=f"{hour:02d}:{minute:02d}:00") for hour in range(6, 10) for minute in range(0, 60, 10)]
+    lines = run_batch(requests, concurrency=3)
+    assert len(lines) == len(requests) == len(planner.calls)
+    assert planner.max_running == 3
+
+
+def test_workers_are_cancelled_on_disconnect(planner):
+    planner.delay = 0.05
+    requests = [make_request(time=f"08:{minute:02d}:00") for minute in range(20)]
+
+    async def disconnect_after_first_line():
+        lines = plan_trips_batch(TripBatchModel(requests=requests, concurrency=4))
+        first = await lines.__anext__()
+        await lines.aclose()
+        # Laisser les tâches annulées se terminer
+        await asyncio.sleep(0.01)
+        return first
+
+    assert "trips" in json.loads(asyncio.run(disconnect_after_first_line()))
+    assert planner.running == 0
+    assert planner.cancelled >= 1
+    assert len(planner.calls) < len(requests)
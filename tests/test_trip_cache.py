@@ -0,0 +1,129 @@
+import asyncio
+import time
+
+from datetime import datetime, timezone
+
+import pytest
+
+from app.api.trip_cache import TripCache
+
+
+def make_cache(**kwargs):
+    return TripCache(**{"max_size": 10, "ttl": 60, "bucket_seconds": 300, **kwargs})
+
+
+def test_make_key_buckets_departure_times():
+    cache = make_cache()
+    key = cache.make_key("A", "B", datetime(2026, 10, 19, 8, 1, tzinfo=timezone.utc), "default")
+    assert key == cache.make_key("A", "B", datetime(2026, 10, 19, 8, 4, tzinfo=timezone.utc), "default")
+    assert key != cache.make_key("A", "B", datetime(2026, 10, 19, 8, 6, tzinfo=timezone.utc), "default")
+
+
+def test_lru_eviction_and_expiry(monkeypatch):
+    cache = make_cache(max_size=2)
+    cache.put("a", {"value": 1})
+    cache.put("b", {"value": 2})
+    cache.get("a")
+    cache.put("c", {"value": 3})
+    assert cache.get("b") is None
+    assert cache.get("a") == {"value": 1}
+    assert cache.evictions == 1
+
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 61)
+    assert cache.get("a") is None
+
+
+def test_identical_requests_share_one_fetch():
+    cache = make_cache()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"trips": [1]}
+
+    async def main():
+        return await asyncio.gather(*(cache.get_or_fetch("key", fetch) for _ in range(5)))
+
+    results = asyncio.run(main())
+    assert results == [{"trips": [1]}] * 5
+    assert len(calls) == 1
+    assert (cache.misses, cache.coalesced) == (1, 4)
+    assert cache.in_flight == {}
+
+    assert asyncio.run(cache.get_or_fetch("key", fetch)) == {"trips": [1]}
+    assert cache.hits == 1 and len(calls) == 1
+
+
+def test_uncacheable_results_are_not_stored():
+    cache = make_cache()
+
+    async def fetch():
+        return {"response": "Error: 500"}
+
+    asyncio.run(cache.get_or_fetch("key", fetch, cacheable=lambda result: "trips" in result))
+    assert cache.get("key") is None
+
+
+def test_cancelled_request_does_not_cancel_other_waiters():
+    cache = make_cache()
+    started = []
+
+    async def fetch():
+        started.append(1)
+        await asyncio.sleep(0.05)
+        return {"trips": [1]}
+
+    async def main():
+        first = asyncio.create_task(cache.get_or_fetch("key", fetch))
+        second = asyncio.create_task(cache.get_or_fetch("key", fetch))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(main()) == {"trips": [1]}
+    assert len(started) == 1
+    assert cache.get("key") == {"trips": [1]}
+
+
+def test_fetch_is_cancelled_when_no_request_waits_anymore():
+    cache = make_cache()
+    cancelled = []
+
+    async def fetch():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+
+    async def main():
+        request = asyncio.create_task(cache.get_or_fetch("key", fetch))
+        await asyncio.sleep(0.01)
+        request.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await request
+        await asyncio.sleep(0.01)
+
+    asyncio.run(main())
+    assert cancelled == [1]
+    assert cache.in_flight == {}
+
+
+def test_fetch_errors_reach_every_waiter_and_are_not_cached():
+    cache = make_cache()
+
+    async def fetch():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("OJP indisponible")
+
+    async def main():
+        return await asyncio.gather(*(cache.get_or_fetch("key", fetch) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert cache.in_flight == {}
+    assert cache.get("key") is None